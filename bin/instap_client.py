@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Tiny client for the instaporter server ("instaporter serve").
+
+Only uses the standard library, so it starts in a fraction of the time it takes
+to start instaporter itself. Usage:
+    instap_client.py http://www.nature.com/nature/journal/v459/n7243/full/nature07971.html
+    instap_client.py --wait url1 url2
+    instap_client.py --file article.html
+    instap_client.py --status
+    instap_client.py --socket ~/.instaporter.sock url
+
+Exits with status 2 if the server is not running (so scripts can fall back to instap.py).
+Requests are authenticated with the token the server writes to ~/.cache/instaporter/serve_token
+(use --token_file if the server was started with a different serve_token_filepath).
+"""
+
+import os
+import sys
+import json
+import socket
+import argparse
+import http.client
+
+
+DEFAULT_PORT = 7270
+DEFAULT_TOKEN_FILEPATH = "~/.cache/instaporter/serve_token"
+TOKEN_HEADER = 'X-Instaporter-Token'
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """ HTTPConnection over a unix socket. """
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+def read_token(filepath=DEFAULT_TOKEN_FILEPATH):
+    """ Read the server token from filepath. Returns None if the file does not exist. """
+    try:
+        with open(os.path.expanduser(filepath)) as fd:
+            return fd.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def request(method, path, data=None, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None, timeout=None,
+            token=None):
+    """ Make request to server. Returns (status, data). Raises OSError if the server is not running. """
+    if socket_path:
+        conn = UnixHTTPConnection(os.path.expanduser(socket_path), timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    body = json.dumps(data).encode('utf-8') if data is not None else None
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    if token:
+        headers[TOKEN_HEADER] = token
+    try:
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        return response.status, json.loads(response.read().decode('utf-8'))
+    finally:
+        conn.close()
+
+
+def main(argv=None):
+    """ Client main function. """
+    parser = argparse.ArgumentParser(description="Submit urls or files to a running instaporter server.")
+    parser.add_argument('items', nargs='*', help="Urls (or files, with --file) to transport to Instapaper.")
+    parser.add_argument('--file', action='store_true', help="Items are html files, not urls.")
+    parser.add_argument('--wait', action='store_true', help="Wait for the job to finish.")
+    parser.add_argument('--status', action='store_true', help="Print server status.")
+    parser.add_argument('--shutdown', action='store_true', help="Stop the server.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--socket', help="Connect to server on this unix socket.")
+    parser.add_argument('--token_file', default=DEFAULT_TOKEN_FILEPATH, help="File with the server token.")
+    args = parser.parse_args(argv)
+    kwargs = {'host': args.host, 'port': args.port, 'socket_path': args.socket, 'token': read_token(args.token_file)}
+    try:
+        if args.status:
+            status, data = request('GET', '/status', **kwargs)
+        elif args.shutdown:
+            status, data = request('POST', '/shutdown', {}, **kwargs)
+        elif args.items:
+            if args.file:
+                payload = {'files': [os.path.abspath(item) for item in args.items], 'wait': args.wait}
+                status, data = request('POST', '/file', payload, **kwargs)
+            else:
+                status, data = request('POST', '/url', {'urls': args.items, 'wait': args.wait}, **kwargs)
+        else:
+            parser.print_help()
+            return 1
+    except OSError as e:
+        print("Could not connect to instaporter server (%s). Start it with: instap.py serve" % e)
+        return 2
+    print(json.dumps(data, indent=2))
+    return 0 if status < 400 and data.get('status') != 'error' else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
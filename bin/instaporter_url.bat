@@ -9,8 +9,10 @@ REM instap.py just imports the instaporter.instaporter module and executes the m
 REM You can add cmdline args (or config params) here:
 REM python %~dp0\instap.py url %1
 
-REM Start with loglevel:
-python %~dp0\instap.py --loglevel INFO url %1
+REM If the instaporter server is running ("instap.py serve"), just hand it the url.
+REM instap_client.py exits with errorlevel 2 if the server is not running; then start instaporter:
+python %~dp0\instap_client.py --wait %1
+IF ERRORLEVEL 2 python %~dp0\instap.py --loglevel INFO url %1
 
 
 REM TEST INVOCATIONS:
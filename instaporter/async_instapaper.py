@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0902,R0904,R0913
+
+"""
+
+Asyncio version of the Instapaper client.
+
+AsyncInstapaperClient has the same methods as instapaper.InstapaperClient,
+but all methods that talk to the server are coroutines. Requests are made
+with aiohttp, using a single connection pool for all requests, and are signed
+with oauth_signer.HmacSha1Signer (HMAC-SHA1, OAuth parameters in the Authorization: header),
+just like XAuthSession does. This makes it possible to have thousands of
+API calls in flight from a single event loop:
+
+    async with AsyncInstapaperClient(consumer_key, consumer_secret, access_tokens=tokens) as client:
+        results = await asyncio.gather(*[client.archive_bookmark(bid) for bid in bookmark_ids])
+
+Requires the aiohttp library.
+
+"""
+
+import json
+from urllib.parse import urljoin, urlencode, parse_qsl
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+    logger.debug("aiohttp not available; AsyncInstapaperClient cannot be used.")
+
+from .instapaper import is_error, response_json, ensure_string, __version__
+from .models import from_json
+from .oauth_signer import HmacSha1Signer
+
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+class AsyncResponse(object):
+    """
+    Minimal, fully-read response object with the parts of the
+    requests.Response interface used by is_error() and the client methods.
+    """
+
+    def __init__(self, status_code, content, url=None, encoding='utf-8'):
+        self.status_code = status_code
+        self.content = content
+        self.url = url
+        self.encoding = encoding or 'utf-8'
+
+    @property
+    def ok(self):
+        """ True if status code is less than 400 (same as requests). """
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        """ Response content decoded as text. """
+        return self.content.decode(self.encoding, errors='replace')
+
+    def json(self):
+        """ Parse response content as json. Raises ValueError if the content is not valid json. """
+        return json.loads(self.text)
+
+    def __repr__(self):
+        return "<AsyncResponse [%s]>" % self.status_code
+
+
+class AsyncInstapaperClient(object):
+    """
+    Asyncio-native Instapaper client.
+    Use as an async context manager, or remember to await client.close() when done.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, access_tokens=None, apiurl=None,
+                 headers=None, limit=100, session=None, typed_responses=True):
+        """
+        Args:
+            consumer_key, consumer_secret: Instapaper client/consumer API key and secret.
+            access_tokens: dict with oauth_token and oauth_token_secret (as saved in the config).
+            apiurl: Base api url, defaults to 'https://www.instapaper.com/api/1.1/'
+            headers: Extra headers to send with every request.
+            limit: Max number of simultaneous connections in the connection pool.
+            session: Use this aiohttp.ClientSession instead of creating a new one.
+            typed_responses: Return typed objects (see models.from_json) instead of plain json data,
+                like InstapaperClient does (unless its typed_responses config parameter is False).
+        """
+        if aiohttp is None:
+            raise ImportError("AsyncInstapaperClient requires the aiohttp library.")
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.access_tokens = access_tokens or {}
+        self.apiurl = apiurl or 'https://www.instapaper.com/api/1.1/'
+        self.headers = {"User-Agent": "Instaporter-InstaClient/%s github.com/scholer/Instaporter - rasmusscholer@gmail.com" % __version__}
+        if headers:
+            self.headers.update(headers)
+        self.limit = limit
+        self._session = session
+        self.status = False
+        self.parse_json = True
+        self.typed_responses = typed_responses
+        self.username = None
+        self._signer = None
+
+    @property
+    def session(self):
+        """ Shared aiohttp session (connection pool), created on first use. """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit)
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self._session
+
+    async def close(self):
+        """ Close the connection pool. """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def get_resource_url(self, resource):
+        """ Get absolute url for a named resource. """
+        return urljoin(self.apiurl, resource)
+
+    def sign(self, url, body=None):
+        """
+        Sign POST request to url with form-encoded body.
+        Returns the signed headers.
+        """
+        tokens = (self.access_tokens.get('oauth_token'), self.access_tokens.get('oauth_token_secret'))
+        # The signer precomputes the signing key, so only create a new one when the tokens change:
+        if self._signer is None or self._signer[0] != tokens:
+            self._signer = (tokens, HmacSha1Signer(self.consumer_key, self.consumer_secret, *tokens))
+        headers = {'Content-Type': FORM_CONTENT_TYPE} if body else {}
+        headers['Authorization'] = self._signer[1].sign('POST', url, body or None)
+        return headers
+
+    async def post(self, endpoint, data=None):
+        """
+        Post data to REST endpoint.
+        Instapaper specifies that parameters are never sent in the query string.
+        Returns an AsyncResponse.
+        """
+        url = self.get_resource_url(endpoint)
+        body = urlencode(data) if data else ''
+        headers = self.sign(url, body)
+        async with self.session.post(url, data=body.encode('utf-8'), headers=headers) as r:
+            content = await r.read()
+            return AsyncResponse(r.status, content, url=str(r.url), encoding=r.charset)
+
+    def check_response(self, response, json=None):
+        """
+        Check whether response is ok and return the response's
+        parsed json data (or the response object, if json=False).
+        Like InstapaperClient.check_response, the json is only parsed once and returned
+        as typed objects, unless typed_responses is False.
+        """
+        if json is None:
+            json = self.parse_json
+        err = is_error(response)
+        if err:
+            logger.info("Response status_code: %s, text: %s", response.status_code, response.text[0:1000])
+            self.status = False
+        else:
+            self.status = True
+        if json:
+            data = response_json(response)
+            return from_json(data) if self.typed_responses else data
+        else:
+            return response
+
+
+    async def login(self, username, password=''):
+        """
+        Log in with username and your optional password, using xAuth.
+        Returns the access tokens on success, False otherwise.
+        """
+        self.access_tokens = {}
+        r = await self.post('oauth/access_token', data={'x_auth_username': username,
+                                                        'x_auth_password': password,
+                                                        'x_auth_mode': 'client_auth'})
+        logger.debug("Access token request returned %s", r)
+        tokens = dict(parse_qsl(r.text))
+        if not tokens:
+            return False
+        self.access_tokens = tokens
+        userinfo = await self.verify_credentials()
+        if not userinfo:
+            return False
+        return tokens
+
+    async def verify_credentials(self):
+        """ Returns the currently logged in user, or False. """
+        r = await self.post('account/verify_credentials')
+        try:
+            userinfo = response_json(r)
+            self.status = userinfo[0]["type"] == 'user' and 'username' in userinfo[0]
+            self.username = userinfo[0]["username"]
+        except (ValueError, IndexError, KeyError, TypeError):
+            print("Userinfo did not produce expected result:", r.text)
+            return False
+        return from_json(userinfo) if self.typed_responses else userinfo
+
+
+    ########################
+    ##  Bookmark methods  ##
+    ########################
+
+    async def list_bookmarks(self, limit=25, folder_id=None, have=None, highlights=None):
+        """ List bookmarks. See InstapaperClient.list_bookmarks. """
+        have = ensure_string(have)
+        highlights = ensure_string(highlights)
+        data = {'limit': limit, 'folder_id': folder_id, 'have': have, 'highlights': highlights}
+        data = {k: v for k, v in data.items() if v is not None}
+        r = await self.post('bookmarks/list', data=data)
+        return self.check_response(r)
+
+    async def add_bookmark(self, url=None, title=None, description=None, folder_id=None,
+                           resolve_final_url=1, content=None, is_private_from_source=None):
+        """ Add a bookmark. See InstapaperClient.add_bookmark. """
+        if url is None and not is_private_from_source:
+            raise ValueError("No url privided; url must be given for non-private sources.")
+        data = {'url': url, 'title': title, 'description': description,
+                'folder_id': folder_id, 'resolve_final_url': resolve_final_url,
+                'content': content, 'is_private_from_source': is_private_from_source}
+        data = {k: v for k, v in data.items() if v is not None}
+        r = await self.post('bookmarks/add', data=data)
+        return self.check_response(r)
+
+    async def delete_bookmark(self, bookmark_id):
+        """ Delete bookmark by id. """
+        logger.info("Deleting bookmark with id: %s", bookmark_id)
+        r = await self.post('bookmarks/delete', data={'bookmark_id': bookmark_id})
+        ret = self.check_response(r)
+        if ret == []:
+            logger.debug("Bookmark successfully deleted: %s", bookmark_id)
+        else:
+            logger.info("Bookmark deletion (%s) did not succeed: %s", bookmark_id, ret)
+        return ret
+
+    async def star_bookmark(self, bookmark_id):
+        """ Star bookmark by id. """
+        r = await self.post('bookmarks/star', data={'bookmark_id': bookmark_id})
+        return self.check_response(r)
+
+    async def archive_bookmark(self, bookmark_id):
+        """ Archive bookmark by id. """
+        r = await self.post('bookmarks/archive', data={'bookmark_id': bookmark_id})
+        return self.check_response(r)
+
+    async def unarchive_bookmark(self, bookmark_id):
+        """ Un-archive bookmark by id. """
+        r = await self.post('bookmarks/unarchive', data={'bookmark_id': bookmark_id})
+        return self.check_response(r)
+
+    async def move_bookmark(self, bookmark_id, folder_id):
+        """ Move bookmark with bookmark_id to folder with folder_id. """
+        r = await self.post('bookmarks/move', data={'bookmark_id': bookmark_id, 'folder_id': folder_id})
+        return self.check_response(r)
+
+    async def get_bookmark_text(self, bookmark_id):
+        """ Get text for bookmark with bookmark_id. """
+        r = await self.post('bookmarks/get_text', data={'bookmark_id': bookmark_id})
+        # Returns HTML, not JSON:
+        self.status = r.ok
+        return r.text
+
+
+    ######################
+    ##  Folder methods  ##
+    ######################
+
+    async def list_folders(self):
+        """ List all folders. """
+        r = await self.post('folders/list')
+        return self.check_response(r)
+
+    async def add_folder(self, title):
+        """ Add folder with title <title> """
+        r = await self.post('folders/add', data={'title': title})
+        return self.check_response(r)
+
+    async def delete_folder(self, folder_id):
+        """ Delete folder with folder_id """
+        r = await self.post('folders/delete', data={'folder_id': folder_id})
+        return self.check_response(r)
+
+    async def set_folder_order(self, order):
+        """ Set the sort order of folders. """
+        r = await self.post('folders/set_order', data={'order': order})
+        return self.check_response(r)
+
+
+    #########################
+    ##  Highlight methods  ##
+    #########################
+
+    async def bookmark_highlights(self, bookmark_id):
+        """ Return highlights for bookmark with id <bookmark_id> """
+        r = await self.post('bookmarks/%d/highlights' % bookmark_id)
+        return self.check_response(r)
+
+    async def bookmark_highlight(self, bookmark_id, text, position):
+        """
+        Create highlight for bookmark with id <bookmark_id>,
+        adding text at position.
+        """
+        r = await self.post('bookmarks/%d/highlight' % bookmark_id,
+                            data={'text': text, 'position': position})
+        return self.check_response(r)
+
+    async def delete_highlight(self, highlight_id):
+        """ Delete highlight with id <highlight_id> """
+        r = await self.post('highlights/%d/delete' % highlight_id)
+        return self.check_response(r)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Bulk bookmark operations: archive, unarchive, star, unstar, move or delete many bookmarks.
+
+The Instapaper API has no bulk endpoints; each bookmark is one request. bulk_apply runs the requests
+with a bounded pool of worker threads. The client's rate limiter, concurrency controller and
+retries apply to every request (see InstapaperClient.post), so a large cleanup runs as fast as
+the API allows without being throttled.
+
+* Results are streamed: iter_bulk yields a BulkResult for each bookmark as soon as its request
+  has completed, and only a bounded number of requests are queued at any time, so bookmark_ids
+  may be a generator (e.g. InstapaperClient.iter_bookmarks for a folder).
+* bulk_apply collects the results in a BulkReport with the succeeded and failed bookmarks.
+  Failed bookmarks are retried (up to <retries> more rounds) without repeating the ones that
+  succeeded. A report can be saved and passed to a later bulk_apply, which then skips the
+  bookmarks that already succeeded.
+
+Usage:
+    report = bulk_apply(client, 'archive', client.iter_bookmarks('unread'), workers=8)
+    report = bulk_apply(client, 'move', [123, 456], folder_id=789)
+    print(report.summary())
+
+"""
+
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+import logging
+logger = logging.getLogger(__name__)
+
+from .instapaper import is_error, response_json
+from .state_store import atomic_write
+
+
+# Operation -> API endpoint (all take a bookmark_id; move also takes a folder_id):
+OPERATIONS = {
+    'archive': 'bookmarks/archive',
+    'unarchive': 'bookmarks/unarchive',
+    'star': 'bookmarks/star',
+    'unstar': 'bookmarks/unstar',
+    'move': 'bookmarks/move',
+    'delete': 'bookmarks/delete',
+}
+
+
+class BulkResult(object):
+    """ Result of an operation on one bookmark. """
+
+    __slots__ = ('bookmark_id', 'ok', 'error')
+
+    def __init__(self, bookmark_id, ok, error=None):
+        self.bookmark_id = bookmark_id
+        self.ok = ok
+        self.error = error
+
+    def __repr__(self):
+        return "BulkResult(%r, %r, %r)" % (self.bookmark_id, self.ok, self.error)
+
+
+class BulkReport(object):
+    """ Aggregate result of a bulk operation: succeeded bookmark ids and failed ids with their errors. """
+
+    def __init__(self, op, folder_id=None):
+        self.op = op
+        self.folder_id = folder_id
+        self.succeeded = []
+        self.failed = {}
+        self.rounds = 0
+        self.elapsed = 0.0
+
+    def add(self, result):
+        """ Add BulkResult to the report. """
+        if result.ok:
+            self.succeeded.append(result.bookmark_id)
+            self.failed.pop(result.bookmark_id, None)
+        else:
+            self.failed[result.bookmark_id] = result.error
+
+    def done(self):
+        """ Return set of bookmark ids which have succeeded. """
+        return set(self.succeeded)
+
+    def summary(self):
+        """ Return one-line summary of the report. """
+        return "%s: %s succeeded, %s failed (%s rounds, %.1f s)." % (
+            self.op, len(self.succeeded), len(self.failed), self.rounds, self.elapsed)
+
+    def to_dict(self):
+        """ Return report as json-serializable dict. """
+        return {'op': self.op, 'folder_id': self.folder_id, 'succeeded': self.succeeded,
+                'failed': [[bid, error] for bid, error in self.failed.items()],
+                'rounds': self.rounds, 'elapsed': self.elapsed}
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Return report from dict (as returned by to_dict). """
+        report = cls(data['op'], data.get('folder_id'))
+        report.succeeded = list(data.get('succeeded', []))
+        report.failed = {bid: error for bid, error in data.get('failed', [])}
+        report.rounds = data.get('rounds', 0)
+        report.elapsed = data.get('elapsed', 0.0)
+        return report
+
+    def save(self, filepath):
+        """ Write report to json file (atomically). """
+        atomic_write(os.path.expanduser(filepath), json.dumps(self.to_dict()))
+
+    @classmethod
+    def load(cls, filepath):
+        """ Load report from json file. """
+        with open(os.path.expanduser(filepath)) as fd:
+            return cls.from_dict(json.load(fd))
+
+
+def apply_one(client, op, bookmark_id, folder_id=None):
+    """ Apply op to one bookmark. Returns BulkResult. """
+    data = {'bookmark_id': bookmark_id}
+    if op == 'move':
+        data['folder_id'] = folder_id
+    try:
+        r = client.post(OPERATIONS[op], data=data)
+    except requests.exceptions.RequestException as e:
+        return BulkResult(bookmark_id, False, "%s: %s" % (type(e).__name__, e))
+    code = is_error(r)
+    if not code:
+        return BulkResult(bookmark_id, True)
+    # Report the API error code (e.g. 1241, invalid bookmark) rather than the http status, if given:
+    try:
+        error = response_json(r)[0]
+        code, message = error.get('error_code') or code, error.get('message')
+    except (ValueError, IndexError, KeyError, TypeError, AttributeError):
+        message = r.text[:200]
+    return BulkResult(bookmark_id, False, "%s: %s" % (code, message))
+
+
+def iter_bulk(client, op, bookmark_ids, folder_id=None, workers=8):
+    """
+    Apply op to bookmarks with <workers> worker threads, yielding a BulkResult per bookmark as
+    the requests complete (not in the order of bookmark_ids). bookmark_ids may be bookmark objects
+    (or dicts) and may be a generator; at most 2*workers requests are queued at a time.
+    """
+    if op not in OPERATIONS:
+        raise ValueError("Unknown bulk operation %r (must be one of %s)." % (op, ", ".join(sorted(OPERATIONS))))
+    if op == 'move' and folder_id is None:
+        raise ValueError("The move operation requires a folder_id.")
+    workers = max(1, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for bookmark_id in bookmark_ids:
+            if not isinstance(bookmark_id, (int, str)):
+                bookmark_id = bookmark_id['bookmark_id']
+            pending.add(executor.submit(apply_one, client, op, int(bookmark_id), folder_id))
+            if len(pending) >= 2 * workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def bulk_apply(client, op, bookmark_ids, folder_id=None, workers=8, retries=1, report=None, progress=None):
+    """
+    Apply op (archive, unarchive, star, unstar, move or delete) to bookmarks.
+    Args:
+        client: InstapaperClient.
+        bookmark_ids: Iterable of bookmark ids (or bookmark objects).
+        folder_id: Folder to move the bookmarks to (move only).
+        workers: Number of concurrent requests (the client's api_rate and api_max_concurrency also apply).
+        retries: Number of extra rounds for the bookmarks that failed.
+        report: BulkReport from an earlier run of the same operation (and folder_id); bookmarks that
+            succeeded are skipped, and the results are added to this report.
+        progress: Function called as progress(result, n_done, n_failed) after each bookmark.
+    Returns BulkReport.
+    """
+    if report is None:
+        report = BulkReport(op, folder_id)
+    elif report.op != op:
+        raise ValueError("Report is for %r, not %r." % (report.op, op))
+    elif (report.folder_id is None) != (folder_id is None) or str(report.folder_id) != str(folder_id):
+        # Folder ids may be int or str (e.g. from the command line or a saved report):
+        raise ValueError("Report is for folder_id %r, not %r." % (report.folder_id, folder_id))
+    skip = report.done()
+    counts = {'done': 0, 'failed': 0}
+    start = time.time()
+
+    def run(ids):
+        """ Run one round over ids (the results are yielded in this thread). """
+        for result in iter_bulk(client, op, ids, folder_id=folder_id, workers=workers):
+            report.add(result)
+            counts['done' if result.ok else 'failed'] += 1
+            if not result.ok:
+                logger.info("%s of bookmark %s failed: %s", op, result.bookmark_id, result.error)
+            if progress is not None:
+                progress(result, counts['done'], counts['failed'])
+
+    def todo():
+        """ Bookmark ids of the first round, skipping those already done (and failed, which are added after). """
+        retry = set(report.failed)
+        for bookmark_id in bookmark_ids:
+            if not isinstance(bookmark_id, (int, str)):
+                bookmark_id = bookmark_id['bookmark_id']
+            bookmark_id = int(bookmark_id)
+            if bookmark_id not in skip and bookmark_id not in retry:
+                yield bookmark_id
+        for bookmark_id in retry:
+            yield bookmark_id
+
+    run(todo())
+    report.rounds += 1
+    for _ in range(retries):
+        if not report.failed:
+            break
+        logger.info("Retrying %s failed %s operations...", len(report.failed), op)
+        counts['failed'] -= len(report.failed)
+        run(list(report.failed))
+        report.rounds += 1
+    report.elapsed += time.time() - start
+    logger.info(report.summary())
+    return report
@@ -42,17 +42,13 @@ app.processEvents() # Is required to avoid hanging...
 from __future__ import print_function
 from six import string_types # python 2*3 compatability
 import os
-import sys
 import logging
 logger = logging.getLogger(__name__)
 
+# Available clipboard libraries; populated by find_backend() on first use,
+# so importing this module does not import Tk, gtk, etc.
 libs = set()
-
-try:
-    from Tkinter import Tk
-    libs.add('tk')
-except ImportError:
-    from tkinter import Tk
+_backend = []
 
 try:
     TEST = unicode("test")
@@ -61,43 +57,49 @@ except NameError:
     def unicode(s):
         """ Ensure string is unicode. """
         return u""+s
-## Clipboard in GTK:
-try:
+
+
+def _import_gtk():
+    """ Clipboard in GTK. Will fail on Windows/Mac. """
     import pygtk
     pygtk.require('2.0')
     import gtk # gtk provides clipboard access:
     # clipboard = gtk.clipboard_get()
     # text = clipboard.wait_for_text()
-    libs.add('gtk')
-except ImportError:
-    # Will happen on Windows/Mac:
-    pass
+    return gtk
 
-## win32clipboard:
-try:
-    import win32clipboard
-    #print "win32clipboard is available."
-    libs.add('win32clipboard')
-except ImportError:
-    pass
 
-## pyperclip:
-try:
-    import pyperclip
-    #print "pyperclip is available."
-    libs.add('pyperclip')
-except ImportError:
-    # check for import with
-    # globals(), locals(), vars() or sys.modules.keys()
-    #>>> if 'pyperclip' in sys.modules.keys()
-    pass
-
-## xerox:
-try:
-    import xerox
-    libs.add('xerox')
-except ImportError:
-    pass
+def _import_tk():
+    """ Tk is always available (as fallback). """
+    try:
+        from Tkinter import Tk
+    except ImportError:
+        from tkinter import Tk
+    return Tk
+
+
+def find_backend():
+    """
+    Find clipboard library to use, in order of preference: xerox, pyperclip, gtk, win32clipboard, tk.
+    Returns (name, module). The result is cached, so the libraries are only probed once.
+    """
+    if _backend:
+        return _backend[0]
+    importers = [('xerox', lambda: __import__('xerox')),
+                 ('pyperclip', lambda: __import__('pyperclip')),
+                 ('gtk', _import_gtk),
+                 ('win32clipboard', lambda: __import__('win32clipboard'))]
+    for name, importer in importers:
+        try:
+            module = importer()
+        except ImportError:
+            continue
+        libs.add(name)
+        _backend.append((name, module))
+        return _backend[0]
+    _backend.append(('tk', _import_tk()))
+    libs.add('tk')
+    return _backend[0]
 
 
 def set_clipboard(text, datatype=None):
@@ -106,15 +108,14 @@ def set_clipboard(text, datatype=None):
     For now, this is generally assumed to be unicode text.
     From http://stackoverflow.com/questions/579687/how-do-i-copy-a-string-to-the-clipboard-on-windows-using-python
     """
-    if 'xerox' in sys.modules.keys():
-        xerox.copy(text)
-    elif 'pyperclip' in sys.modules.keys():
-        pyperclip.copy(text)
-    elif 'gtk' in sys.modules.keys():
-        clipboard = gtk.clipboard_get()
+    name, lib = find_backend()
+    if name in ('xerox', 'pyperclip'):
+        lib.copy(text)
+    elif name == 'gtk':
+        clipboard = lib.clipboard_get()
         text = clipboard.set_text(text)
-    elif 'win32clipboard' in sys.modules.keys():
-        wcb = win32clipboard
+    elif name == 'win32clipboard':
+        wcb = lib
         wcb.OpenClipboard()
         wcb.EmptyClipboard()
         # wcb.SetClipboardText(text)  # doesn't work
@@ -125,7 +126,7 @@ def set_clipboard(text, datatype=None):
         wcb.CloseClipboard() # User cannot use clipboard until it is closed.
     else:
         # If code is run from within e.g. an ipython qt console, invoking Tk root's mainloop() may hang the console.
-        tkroot = Tk()
+        tkroot = lib()
         # r.withdraw()
         tkroot.clipboard_clear()
         tkroot.clipboard_append(text)
@@ -136,18 +137,16 @@ def get_clipboard():
     """
     Get content of OS clipboard.
     """
-    if 'xerox' in sys.modules.keys():
-        print("Returning clipboard content using xerox...")
-        return xerox.paste()
-    elif 'pyperclip' in sys.modules.keys():
-        print("Returning clipboard content using pyperclip...")
-        return pyperclip.paste()
-    elif 'gtk' in sys.modules.keys():
+    name, lib = find_backend()
+    if name in ('xerox', 'pyperclip'):
+        print("Returning clipboard content using %s..." % name)
+        return lib.paste()
+    elif name == 'gtk':
         print("Returning clipboard content using gtk...")
-        clipboard = gtk.clipboard_get()
+        clipboard = lib.clipboard_get()
         return clipboard.wait_for_text()
-    elif 'win32clipboard' in sys.modules.keys():
-        wcb = win32clipboard
+    elif name == 'win32clipboard':
+        wcb = lib
         wcb.OpenClipboard()
         try:
             data = wcb.GetClipboardData(wcb.CF_TEXT)
@@ -157,10 +156,9 @@ def get_clipboard():
         wcb.CloseClipboard() # User cannot use clipboard until it is closed.
         return data
     else:
-        #print("sys.modules.keys() is: ", sys.modules.keys())
         print("Neither of win32clipboard, gtk, pyperclip, or xerox available.")
         print("- Falling back to Tk...")
-        tkroot = Tk()
+        tkroot = lib()
         tkroot.withdraw()
         result = tkroot.selection_get(selection="CLIPBOARD")
         tkroot.destroy()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+On-disk cache for DOI metadata (CSL JSON from dx.doi.org).
+
+Entries are keyed by the normalized, lower-cased DOI (DOIs are case-insensitive).
+Successful lookups are kept for <ttl> seconds. Failed lookups (e.g. 404 for an unknown DOI)
+are stored as negative entries and kept for <negative_ttl> seconds, so a bad DOI is not
+queried again on every run.
+
+html_utils.get_doi_data uses the default cache, see get_doi_cache() and set_doi_cache().
+
+Usage:
+    cache = DoiCache("~/.cache/instaporter/doi.sqlite", ttl=30*86400)
+    found, data = cache.get("10.1038/nature07971")
+    if not found:
+        cache.put("10.1038/nature07971", data)   # data=None stores a negative entry.
+
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dois (
+    doi TEXT PRIMARY KEY,
+    timestamp REAL NOT NULL,
+    data TEXT
+);
+"""
+
+DEFAULT_TTL = 30*86400
+DEFAULT_NEGATIVE_TTL = 86400
+
+
+def doi_key(doi):
+    """ Return cache key for doi. """
+    return doi.strip().lower()
+
+
+class DoiCache(object):
+    """
+    SQLite cache of DOI metadata, with TTL and negative entries.
+    Can be used from several threads.
+    """
+
+    def __init__(self, filepath=None, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL):
+        """
+        Args:
+            filepath: Path to the SQLite database file. Defaults to ~/.cache/instaporter/doi.sqlite
+            ttl: Number of seconds to keep DOI data.
+            negative_ttl: Number of seconds to keep failed lookups.
+        """
+        if filepath is None:
+            filepath = "~/.cache/instaporter/doi.sqlite"
+        if filepath != ':memory:':
+            filepath = os.path.expanduser(filepath)
+            dirname = os.path.dirname(filepath)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        self.filepath = filepath
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(filepath, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """ Close database connection. """
+        with self._lock:
+            self.db.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM dois").fetchone()[0]
+
+    def get(self, doi):
+        """
+        Look up doi in the cache.
+        Returns (found, data) tuple: found is False if the doi is not cached (or the entry
+        has expired), and data is None for negative entries.
+        """
+        with self._lock:
+            row = self.db.execute("SELECT timestamp, data FROM dois WHERE doi = ?", (doi_key(doi),)).fetchone()
+            if row is not None:
+                ttl = self.ttl if row[1] is not None else self.negative_ttl
+                if time.time() - row[0] >= ttl:
+                    row = None
+            if row is None:
+                self.misses += 1
+                return False, None
+            if row[1] is None:
+                self.negative_hits += 1
+                return True, None
+            self.hits += 1
+        return True, json.loads(row[1])
+
+    def put(self, doi, data):
+        """ Store data for doi. data=None stores a negative entry (failed lookup). """
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO dois (doi, timestamp, data) VALUES (?, ?, ?)",
+                            (doi_key(doi), time.time(), None if data is None else json.dumps(data)))
+
+    def delete(self, doi):
+        """ Remove doi from the cache. """
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM dois WHERE doi = ?", (doi_key(doi),))
+
+    def purge(self):
+        """ Remove all expired entries. Returns number of removed entries. """
+        now = time.time()
+        with self._lock, self.db:
+            cursor = self.db.execute("DELETE FROM dois WHERE (data IS NOT NULL AND timestamp < ?) "
+                                     "OR (data IS NULL AND timestamp < ?)",
+                                     (now - self.ttl, now - self.negative_ttl))
+        return cursor.rowcount
+
+    def stats(self):
+        """ Return dict with hit/miss statistics. """
+        return {'hits': self.hits, 'negative_hits': self.negative_hits, 'misses': self.misses}
+
+
+# The default cache, used by html_utils.get_doi_data. Created on first use.
+_default_cache = []
+
+
+def get_doi_cache():
+    """ Return the default DoiCache (None if caching has been disabled with set_doi_cache(None)). """
+    if not _default_cache:
+        _default_cache.append(DoiCache())
+    return _default_cache[0]
+
+
+def set_doi_cache(cache):
+    """ Set the default DoiCache. Use set_doi_cache(None) to disable caching. """
+    _default_cache[:] = [cache]
+
+
+def configure_doi_cache(config):
+    """
+    Set up the default cache from config parameters:
+        doi_cache_filepath: Cache file (default ~/.cache/instaporter/doi.sqlite); set to '' to disable caching.
+        doi_cache_ttl, doi_cache_negative_ttl: Number of seconds to keep DOI data and failed lookups;
+            0 means entries expire immediately (e.g. doi_cache_negative_ttl = 0 to not cache failures).
+    Returns the cache.
+    """
+    filepath = config.get('doi_cache_filepath')
+    ttl = config.get('doi_cache_ttl')
+    negative_ttl = config.get('doi_cache_negative_ttl')
+    if filepath == '':
+        cache = None
+    else:
+        cache = DoiCache(filepath, ttl=DEFAULT_TTL if ttl is None else ttl,
+                         negative_ttl=DEFAULT_NEGATIVE_TTL if negative_ttl is None else negative_ttl)
+    set_doi_cache(cache)
+    return cache
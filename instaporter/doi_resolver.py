@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Concurrent resolution of many DOIs.
+
+resolve_dois() looks up DOI metadata with a pool of worker threads, sharing the
+pooled session from http_session, and yields (doi, data) tuples as the lookups complete:
+
+    for doi, data in resolve_dois(dois, workers=16):
+        print(doi, data and data.get('title'))
+
+* Lookups go through the DOI cache (see doi_cache), so already-resolved DOIs do not hit the network.
+* Duplicate DOIs are only resolved once, and identical lookups that are in flight at the same
+  time (e.g. from concurrent resolve_dois calls) are collapsed into a single request (singleflight).
+* No more than <per_host> requests are made to the same host at a time, counting the requests
+  of all resolve_dois calls (HOST_LIMITER is shared). Cache hits do not take a slot.
+* At most 2*workers lookups are queued at a time, so dois may be a long iterable (e.g. a file);
+  results are yielded while the rest of the input is read.
+
+"""
+
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import logging
+logger = logging.getLogger(__name__)
+
+from .doi_cache import doi_key
+from .html_utils import get_doi_data, normalize_doi, DOI_API_BASEURL
+from .http_session import get_session
+
+
+class SingleFlight(object):
+    """
+    Collapse concurrent calls with the same key into one call.
+    The first caller (the leader) calls the function; callers arriving while the
+    call is in flight wait for, and get, the leader's result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args, **kwargs):
+        """ Call func(*args, **kwargs), unless a call with the same key is already in flight. """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return result
+
+
+class HostLimiter(object):
+    """
+    Limit the number of concurrent requests per host. The count of requests to a host is shared
+    by all users of the limiter; each request waits until fewer than its per_host limit are active.
+    """
+
+    def __init__(self, per_host=8):
+        self.per_host = per_host
+        self._cond = threading.Condition()
+        self._active = {}
+
+    @contextmanager
+    def __call__(self, url, per_host=None):
+        """ Context manager holding a request slot for the host of url; use as: with limiter(url): ... """
+        host = urlparse(url).netloc.lower()
+        limit = max(1, per_host or self.per_host)
+        with self._cond:
+            while self._active.get(host, 0) >= limit:
+                self._cond.wait()
+            self._active[host] = self._active.get(host, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active[host] -= 1
+                if not self._active[host]:
+                    del self._active[host]
+                self._cond.notify_all()
+
+
+# Shared by all callers, so that lookups from different threads are collapsed:
+DOI_FLIGHTS = SingleFlight()
+# Shared by all callers, so that the per-host limit applies to all lookups:
+HOST_LIMITER = HostLimiter()
+
+
+def resolve_dois(dois, workers=16, per_host=8, cache=False, session=None):
+    """
+    Resolve DOIs concurrently, yielding (doi, data) tuples as the lookups complete.
+    data is None if the DOI could not be resolved.
+    Args:
+        dois: Iterable of DOIs (with or without 'doi:' or url prefixes).
+        workers: Number of worker threads.
+        per_host: Max number of concurrent requests to the same host (by all callers).
+        cache: DoiCache to use; default is the default cache, None disables caching.
+        session: requests session to use (default: the shared session, see http_session.get_session).
+    Invalid DOIs are yielded with data None, and duplicate DOIs only once.
+    """
+    if session is None:
+        session = get_session()
+    workers = max(1, workers)
+
+    def resolve(doi):
+        """ Resolve a single doi; the per-host limit only applies if it is not cached. """
+        return DOI_FLIGHTS.do(doi_key(doi), get_doi_data, doi, cache=cache, session=session,
+                              slot=HOST_LIMITER(DOI_API_BASEURL, per_host))
+
+    def results(done):
+        """ Generate (doi, data) for completed futures. """
+        for future in done:
+            doi = futures.pop(future)
+            try:
+                data = future.result()
+            except Exception as e:    # pylint: disable=W0703
+                logger.error("Could not resolve DOI %s: %s", doi, e)
+                data = None
+            yield doi, data
+
+    seen = set()
+    futures = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for doi in dois:
+            doi = doi.strip()
+            if not doi:
+                continue
+            normalized = normalize_doi(doi)
+            if normalized is None:
+                logger.warning("Not a DOI: %r", doi)
+                yield doi, None
+                continue
+            if doi_key(normalized) in seen:
+                continue
+            seen.add(doi_key(normalized))
+            futures[executor.submit(resolve, normalized)] = normalized
+            if len(futures) >= 2 * workers:
+                done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                for result in results(done):
+                    yield result
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for result in results(done):
+                yield result
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Resumable export (backup) of an Instapaper account: folders, bookmarks, highlights and texts.
+
+Export directory layout:
+    folders.json        The user's folders (folders/list).
+    bookmarks.jsonl     One line per bookmark: the bookmark, plus 'folder_id', 'highlights'
+                        and 'text_file' (or 'text_error' if Instapaper has no text for the bookmark).
+    texts/<bookmark_id>.html.gz     Bookmark text (bookmarks/get_text), gzip-compressed.
+    checkpoint.json     Progress: bytes of bookmarks.jsonl that are complete, failed bookmarks, etc.
+
+The folders are listed page by page (InstapaperClient.iter_bookmarks) while texts and highlights
+are fetched by a pool of worker threads (at most 2*workers bookmarks are in flight). Each text file
+is written (atomically) before its bookmark's line is appended to bookmarks.jsonl, and
+checkpoint.json is written every <checkpoint_every> bookmarks and when the export stops.
+
+Resuming: bookmarks.jsonl is only appended to, so the bookmarks already exported are read from it
+(a partly written last line, from an export that was killed, is truncated). These bookmark ids are
+passed as 'have' when listing the folders, so neither they nor their texts and highlights are
+downloaded again. Text files written just before an export was killed are reused.
+Bookmarks which failed (e.g. network errors) are retried when the export is resumed.
+
+Usage:
+    exporter = AccountExport(client, "~/instapaper-backup", workers=8)
+    stats = exporter.run()
+
+"""
+
+import os
+import gzip
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import logging
+logger = logging.getLogger(__name__)
+
+from .instapaper import is_error, response_json, retry_code
+from .models import to_plain, json_default
+from .state_store import atomic_write
+
+
+class ExportError(Exception):
+    """ Raised when a bookmark's text or highlights could not be fetched (it should be retried). """
+    pass
+
+
+class AccountExport(object):
+    """
+    Exports all bookmarks of client's account to directory, resuming a previous export if present.
+    """
+
+    def __init__(self, client, directory, workers=8, batch=500, checkpoint_every=50, compresslevel=6):
+        """
+        Args:
+            client: InstapaperClient.
+            directory: Export directory (created if needed).
+            workers: Number of concurrent text/highlights requests.
+            batch: Number of bookmarks per bookmarks/list request.
+            checkpoint_every: Write checkpoint.json after this many bookmarks.
+            compresslevel: gzip compression level for the texts.
+        """
+        self.client = client
+        self.directory = os.path.expanduser(directory)
+        self.workers = max(1, workers)
+        self.batch = batch
+        self.checkpoint_every = checkpoint_every
+        self.compresslevel = compresslevel
+        self.jsonl_filepath = os.path.join(self.directory, 'bookmarks.jsonl')
+        self.texts_directory = os.path.join(self.directory, 'texts')
+        self.checkpoint_filepath = os.path.join(self.directory, 'checkpoint.json')
+        self.folders_filepath = os.path.join(self.directory, 'folders.json')
+        # str(folder_id) -> list of exported bookmark ids:
+        self.exported = {}
+        self.failed = {}
+        self.offset = 0
+        self.stats = {'exported': 0, 'resumed': 0, 'failed': 0, 'text_bytes': 0, 'elapsed': 0.0}
+
+    def text_filepath(self, bookmark_id):
+        """ Return path of the text file for bookmark. """
+        return os.path.join(self.texts_directory, '%s.html.gz' % bookmark_id)
+
+    def load_checkpoint(self):
+        """
+        Load progress of a previous export: the checkpoint and the bookmarks in bookmarks.jsonl.
+        Lines after the checkpoint's offset are kept if they are complete (the export may have been
+        killed before writing the checkpoint); a partly written line is truncated.
+        """
+        checkpoint = {}
+        if os.path.exists(self.checkpoint_filepath):
+            with open(self.checkpoint_filepath) as fd:
+                checkpoint = json.load(fd)
+        self.failed = {int(bid): error for bid, error in checkpoint.get('failed', [])}
+        self.stats['elapsed'] = checkpoint.get('elapsed', 0.0)
+        self.exported, self.offset = {}, 0
+        if not os.path.exists(self.jsonl_filepath):
+            return checkpoint
+        with open(self.jsonl_filepath, 'rb+') as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+                if not line.endswith(b'\n'):
+                    break
+                self.exported.setdefault(str(record['folder_id']), []).append(record['bookmark_id'])
+                self.offset += len(line)
+            if self.offset < checkpoint.get('offset', 0):
+                logger.warning("%s is shorter than the checkpoint (%s < %s bytes).",
+                               self.jsonl_filepath, self.offset, checkpoint['offset'])
+            fd.truncate(self.offset)
+        self.stats['resumed'] = sum(len(ids) for ids in self.exported.values())
+        logger.info("Resuming export: %s bookmarks already exported, %s failed before.",
+                    self.stats['resumed'], len(self.failed))
+        return checkpoint
+
+    def save_checkpoint(self, complete=False):
+        """ Write checkpoint.json (atomically). """
+        checkpoint = {'offset': self.offset, 'exported': sum(len(ids) for ids in self.exported.values()),
+                      'failed': [[bid, error] for bid, error in self.failed.items()],
+                      'complete': complete, 'elapsed': self.stats['elapsed'], 'time': time.time()}
+        atomic_write(self.checkpoint_filepath, json.dumps(checkpoint))
+
+    def fetch_text(self, bookmark):
+        """
+        Fetch text for bookmark and write it to its text file (unless the file is already there).
+        Returns (text_file relative to the export directory, bytes written, error); error is the API
+        error for bookmarks without a text (e.g. videos). Raises ExportError if the request failed.
+        """
+        filepath = self.text_filepath(bookmark['bookmark_id'])
+        relpath = 'texts/%s.html.gz' % bookmark['bookmark_id']
+        if os.path.exists(filepath):
+            return relpath, 0, None
+        cache = self.client.text_cache
+        text = cache.get(bookmark['bookmark_id'], bookmark.get('hash')) if cache is not None else None
+        if text is None:
+            r = self.client.post('bookmarks/get_text', data={'bookmark_id': bookmark['bookmark_id']})
+            code = retry_code(r)
+            if code is not None:
+                raise ExportError("get_text failed with %s" % code)
+            if not r.ok:
+                # Instapaper has no text for the bookmark (e.g. 1550 for videos); not worth retrying:
+                try:
+                    error = response_json(r)[0]
+                    return None, 0, "%s: %s" % (error.get('error_code') or r.status_code, error.get('message'))
+                except (ValueError, IndexError, KeyError, TypeError, AttributeError):
+                    return None, 0, "%s: %s" % (r.status_code, r.text[:200])
+            text = r.text
+            if cache is not None:
+                cache.put(bookmark['bookmark_id'], bookmark.get('hash'), text)
+        data = gzip.compress(text.encode('utf-8'), self.compresslevel, mtime=0)
+        atomic_write(filepath, data)
+        return relpath, len(data), None
+
+    def fetch_highlights(self, bookmark):
+        """ Return list of highlights for bookmark. Raises ExportError if the request failed. """
+        r = self.client.post('bookmarks/%d/highlights' % bookmark['bookmark_id'])
+        code = is_error(r)
+        if code:
+            raise ExportError("highlights: %s" % code)
+        return to_plain(response_json(r))
+
+    def export_one(self, folder_id, bookmark):
+        """
+        Fetch text and highlights for bookmark (called in the worker threads).
+        Returns (jsonl line as bytes, size of the text file written).
+        """
+        record = to_plain(bookmark)
+        record['folder_id'] = folder_id
+        record['text_file'], text_bytes, error = self.fetch_text(bookmark)
+        if error:
+            record['text_error'] = error
+        record['highlights'] = self.fetch_highlights(bookmark)
+        line = json.dumps(record, ensure_ascii=False, default=json_default) + '\n'
+        return line.encode('utf-8'), text_bytes
+
+    def run(self, folders=None, progress=None):
+        """
+        Export (or resume exporting) the bookmarks in folders (default: all folders).
+        progress: Function called as progress(bookmark_id, error, stats) after each bookmark (error is None if exported).
+        Returns dict with stats: 'exported' (this run), 'resumed' (from earlier runs), 'failed', 'text_bytes', 'elapsed'.
+        If the export is interrupted (or a folder cannot be listed), the checkpoint is saved before the exception is raised.
+        """
+        if not os.path.isdir(self.texts_directory):
+            os.makedirs(self.texts_directory)
+        self.load_checkpoint()
+        all_folders = folders is None
+        if all_folders:
+            user_folders = self.client.list_folders()
+            if not isinstance(user_folders, list):
+                raise ValueError("folders/list failed: %s" % (user_folders,))
+            atomic_write(self.folders_filepath, json.dumps(to_plain(user_folders), indent=2, ensure_ascii=False))
+            folders = ['unread', 'archive'] + [folder['folder_id'] for folder in user_folders
+                                               if folder.get('type') == 'folder']
+        retry = set(self.failed)
+        done = {bid for ids in self.exported.values() for bid in ids}
+        bookmarks = self.client.iter_bookmarks(folders, batch=self.batch, with_folder=True, have=self.exported)
+        start, elapsed = time.time(), self.stats['elapsed']
+        futures = {}
+
+        with open(self.jsonl_filepath, 'ab') as jsonl, ThreadPoolExecutor(max_workers=self.workers) as executor:
+
+            def record(future):
+                """ Append the bookmark's line to bookmarks.jsonl (in the calling thread). """
+                folder_id, bookmark_id = futures.pop(future)
+                try:
+                    line, text_bytes = future.result()
+                except Exception as e:    # pylint: disable=W0703
+                    error = self.failed[bookmark_id] = "%s: %s" % (type(e).__name__, e)
+                    logger.warning("Could not export bookmark %s: %s", bookmark_id, e)
+                else:
+                    jsonl.write(line)
+                    self.offset += len(line)
+                    self.exported.setdefault(str(folder_id), []).append(bookmark_id)
+                    self.failed.pop(bookmark_id, None)
+                    self.stats['exported'] += 1
+                    self.stats['text_bytes'] += text_bytes
+                    error = None
+                if progress is not None:
+                    progress(bookmark_id, error, self.stats)
+
+            def checkpoint(complete=False):
+                """ Flush bookmarks.jsonl to disk, then write the checkpoint. """
+                jsonl.flush()
+                os.fsync(jsonl.fileno())
+                self.stats['failed'] = len(self.failed)
+                self.stats['elapsed'] = elapsed + time.time() - start
+                self.save_checkpoint(complete)
+
+            try:
+                last_checkpoint = 0
+                for folder_id, bookmark in bookmarks:
+                    if bookmark['bookmark_id'] in done:
+                        continue    # Moved to another folder since it was exported.
+                    done.add(bookmark['bookmark_id'])
+                    retry.discard(bookmark['bookmark_id'])
+                    future = executor.submit(self.export_one, folder_id, bookmark)
+                    futures[future] = (folder_id, bookmark['bookmark_id'])
+                    while len(futures) >= 2 * self.workers:
+                        finished, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            record(future)
+                    if self.stats['exported'] - last_checkpoint >= self.checkpoint_every:
+                        checkpoint()
+                        last_checkpoint = self.stats['exported']
+                while futures:
+                    finished, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(future)
+                if all_folders:
+                    # Bookmarks which failed before but are no longer listed have been deleted:
+                    for bookmark_id in retry:
+                        self.failed.pop(bookmark_id, None)
+                checkpoint(complete=all_folders and not self.failed)
+            except BaseException:
+                # Keep the bookmarks already being fetched, cancel the rest, and save the checkpoint:
+                progress = None
+                for future in list(futures):
+                    if future.cancel():
+                        futures.pop(future)
+                    else:
+                        record(future)
+                checkpoint()
+                raise
+            finally:
+                bookmarks.close()
+        logger.info("Export to %s: %s", self.directory, self.stats)
+        return self.stats
+
+
+def read_export(directory):
+    """ Generate the bookmark records (dicts) of an export in directory. """
+    with open(os.path.join(os.path.expanduser(directory), 'bookmarks.jsonl'), encoding='utf-8') as fd:
+        for line in fd:
+            if line.endswith('\n'):
+                yield json.loads(line)
+
+
+def read_text(directory, record):
+    """ Return text (html) of exported bookmark record, or None if it has no text. """
+    if not record.get('text_file'):
+        return None
+    with gzip.open(os.path.join(os.path.expanduser(directory), record['text_file']), 'rb') as fd:
+        return fd.read().decode('utf-8')
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,R0902
+
+"""
+Streaming html processing with bounded memory.
+
+Instead of reading the whole document and then making several full copies of it
+(body extraction, symbol replacement, url rewriting), HtmlStreamProcessor is fed
+the document in chunks as they arrive from the server:
+
+1. Until the <body> tag is found, chunks are collected as the document head,
+   which is used for metadata and <base href>.
+2. After <body>, each chunk is cut at its last '<' (so no tag is split between chunks),
+   glyph symbols are replaced and urls made absolute, and the result is written to <out>.
+3. The body ends at the last </body> tag (like html_utils.find_body_span), so the text after a
+   </body> tag is held back until either another </body> tag follows (and it is part of the body)
+   or the document ends (and it is discarded).
+
+Chunks given as bytes are decoded with the response encoding, if given; otherwise the encoding is
+taken from a byte order mark or <meta charset> in the first chunk (default utf-8).
+
+Only the head and a small working buffer are kept in memory; the processed
+body is written to the <out> file-like object (e.g. io.StringIO or a file).
+
+Usage:
+    out = io.StringIO()
+    processor = process_stream(r.iter_content(2**16), url, out, encoding=r.encoding)
+    metadata = find_metadata(processor.head, url)
+    content = out.getvalue()
+"""
+
+import re
+import codecs
+import logging
+logger = logging.getLogger(__name__)
+
+from .html_utils import get_symbol_replacer, UrlRewriter, find_base_url, find_doi, \
+    BODY_OPEN_REGEX, BODY_CLOSE_REGEX, find_tag_end
+
+
+# Charset declared in the document, e.g. <meta charset="utf-8"> or
+# <meta http-equiv="Content-Type" content="text/html; charset=iso-8859-1">:
+META_CHARSET_REGEX = re.compile(br"""<meta[^>]*?charset\s*=\s*["']?([\w.:-]+)""", flags=re.IGNORECASE)
+
+
+def sniff_encoding(data, default='utf-8'):
+    """ Return the encoding of the html document starting with data (bytes), from its BOM or <meta charset>. """
+    if data.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    match = META_CHARSET_REGEX.search(data)
+    if match:
+        return match.group(1).decode('ascii')
+    return default
+
+
+def get_decoder(encoding):
+    """ Return incremental decoder for encoding (utf-8 if the encoding is not known). """
+    try:
+        return codecs.getincrementaldecoder(encoding)(errors='replace')
+    except LookupError:
+        logger.warning("Unknown encoding %r, decoding as utf-8.", encoding)
+        return codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+
+class HtmlStreamProcessor(object):
+    """
+    Incremental html processor. Feed it chunks of text (or bytes) with feed(), then call close().
+    After close():
+        head: The document head (everything before <body>).
+        doi: DOI found in the body, if any (used when the head does not have one).
+        replaced, unrecognized, urls: Number of replaced/unrecognized symbols and rewritten urls.
+    """
+
+    def __init__(self, url, out, symbols_filepath=None, max_head=2**20, encoding=None):
+        """
+        Args:
+            url: Url of the document (for resolving relative urls).
+            out: File-like object that the processed body is written to.
+            symbols_filepath: Extra glyph symbols, see html_utils.html_symbol_repl.
+            max_head: If no <body> tag is found in the first max_head characters,
+                the document is assumed to have no body tag and is processed as a whole.
+            encoding: Encoding used to decode chunks given as bytes, e.g. the response encoding.
+                If None, the encoding is found from the first chunk (see sniff_encoding).
+        """
+        self.url = url
+        self.out = out
+        self.max_head = max_head
+        self.symbols = get_symbol_replacer(symbols_filepath)
+        self.encoding = encoding
+        self.decoder = get_decoder(encoding) if encoding else None
+        self.rewriter = None
+        self.state = 'head'
+        self.head = ''
+        self.doi = None
+        self.buffer = ''
+        self._scan_from = 0
+        self.replaced = 0
+        self.unrecognized = 0
+        self.urls = 0
+        self.chars_out = 0
+
+    def _start_body(self, head, rest):
+        """ Switch to body state. """
+        self.head = head
+        self.rewriter = UrlRewriter(find_base_url(head, self.url))
+        self.state = 'body'
+        self.buffer = rest
+
+    def _process(self, html):
+        """ Replace symbols, rewrite urls and write html to out. """
+        html, n, unrecognized = self.symbols.subn(html)
+        self.replaced += n
+        self.unrecognized += sum(unrecognized.values())
+        html, n = self.rewriter.subn(html)
+        self.urls += n
+        if self.doi is None:
+            self.doi = find_doi(html)
+        self.out.write(html)
+        self.chars_out += len(html)
+
+    def feed(self, chunk):
+        """ Feed the next chunk of the document (str or bytes). """
+        if isinstance(chunk, bytes):
+            if self.decoder is None:
+                self.encoding = sniff_encoding(chunk)
+                self.decoder = get_decoder(self.encoding)
+            chunk = self.decoder.decode(chunk)
+        if not chunk or self.state == 'done':
+            return
+        # In the 'tail' state, the buffer starts with the last </body> tag found so far;
+        # look for a later one from the last '<' before this chunk (the tag may span chunks):
+        scan = max(1, self.buffer.rfind('<')) if self.state == 'tail' else 0
+        self.buffer += chunk
+        if self.state == 'head':
+            match = BODY_OPEN_REGEX.search(self.buffer, self._scan_from)
+            if match:
+                # Skip to the end of the body tag (attributes may span chunks):
+                tag_end = find_tag_end(self.buffer, match.end() - 1)
+                if tag_end == -1 and len(self.buffer) - match.start() <= self.max_head:
+                    self._scan_from = match.start()
+                    return
+                if tag_end == -1:
+                    logger.info("<body> tag is not terminated in %s chars; processing the whole document.",
+                                self.max_head)
+                    self._start_body('', self.buffer)
+                else:
+                    self._start_body(self.buffer[:match.start()], self.buffer[tag_end:])
+            elif len(self.buffer) > self.max_head:
+                logger.info("No <body> tag found in the first %s chars; processing the whole document.",
+                            self.max_head)
+                self._start_body('', self.buffer)
+            else:
+                # Next search starts a bit before the new chunk, in case the tag is split between chunks:
+                self._scan_from = max(0, len(self.buffer) - 6)
+                return
+        last = None
+        for last in BODY_CLOSE_REGEX.finditer(self.buffer, scan):
+            pass
+        if last is not None:
+            # Everything before the last </body> is body; the rest is held back (see module docstring):
+            self._process(self.buffer[:last.start()])
+            self.buffer = self.buffer[last.start():]
+            self.state = 'tail'
+            return
+        if self.state == 'tail':
+            return
+        # Keep everything from the last '<', so tags (and </body>) are never split between chunks:
+        cut = self.buffer.rfind('<')
+        if cut == -1:
+            cut = len(self.buffer)
+        if cut > 0:
+            self._process(self.buffer[:cut])
+            self.buffer = self.buffer[cut:]
+
+    def close(self):
+        """ Process any remaining buffered content (and discard anything after the last </body>). """
+        if self.decoder is not None:
+            self.feed(self.decoder.decode(b'', final=True))
+        if self.state == 'head':
+            # Never found a body tag; process it all:
+            self._start_body('', self.buffer)
+        if self.state == 'body' and self.buffer:
+            self._process(self.buffer)
+        self.buffer = ''
+        self.state = 'done'
+        logger.info("%s symbols replaced (%s not recognized) and %s urls rewritten in %s chars of body from %s",
+                    self.replaced, self.unrecognized, self.urls, self.chars_out, self.url)
+        return self
+
+
+def process_stream(chunks, url, out, symbols_filepath=None, encoding=None):
+    """
+    Process html document from iterable of chunks (str or bytes), writing the
+    processed body to out. Returns the closed HtmlStreamProcessor.
+    encoding: Encoding of bytes chunks, e.g. the response encoding; found from the document if None.
+    """
+    processor = HtmlStreamProcessor(url, out, symbols_filepath=symbols_filepath, encoding=encoding)
+    for chunk in chunks:
+        processor.feed(chunk)
+    return processor.close()
@@ -22,23 +22,31 @@
 Utility functions for rewriting/reformatting/replacing html documents/content.
 """
 
+import os
 import re
 from urllib.parse import urljoin
-import requests
+from html import unescape as html_unescape
+from html.parser import HTMLParser
+
+from .doi_cache import get_doi_cache
+from .http_session import get_session
 
 import logging
 logger = logging.getLogger(__name__)
 
 
-def find_doi(html):
+#DOI_REGEX = r"doi.+(10\\.\d{4,6}/[^\"'&<% \t\n\r\f\v]+)"
+DOI_REGEX = re.compile(r"doi.+(10\.\d{4,6}/[^\"'&<%\s]+)")
+
+
+def find_doi(html, pos=0, endpos=None):
     """
     Find a regex in html. If more DOIs are present, we assume the first DOI is the one we want.
+    Optional pos and endpos limits the search to html[pos:endpos] (without copying).
     """
-    #DOI_REGEX = r"doi.+(10\\.\d{4,6}/[^\"'&<% \t\n\r\f\v]+)"
-    DOI_REGEX = r"doi.+(10\.\d{4,6}/[^\"'&<%\s]+)"
-    hits = re.findall(DOI_REGEX, html)
-    if hits:
-        return hits[0]
+    match = DOI_REGEX.search(html, pos, len(html) if endpos is None else endpos)
+    if match:
+        return match.group(1)
     return None
 
 def find_headings(html):
@@ -59,23 +67,141 @@ def find_titles(html):
     titles = re.findall(r"<title[^>]*?>(.*?)</title>", html)
     return titles
 
+META_REGEX = re.compile(r"<meta\s[^>]*>", flags=re.IGNORECASE)
+ATTR_REGEX = re.compile(r"""([\w:.-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+
+
+def parse_attributes(tag):
+    """ Parse attributes of a html tag string, e.g. '<meta name="x" content="y">'. Returns dict. """
+    return {m.group(1).lower(): html_unescape(next(v for v in m.groups()[1:] if v is not None))
+            for m in ATTR_REGEX.finditer(tag)}
+
+
 def find_keywords(html):
     """
     Find tags/keywords in html.
-    Uhm... Doesn't seem to be that easy.
     Nature has this: <meta name="keywords" content="Long non-coding RNAs" />
     .. same for ACS Journals.
+    The attributes may be in any order, use any quotes and there may be other attributes.
     """
-    # TODO: Find keywords/tags, better.
-    tags = re.findall(r'<meta\s(\w+="[^"]+")\s+(\w+="[^"]+")[^>]*?>', html)
-    tags = [tag for tag in tags if any(elem.lower() == 'name="keywords"' for elem in tag)]
-    if not tags:
-        return
-    tag = tags[0]
-    keywords = tag[1] if tag[0] == 'name="keywords"' else tag[0]
-    keywords = keywords.split("=")[1].strip(' "')
-    keywords = [word.strip() for word in keywords.split(',')]
-    return keywords
+    for tag in META_REGEX.findall(html):
+        attrs = parse_attributes(tag)
+        if attrs.get('name', '').lower() == 'keywords' and attrs.get('content'):
+            return split_keywords(attrs['content'])
+
+
+def split_keywords(content):
+    """ Split keywords string by ',' or ';'. """
+    return [word.strip() for word in re.split(r"[,;]", content) if word.strip()]
+
+
+def normalize_doi(doi):
+    """
+    Normalize DOI, i.e. remove 'doi:' and 'http://dx.doi.org/'-style prefixes and surrounding whitespace.
+    Returns None if doi is empty or does not look like a DOI.
+    """
+    if not doi:
+        return None
+    doi = doi.strip()
+    doi = re.sub(r"^(?:doi:\s*|https?://(?:dx\.)?doi\.org/)", "", doi, flags=re.IGNORECASE)
+    return doi if re.match(r"10\.\d{4,9}/\S+$", doi) else None
+
+
+class HeadMetadataParser(HTMLParser):
+    """
+    Collect <title>, <meta> and <link> tags from the document head, in a single pass.
+    Parsing stops at </head> or <body>.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.title = None
+        self.meta = {}      # name/property (lower case) -> list of content values
+        self.links = []     # list of attribute dicts
+        self.done = False
+        self._in_title = False
+        self._title_parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        attrs = {k.lower(): v for k, v in attrs if v is not None}
+        if tag == 'meta':
+            key = attrs.get('name') or attrs.get('property') or attrs.get('http-equiv')
+            if key and 'content' in attrs:
+                self.meta.setdefault(key.lower(), []).append(attrs['content'])
+        elif tag == 'link':
+            self.links.append(attrs)
+        elif tag == 'title' and self.title is None:
+            self._in_title = True
+        elif tag == 'body':
+            self.done = True
+
+    handle_startendtag = handle_starttag
+
+    def handle_data(self, data):
+        if self._in_title:
+            self._title_parts.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'title' and self._in_title:
+            self._in_title = False
+            self.title = "".join(self._title_parts).strip()
+        elif tag == 'head':
+            self.done = True
+
+    def first(self, *names):
+        """ Return the first non-empty meta value for any of names. """
+        for name in names:
+            for value in self.meta.get(name, []):
+                if value.strip():
+                    return value.strip()
+        return None
+
+
+HEAD_END_REGEX = re.compile(r"</head\s*>|<body[\s>]", flags=re.IGNORECASE)
+
+
+def scan_metadata(html):
+    """
+    Find metadata in html document.
+    The <head> is parsed once for <title>, <meta> and <link> tags; only if some fields are missing
+    is the rest of the document scanned for them.
+    Returns dict with:
+        title: citation_title (or dc.title, og:title, <title>).
+        doi: citation_doi (or dc.identifier, prism.doi, or the first DOI-like string in the document).
+        keywords: list of keywords from keywords/citation_keywords meta tags.
+        abstract: citation_abstract (or dc.description, description, og:description).
+        meta: dict with all meta tags, name -> list of values.
+        links: list of attribute dicts for all link tags.
+    """
+    match = HEAD_END_REGEX.search(html)
+    head_end = match.start() if match else len(html)
+    parser = HeadMetadataParser()
+    parser.feed(html[:head_end])
+    parser.close()
+    first = parser.first
+    keywords = [kw for value in parser.meta.get('citation_keywords', []) + parser.meta.get('keywords', [])
+                for kw in split_keywords(value)]
+    dois = [first(name) for name in ('citation_doi', 'dc.identifier', 'prism.doi', 'bepress_citation_doi')]
+    record = {
+        'title': first('citation_title', 'dc.title', 'og:title') or parser.title,
+        'doi': next((normalize_doi(doi) for doi in dois if normalize_doi(doi)), None),
+        'keywords': keywords or None,
+        'abstract': first('citation_abstract', 'dc.description', 'description', 'og:description') or '',
+        'meta': parser.meta,
+        'links': parser.links,
+    }
+    # Fall back to scanning the head text and then the body, only for missing fields:
+    if record['doi'] is None:
+        record['doi'] = find_doi(html, 0, head_end) or find_doi(html, head_end)
+    if record['title'] is None:
+        titles = find_titles(html[head_end:])
+        record['title'] = titles[0] if titles else None
+    if record['keywords'] is None and head_end < len(html):
+        record['keywords'] = find_keywords(html[head_end:])
+    return record
+
 
 def find_metadata(html, url=None):
     """
@@ -85,17 +211,13 @@ def find_metadata(html, url=None):
             title: title, as found in html.
             keywords: keywords, as found in html.
             abstract: abstract, as found in html.
+            doi: doi, as found in html.
+            (and meta and links, see scan_metadata)
         doi: <CLS data from dx.doi.org, if a DOI was found in the html>
     """
     metadata = {'doi': None, 'url': url}
-    html_titles = find_titles(html)
-    doi = find_doi(html)
-    metadata['html'] = {'title': html_titles[0] if html_titles else None,
-                        'keywords': find_keywords(html),
-                        'abstract': '',
-                        'doi': doi}
-    #html_keywords = find_keywords(html)
-    #html_abstract = ''
+    metadata['html'] = scan_metadata(html)
+    doi = metadata['html']['doi']
     if not doi:
         print("\nCould not find any DOI in html; aborting..")
     else:
@@ -104,21 +226,53 @@ def find_metadata(html, url=None):
             metadata['doi'] = doi_data
     return metadata
 
-def get_doi_data(doi):
-    """ Get DOI data as dict. Returns None if DOI response was not ok. """
-    r = get_doi_response(doi)
+def get_doi_data(doi, cache=False, session=None, slot=None):
+    """
+    Get DOI data as dict. Returns None if DOI response was not ok.
+    Lookups go through cache (default: the default DoiCache, see doi_cache.get_doi_cache);
+    use cache=None to always query dx.doi.org.
+    Requests are made with session, if given.
+    slot: Context manager which is entered only around the request to dx.doi.org, not for
+    cache hits (e.g. a per-host limit, see doi_resolver.HostLimiter).
+    Failed lookups (4xx responses or invalid json) are cached as negative entries;
+    server errors are not cached.
+    """
+    doi = normalize_doi(doi) or doi.strip()
+    if cache is False:
+        cache = get_doi_cache()
+    if cache is not None:
+        found, data = cache.get(doi)
+        if found:
+            logger.debug("DOI data for %s found in cache (negative entry: %s).", doi, data is None)
+            return data
+    if slot is None:
+        r = get_doi_response(doi, session=session)
+    else:
+        with slot:
+            r = get_doi_response(doi, session=session)
     if not r.ok:
         print("DOI response not OK: ", r)
+        if cache is not None and r.status_code < 500:
+            cache.put(doi, None)
         return
-    return r.json()
+    try:
+        data = r.json()
+    except ValueError:
+        print("DOI response is not valid json: ", r.text[:200])
+        data = None
+    if cache is not None:
+        cache.put(doi, data)
+    return data
 
-def get_doi_response(doi):
-    """ Query dx.doi.org for doi. Return requests Response. """
+DOI_API_BASEURL = "http://dx.doi.org"
+
+
+def get_doi_response(doi, session=None):
+    """ Query dx.doi.org for doi, using session (default: the shared session). Return requests Response. """
     # Do NOT include the ":" in the headers for requests:
     doi_headers = {"Accept": "application/vnd.citationstyles.csl+json"}
-    doi_api_baseurl = "http://dx.doi.org"
-    doi_endpoint = urljoin(doi_api_baseurl, doi)
-    r = requests.get(doi_endpoint, headers=doi_headers)
+    doi_endpoint = urljoin(DOI_API_BASEURL, doi)
+    r = (session or get_session()).get(doi_endpoint, headers=doi_headers)
     return r
 
 
@@ -133,9 +287,184 @@ def get_doc_title(html):
     return title
 
 
+# Attributes that contain urls (srcset contains a list of urls with size descriptors):
+URL_ATTRIBUTES = ('href', 'src', 'srcset', 'action', 'formaction', 'poster', 'background',
+                  'cite', 'longdesc', 'data', 'usemap')
+
+# Matches all url-bearing attributes (double or single quoted) and CSS url() values in one scan.
+# The attribute must be preceded by whitespace, a quote, '/' or '-' (e.g. data-src); this character
+# class plus the first-letter lookahead is much cheaper to test at every position than \b + IGNORECASE.
+# The regex does not know the context of a match; UrlRewriter only rewrites attributes inside tags
+# and url() values inside tags (style attributes) or <style> elements, not text or scripts.
+URL_REGEX = re.compile(
+    r"""(?P<attr>[\s"'/\-](?=[%s])(?i:%s)\s*=\s*)(?:"(?P<dq>[^"]*)"|'(?P<sq>[^']*)')"""
+    r"""|(?P<css>[uU][rR][lL]\(\s*)(?P<cq>["']?)(?P<curl>[^"')]*)(?P=cq)(?P<cssend>\s*\))"""
+    % ("".join(sorted({c for attr in URL_ATTRIBUTES for c in (attr[0], attr[0].upper())})),
+       "|".join(URL_ATTRIBUTES)))
+
+# Start and end tags of <style> elements:
+STYLE_TAG_REGEX = re.compile(r"<(/?)style\b", flags=re.IGNORECASE)
+
+BASE_REGEX = re.compile(r"""<base\s[^>]*?href\s*=\s*["']([^"']*)["']""", flags=re.IGNORECASE)
+
+
+def find_base_url(html, url):
+    """
+    Return the base url for resolving relative urls in html document from url,
+    i.e. the <base href="..."> of the document (resolved against url), if it has one, otherwise url.
+    """
+    match = BASE_REGEX.search(html)
+    if match and match.group(1).strip():
+        return urljoin(url, match.group(1).strip())
+    return url
+
+
+def sub_span(regex, repl, html, pos=0, endpos=None):
+    """
+    Same as regex.subn(repl, html[pos:endpos]), but without first copying html[pos:endpos].
+    Returns (new_html, number of substitutions).
+    """
+    if endpos is None:
+        endpos = len(html)
+    if pos == 0 and endpos == len(html):
+        return regex.subn(repl, html)
+    parts = []
+    last = pos
+    for match in regex.finditer(html, pos, endpos):
+        parts.append(html[last:match.start()])
+        parts.append(repl(match))
+        last = match.end()
+    parts.append(html[last:endpos])
+    return "".join(parts), (len(parts) - 1) // 2
+
+
+BODY_OPEN_REGEX = re.compile(r"<body[\s>]", flags=re.IGNORECASE)
+BODY_CLOSE_REGEX = re.compile(r"</body\s*>", flags=re.IGNORECASE)
+# Characters that end a tag or start a quoted attribute value:
+TAG_SPECIAL_REGEX = re.compile(r"""[>"']""")
+
+
+def find_tag_end(html, pos):
+    """
+    Return the index just after the '>' that ends the tag at pos, skipping '>' inside quoted
+    attribute values, or -1 if the tag is not terminated. Scans each character at most once
+    (a regex with nested quantifiers backtracks exponentially on an unterminated tag).
+    """
+    while True:
+        match = TAG_SPECIAL_REGEX.search(html, pos)
+        if not match:
+            return -1
+        if match.group() == '>':
+            return match.end()
+        pos = html.find(match.group(), match.end())
+        if pos == -1:
+            return -1
+        pos += 1
+
+
+def find_body_span(html):
+    """
+    Find document.body.innerHTML by index search.
+    Returns (start, end) offsets such that html[start:end] is the body's innerHTML,
+    or None if html has no <body> tag. If there is no </body> tag, end is the end of html.
+    Only the body start tag is matched with a regex; the closing tag is found with rfind,
+    so the search is linear in the size of the document.
+    """
+    match = BODY_OPEN_REGEX.search(html)
+    if not match:
+        return None
+    start = find_tag_end(html, match.end() - 1)
+    if start == -1:
+        return None
+    # The last closing tag, like the greedy regex did. Try the common spellings with rfind first:
+    end = max(html.rfind(close, start) for close in ('</body', '</BODY', '</Body'))
+    if end == -1:
+        matches = list(BODY_CLOSE_REGEX.finditer(html, start))
+        end = matches[-1].start() if matches else len(html)
+    return start, end
+
+
+class UrlRewriter(object):
+    """
+    Make urls absolute, resolving them against baseurl.
+    Resolved urls are memoized, since reference-heavy papers repeat the same links many times.
+    The same rewriter can be used for several parts of the same document (e.g. when streaming).
+    """
+
+    def __init__(self, baseurl):
+        self.baseurl = baseurl
+        self.memo = {}
+
+    def join(self, url):
+        """ Return url resolved against baseurl (memoized). """
+        try:
+            return self.memo[url]
+        except KeyError:
+            self.memo[url] = absurl = urljoin(self.baseurl, url.strip())
+            return absurl
+
+    def join_srcset(self, srcset):
+        """ Resolve each url in srcset, e.g. "a.jpg 1x, b.jpg 2x". """
+        candidates = []
+        for candidate in srcset.split(','):
+            parts = candidate.strip().split(None, 1)
+            if parts:
+                parts[0] = self.join(parts[0])
+            candidates.append(" ".join(parts))
+        return ", ".join(candidates)
+
+    def repl(self, match):
+        """ Return match with url made absolute (regardless of its context, see subn). """
+        if match.group('css') is not None:
+            quote = match.group('cq')
+            return match.group('css') + quote + self.join(match.group('curl')) + quote + match.group('cssend')
+        attr = match.group('attr')
+        quote, value = ('"', match.group('dq')) if match.group('dq') is not None else ("'", match.group('sq'))
+        if attr[1:].rstrip(' \t\n\r\f=').lower() == 'srcset':
+            value = self.join_srcset(value)
+        else:
+            value = self.join(value)
+        return attr + quote + value + quote
+
+    def subn(self, html, pos=0, endpos=None):
+        """
+        Returns (new_html, number of urls rewritten).
+        If pos/endpos is given, only html[pos:endpos] is rewritten and returned.
+        Only matches in the right context are rewritten: attributes inside a <tag ...>, and
+        url() values inside a tag or a <style> element. The context is tracked by scanning
+        the text between consecutive matches, so the whole scan is still linear.
+        (html[pos:endpos] must not start inside a tag or <style> element.)
+        """
+        context = {'pos': pos, 'lt': -1, 'gt': -1, 'style': False, 'n': 0}
+
+        def repl(match):
+            """ Rewrite match if it is in the right context. """
+            start = match.start()
+            lt = html.rfind('<', context['pos'], start)
+            gt = html.rfind('>', context['pos'], start)
+            if lt != -1:
+                context['lt'] = lt
+                for tag in STYLE_TAG_REGEX.finditer(html, context['pos'], start):
+                    context['style'] = not tag.group(1)
+            if gt != -1:
+                context['gt'] = gt
+            context['pos'] = start
+            in_tag = context['lt'] > context['gt']
+            if not in_tag and not (context['style'] and match.group('css') is not None):
+                return match.group(0)
+            context['n'] += 1
+            return self.repl(match)
+
+        html, _ = sub_span(URL_REGEX, repl, html, pos, endpos)
+        return html, context['n']
+
+
 def make_urls_absolute(html, baseurl):
     """
     Ensure that all urls in html document is absolute, not relative.
+    All url-bearing attributes (href, src, srcset, etc, single or double quoted)
+    and CSS url() values are rewritten in a single scan of the document.
+    If the document has a <base href>, that is used to resolve urls.
     Consideration: Should you rewrite url fragments ?
         Why not:
           - It would be nice to use fragment/anchors in the text for navigation.
@@ -143,74 +472,114 @@ def make_urls_absolute(html, baseurl):
           - Many fragments are provided as divs with an id="<id>" attribute.
             Since the divs are completely stripped, the fragment is lost, and any anchors wouldn't work.
     """
-    # Replace href=:
-    tot = 0
-    fmt = None
-    for tag in ('href', 'src'):
-        fmt = tag + '="%s"' # e.g. 'href="%s"'
-        repl = lambda match: fmt % urljoin(baseurl, match.group(1))
-        (html, n) = re.subn(tag+'="([^"]*?)"', repl, html, flags=re.MULTILINE) # e.g. 'href="([^"]*?)"'
-        tot += n
-    #repl = lambda match: 'href="%s"' % urljoin(baseurl, match.group(1))
-    #(html, n) = re.subn('href="([^"]*?)"', repl, html)
-    #tot += n
-    ## Replace src=:
-    #repl = lambda match: 'src="%s"' % urljoin(baseurl, match.group(1))
-    #(html, n) = re.subn('src="([^"]*?)"', repl, html)
-    #tot += n
-    logger.info("%s link/href/src replaced in content.", tot)
+    rewriter = UrlRewriter(find_base_url(html, baseurl))
+    (html, tot) = rewriter.subn(html)
+    logger.info("%s link/href/src replaced in content (%s unique urls).", tot, len(rewriter.memo))
     return html
 
 
-def html_symbol_repl(html, url=None):
-    """
-    Make replacements in html (currently hardcoded, because...)
-    """
-
-    symbols = """alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi
-              omicron pi rho sigma tau upsilon phi chi psi omega""".split()
-    greek = [(r'<img\s[^>]*?src="/__chars/%s/[^>]*>' % char, "&#%s;" % code)
-             for code, char in enumerate(symbols, 945)]
-    #replacements = [('<img src="/__chars/alpha/[^>]*>', "&#945;"), # Greek mu = micro symbol
-    #                ('<img src="/__chars/mu/[^>]*>', "&#956;"), # Greek mu = micro symbol
-    #                ('<img src="/__chars/beta/[^>]*>', "&#956;"), # Greek mu = micro symbol
-    #                ('<img src="/__chars/mu/[^>]*>', "&#956;"), # Greek mu = micro symbol
-    #math = [('<img src="/__chars/math/special/times/[^>]*>', "&#215"), # Times/multiplication
-    #        ('<img src="/__chars/math/special/sim/[^>]*>', "&#126"), # Tilde/similarity
-    #        ('<img src="/__chars/math/special/plusmn/[^>]*>', "&#177"), # Plus-minus
-    #        ('<img src="/__chars/math/special/lfen/[^>]*>', "&#9001"), # Left bracket/chevron/fence
-    #        ('<img src="/__chars/math/special/rfen/[^>]*>', "&#9002"), # Right bracket/chevron/fence
-    #       ]
-#lt      66
-#gt      68
-#    symbols = """
-#sim     126
-#plusmn  177
-#times   215
-#lfen    9001
-#rfen    9002"""
-    symbols = (("sim", 126), ("plusmn", 177), ("times", 215), ("lfen", 9001), ("rfen", 9002))
-    math = [(r'<img\s[^>]*?src="/__chars/math/special/%s/[^>]*>' % char, "&#%s;" % code)
-            for char, code in symbols]
-
-    other = [(r'<img\s[^>]*?src="/__chars/less/special/le/[^>]*>', "&#8804"), # Less-than-or-equal
-             (r'<img\s[^>]*?src="/__chars/micro/[^>]*>', "&#956"), # Micro (looks similar to mu)
-             (r'<img\s[^>]*?src="/__chars/plus/special/plusmn/[^>]*>', "&#177"), # Plus-minus
-             #(r'<img src="/__chars/math/special/lfen/[^>]*>', "&#9001"), # Left bracket/chevron/fence
-             #(r'<img src="/__chars/math/special/rfen/[^>]*>', "&#9002"), # Right bracket/chevron/fence
-            ]
-    #le      8804
-
-    replace = greek + math + other
-    tot = 0
-    repl = None
-    for regex, rep in replace:
-        repl = lambda match: rep
-        (html, n) = re.subn(regex, repl, html, flags=re.MULTILINE+re.DOTALL)
-        tot += n
-    unrecognized = 'src="/__chars'
+SYMBOLS_FILEPATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "html_symbols.txt")
+
+
+def load_symbol_table(filepath=None):
+    """
+    Load symbol table from file (default: html_symbols.txt in this package).
+    Each line has a glyph path (what comes after /__chars/) and a replacement,
+    which is either a decimal unicode code point or a literal string, e.g.
+        mu                    956
+        math/special/times    215
+    Lines starting with '#' are comments.
+    Returns dict with glyph path -> replacement html.
+    """
+    if filepath is None:
+        filepath = SYMBOLS_FILEPATH
+    table = {}
+    with open(os.path.expanduser(filepath), encoding='utf-8') as fd:
+        for line in fd:
+            line = line.split(' #', 1)[0].strip()
+            if not line or line.startswith('#'):
+                continue
+            path, repl = line.split(None, 1)
+            repl = repl.strip()
+            table[path.strip('/')] = "&#%s;" % repl if repl.isdigit() else repl
+    return table
+
+
+class SymbolReplacer(object):
+    """
+    Replace glyph images (<img src="/__chars/<glyph>/...">) with html characters, in a single pass.
+    All glyph tags are found by one compiled regex; the replacement is found by dict lookup
+    of the glyph path. Glyph tags that are not in the symbol table are left as-is and counted.
+    """
+
+    # The glyph path is followed by style directories, e.g. black/med/base/glyph.gif,
+    # so the table is looked up with successively longer prefixes of the path:
+    regex = re.compile(r'<img\s[^>]*?src="/__chars/([^"]*)"[^>]*>')
+
+    def __init__(self, table):
+        self.table = table
+        self.max_depth = max((key.count('/') + 1 for key in table), default=0)
+
+    def lookup(self, path):
+        """ Return replacement for glyph path, or None if not recognized. """
+        parts = path.split('/', self.max_depth)
+        table = self.table
+        for depth in range(1, min(self.max_depth, len(parts)) + 1):
+            repl = table.get('/'.join(parts[:depth]))
+            if repl is not None:
+                return repl
+        return None
+
+    def subn(self, html, pos=0, endpos=None):
+        """
+        Replace all recognized glyphs in html.
+        Returns (new_html, number of replacements, dict with unrecognized glyph path -> count).
+        If pos/endpos is given, only html[pos:endpos] is processed and returned.
+        """
+        count = [0]
+        unrecognized = {}
+        lookup = self.lookup
+        def repl(match):
+            """ Return replacement for glyph tag match. """
+            rep = lookup(match.group(1))
+            if rep is None:
+                path = match.group(1)
+                unrecognized[path] = unrecognized.get(path, 0) + 1
+                return match.group(0)
+            count[0] += 1
+            return rep
+        html, _ = sub_span(self.regex, repl, html, pos, endpos)
+        return html, count[0], unrecognized
+
+
+_symbol_replacers = {}
+
+def get_symbol_replacer(filepath=None):
+    """
+    Return SymbolReplacer for the default symbol table, updated with symbols from filepath (if given).
+    Replacers are only created once per filepath.
+    """
+    if filepath not in _symbol_replacers:
+        table = load_symbol_table()
+        if filepath:
+            table.update(load_symbol_table(filepath))
+        _symbol_replacers[filepath] = SymbolReplacer(table)
+    return _symbol_replacers[filepath]
+
+
+def html_symbol_repl(html, url=None, symbols_filepath=None, pos=0, endpos=None):
+    """
+    Replace glyph images with html characters.
+    The symbols are read from html_symbols.txt, plus any extra symbols in symbols_filepath.
+    If pos/endpos is given, only html[pos:endpos] is processed and returned.
+    """
+    replacer = get_symbol_replacer(symbols_filepath)
+    html, tot, unrecognized = replacer.subn(html, pos, endpos)
+    n_unrecognized = sum(unrecognized.values())
     logger.info("%s symbols replaced (another %s possible symbols not recognized) in html from %s",
-                tot, html.count(unrecognized), url)
+                tot, n_unrecognized, url)
+    if unrecognized:
+        logger.info("Unrecognized symbols: %s", ", ".join(sorted(unrecognized)))
     print("%s symbols replaced (another %s possible symbols not recognized) in html from %s" \
-          %(tot, html.count(unrecognized), url))
+          %(tot, n_unrecognized, url))
     return html
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Shared, pooled requests sessions for all outbound http requests
+(article downloads, DOI lookups and pdf downloads).
+
+A plain requests.get() opens a new connection (DNS lookup, TCP and TLS handshakes)
+for every request and has no timeout. The sessions handed out by the registry keep
+connections alive in a pool per host (urllib3 does the pooling), and apply a default
+timeout to requests that do not specify one.
+
+Usage:
+    session = get_session()
+    r = session.get(url)
+    ...
+    print(SESSIONS.stats())   # {'opened': 3, 'reused': 41, 'requests': 44, 'hosts': {...}}
+
+The pool sizes and timeout can be set with configure_sessions(config), using the config
+parameters http_pool_connections, http_pool_maxsize and http_timeout.
+
+"""
+
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+import logging
+logger = logging.getLogger(__name__)
+
+
+# (connect timeout, read timeout) in seconds:
+DEFAULT_TIMEOUT = (10, 60)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter which applies a default timeout, and keeps connection counts
+    of pools that are evicted from the pool manager.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        self.evicted = {}
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        pools = self.poolmanager.pools
+        dispose = pools.dispose_func
+        def dispose_func(pool):
+            """ Record the pool's counts before it is closed. """
+            opened, requests_ = self.evicted.get(pool.host, (0, 0))
+            self.evicted[pool.host] = (opened + pool.num_connections, requests_ + pool.num_requests)
+            if dispose:
+                dispose(pool)
+        pools.dispose_func = dispose_func
+
+    def send(self, request, **kwargs):    # pylint: disable=W0221
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        return super().send(request, **kwargs)
+
+    def host_stats(self):
+        """ Return dict with host -> (connections opened, requests made). """
+        stats = dict(self.evicted)
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened, requests_ = stats.get(pool.host, (0, 0))
+            stats[pool.host] = (opened + pool.num_connections, requests_ + pool.num_requests)
+        return stats
+
+
+class SessionRegistry(object):
+    """
+    Registry of shared requests sessions, by name.
+    All sessions use pooled connections and a default timeout.
+    """
+
+    def __init__(self, pool_connections=32, pool_maxsize=16, timeout=DEFAULT_TIMEOUT):
+        """
+        Args:
+            pool_connections: Number of hosts to keep connection pools for.
+            pool_maxsize: Max number of connections kept alive per host
+                (should be at least the number of threads making requests to the same host).
+            timeout: Default timeout, seconds or (connect, read) tuple.
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._sessions = {}
+
+    def get(self, name='default'):
+        """ Return the session with the given name, creating it if needed. """
+        with self._lock:
+            session = self._sessions.get(name)
+            if session is None:
+                session = self._sessions[name] = self.make_session()
+            return session
+
+    def make_session(self):
+        """ Create a new session with pooled adapters. """
+        session = requests.Session()
+        adapter = PooledHTTPAdapter(timeout=self.timeout, pool_connections=self.pool_connections,
+                                    pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def configure(self, pool_connections=None, pool_maxsize=None, timeout=None):
+        """ Change settings. Existing sessions are closed, new sessions use the new settings. """
+        if pool_connections:
+            self.pool_connections = pool_connections
+        if pool_maxsize:
+            self.pool_maxsize = pool_maxsize
+        if timeout:
+            self.timeout = timeout
+        self.close()
+
+    def adapters(self):
+        """ Return list of all (distinct) adapters of the registered sessions. """
+        with self._lock:
+            sessions = list(self._sessions.values())
+        adapters = []
+        for session in sessions:
+            for adapter in session.adapters.values():
+                if isinstance(adapter, PooledHTTPAdapter) and adapter not in adapters:
+                    adapters.append(adapter)
+        return adapters
+
+    def stats(self):
+        """
+        Return dict with number of connections opened, connections reused and requests made,
+        in total and per host:
+            {'opened': n, 'reused': n, 'requests': n, 'hosts': {host: {'opened': n, 'requests': n}}}
+        """
+        hosts = {}
+        for adapter in self.adapters():
+            for host, (opened, requests_) in adapter.host_stats().items():
+                host_stats = hosts.setdefault(host, {'opened': 0, 'requests': 0})
+                host_stats['opened'] += opened
+                host_stats['requests'] += requests_
+        opened = sum(h['opened'] for h in hosts.values())
+        requests_ = sum(h['requests'] for h in hosts.values())
+        return {'opened': opened, 'reused': max(0, requests_ - opened), 'requests': requests_, 'hosts': hosts}
+
+    def close(self):
+        """ Close all sessions. """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            session.close()
+
+
+# The default registry:
+SESSIONS = SessionRegistry()
+
+
+def get_session(name='default'):
+    """ Return shared session from the default registry. """
+    return SESSIONS.get(name)
+
+
+def configure_sessions(config):
+    """ Configure the default registry from config parameters http_pool_connections, http_pool_maxsize and http_timeout. """
+    timeout = config.get('http_timeout')
+    if isinstance(timeout, list):
+        timeout = tuple(timeout)
+    SESSIONS.configure(pool_connections=config.get('http_pool_connections'),
+                       pool_maxsize=config.get('http_pool_maxsize'), timeout=timeout)
+    return SESSIONS
@@ -38,20 +38,43 @@ Ruby:
 """
 
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urljoin#, urlsplit
+import requests
 #import json
-import pickle
 #from six import string_types
 import logging
 logger = logging.getLogger(__name__)
 
 
 from .xauth_session import XAuthSession
+from .oauth_signer import FormBody
 from .utils import credentials_prompt, load_config, save_config#, load_consumer_keys
+from .ratelimit import TokenBucket, Backoff, AIMDController
+from .token_cache import TokenCache, DEFAULT_WINDOW
+from .state_store import StateStore, cookies_to_list, cookies_from_list
+from .models import from_json, parse_stream, Error, BookmarkList
 
 
 __version__ = 0.1
 
+# Streamed bookmarks/list responses are read in chunks of this size:
+STREAM_CHUNK_SIZE = 2**16
+
+
+def response_json(response):
+    """
+    Return the parsed json of response. The body is only parsed once:
+    the data is kept on the response (is_error, retry_code and check_response all need it).
+    """
+    try:
+        return response.parsed_json
+    except AttributeError:
+        pass
+    data = response.parsed_json = response.json()
+    return data
 
 
 def is_error(response):
@@ -82,7 +105,7 @@ def is_error(response):
     if response.status_code >= 300:
         return response.status_code
     try:
-        data = response.json()
+        data = response_json(response)
     except ValueError:
         # Not sure this should happen...
         if len(response.content) == 0:
@@ -115,14 +138,54 @@ def is_error(response):
             return 3
 
 
+# Instapaper API error codes that are worth retrying. Other 15xx codes are specific to the
+# request, e.g. 1550 (error generating text version, for videos and pdfs), and fail again:
+RATE_LIMIT_ERROR = 1040
+SERVICE_ERROR = 1500
+
+# Endpoints which can safely be requested again if the connection failed or timed out after
+# the request was sent (the request may have been processed). bookmarks/<id>/highlights is also idempotent.
+IDEMPOTENT_ENDPOINTS = frozenset([
+    'account/verify_credentials', 'bookmarks/list', 'bookmarks/get_text',
+    'bookmarks/update_read_progress', 'bookmarks/star', 'bookmarks/unstar', 'bookmarks/archive',
+    'bookmarks/unarchive', 'bookmarks/move', 'folders/list', 'folders/set_order',
+])
+
+
+def is_idempotent(endpoint):
+    """ Return True if endpoint can be requested again without duplicating its effect. """
+    return endpoint in IDEMPOTENT_ENDPOINTS or (endpoint.startswith('bookmarks/') and endpoint.endswith('/highlights'))
+
+
+def retry_code(response):
+    """
+    Return error code if response is a temporary error that should be retried, otherwise None:
+        1040 (rate-limit exceeded), 1500 (service error), HTTP 429 and 5xx.
+    Unlike is_error, this only parses the response if it looks like an API error.
+    """
+    if response.status_code >= 500 or response.status_code == 429:
+        return response.status_code
+    if b'"error"' not in response.content[:200]:
+        return None
+    try:
+        data = response_json(response)
+        code = data[0]["error_code"] if data[0]["type"] == "error" else None
+    except (ValueError, IndexError, KeyError, TypeError):
+        return None
+    if code in (RATE_LIMIT_ERROR, SERVICE_ERROR):
+        return code
+    return None
+
+
+def is_throttle(code):
+    """ Return True if retry code means that we are rate limited. """
+    return code in (RATE_LIMIT_ERROR, 429, 503)
+
 
-def save_cookies(fd, cookiejar):
-    """ Save cookiejar to file. """
-    pickle.dump(cookiejar, fd)
+def is_auth_error(response):
+    """ Return True if response means that the access tokens were rejected (HTTP 401/403). """
+    return response.status_code in (401, 403)
 
-def load_cookies(fd):
-    """ Load cookies from file. """
-    return pickle.load(fd)
 
 def print_bookmarks(bookmarks):
     if isinstance(bookmarks, dict):
@@ -166,8 +229,10 @@ class InstapaperClient(object):
     pass_prompt = credentials_prompt
 
     def __init__(self, config=None, consumer_key=None, consumer_secret=None,
-                 username=None, password='', headers=None, config_filepath=None):
+                 username=None, password='', headers=None, config_filepath=None, token_cache_filepath=None):
         """
+        token_cache_filepath: Default token verification cache, used if the config has no
+            token_cache_filepath (set it to '' in the config to disable the cache).
         filename or filepath?
          -- filepath is the better choice, because filename is sometimes
             interpreted as basename (myfile.txt) and sometimes the full
@@ -183,9 +248,16 @@ class InstapaperClient(object):
         self._password = password
         self.status = False
         self.parse_json = True # Mostly for debugging. Deactivate to return response objects.
+        # Return User/Bookmark/Folder/... objects instead of plain dicts (see models):
+        self.typed_responses = self.config.get('typed_responses', True)
+        # Parse bookmarks/list responses incrementally as they are downloaded:
+        self.stream_listings = self.config.get('stream_listings', True)
         self.apiurl = config.get('apiurl') or 'https://www.instapaper.com/api/1.1/'
         # Create xauth session:
         self.session = XAuthSession(consumer_key, consumer_secret)
+        # Sign requests with the fast HMAC-SHA1 signer, unless disabled:
+        if self.config.get('fast_oauth_signer', True):
+            self.session.enable_fast_signer()
         # Update headers:
         if self.config.get('headers'):
             self.headers.update(self.config['headers'])
@@ -195,9 +267,45 @@ class InstapaperClient(object):
             self.headers["User-Agent"] = "Instaporter-InstaClient/%s github.com/scholer/Instaporter - rasmusscholer@gmail.com" % __version__
         if self.cookies_filepath:
             self.load_cookies()
+        # Cache for bookmark texts (get_bookmark_text):
+        self.text_cache = None
+        if self.config.get('text_cache_filepath'):
+            from .text_cache import TextCache
+            self.text_cache = TextCache(self.config['text_cache_filepath'],
+                                        max_bytes=self.config.get('text_cache_max_bytes', 200*2**20))
+        # Rate limiting and retries (see post):
+        self.max_retries = self.config.get('api_max_retries', 4)
+        self.rate_limiter = TokenBucket(self.config['api_rate']) if self.config.get('api_rate') else None
+        self.backoff = Backoff(base=self.config.get('api_backoff_base', 0.5), cap=self.config.get('api_backoff_max', 30))
+        self.concurrency = AIMDController(initial=self.config.get('api_max_concurrency', 8),
+                                          maximum=self.config.get('api_max_concurrency', 8))
+        self.retries = 0
+        # Upload bodies (see add_bookmark): encode large form bodies as FormBody, unless disabled:
+        self.stream_uploads = self.config.get('stream_uploads', True)
+        self.upload_stats = {'uploads': 0, 'bytes': 0, 'encode_time': 0.0}
+        self._stats_lock = threading.Lock()
+        # Token verification (see verify_credentials and post):
+        self.access_tokens = None
+        self.verified = False
+        self._verify_lock = threading.Lock()
+        self.token_cache = None
+        if self.config.get('token_cache_filepath') is not None:
+            token_cache_filepath = self.config['token_cache_filepath']
+        if token_cache_filepath:
+            self.token_cache = TokenCache(token_cache_filepath,
+                                          window=self.config.get('token_verify_window', DEFAULT_WINDOW))
         # Update access_tokens:
         if 'access_tokens' in config:
             self.update_access_tokens(config['access_tokens'])
+            self.access_tokens = config['access_tokens']
+            userinfo = self.token_cache.get(self.access_tokens, username=self.username) \
+                if self.token_cache is not None else None
+            if userinfo:
+                # Tokens were verified recently; if they have been revoked since, post() re-verifies on the first 401.
+                logger.info("Access tokens were verified recently for %s; skipping verification.", userinfo[0]['username'])
+                self.status = True
+                self.username = userinfo[0]['username']
+                return
             userinfo = self.verify_credentials()
             logger.info("xAuth using existing access_tokens returned: %s", userinfo)
             if userinfo:
@@ -261,7 +369,10 @@ class InstapaperClient(object):
             self.config['cookies_filepath'] = cookies_filepath
 
     def save_cookies(self, filepath=None):
-        """ Saves session cookies """
+        """
+        Saves session cookies to the 'cookies' section of the StateStore file at filepath.
+        The file is written atomically, and only if the cookies changed.
+        """
         filepath = filepath or self.cookies_filepath
         if not filepath:
             logger.error("Could not save cookies, filepath/<type> is %s/%s", filepath, type(filepath))
@@ -269,31 +380,24 @@ class InstapaperClient(object):
         filepath = os.path.expanduser(filepath)
         logger.info("Saving cookies to file: %s", filepath)
         try:
-            with open(filepath, 'wb') as fd:
-                save_cookies(fd, self.cookies)
+            StateStore(filepath).replace('cookies', cookies_to_list(self.cookies))
             self.cookies_filepath = filepath
-        except FileNotFoundError:
-            logger.error("Could not save cookies to file: %s", filepath)
+        except (IOError, OSError) as e:
+            logger.error("Could not save cookies to file: %s (%s)", filepath, e)
 
     def load_cookies(self, filepath=None):
-        """ Saves session cookies """
+        """ Loads session cookies (saved with save_cookies). """
         filepath = filepath or self.cookies_filepath
         if not filepath:
-            logger.warning("Could not save cookies, filepath/<type> is %s/%s", filepath, type(filepath))
+            logger.warning("Could not load cookies, filepath/<type> is %s/%s", filepath, type(filepath))
             return
         filepath = os.path.expanduser(filepath)
         logger.info("Loading cookies from file: %s", filepath)
-        try:
-            with open(filepath, 'rb') as fd:
-                cookiejar = load_cookies(fd)
-                try:
-                    self.cookies.update(cookiejar)
-                except AttributeError:
-                    # self.cookie does not support update, it might be a http.cookiejar.CookieJar object
-                    self.cookies = cookiejar
-            self.cookies_filepath = filepath
-        except FileNotFoundError:
+        if not os.path.exists(filepath):
             logger.error("Could not load cookies from file: %s", filepath)
+            return
+        cookies_from_list(StateStore(filepath).get('cookies', []), self.cookies)
+        self.cookies_filepath = filepath
 
     def save_config(self, filepath=None):
         """
@@ -339,10 +443,10 @@ class InstapaperClient(object):
         tokens = self.session.request_access_tokens(url, username, password)
         if not tokens:
             return False
+        self.access_tokens = tokens
         userinfo = self.verify_credentials()
         if not userinfo:
             return False
-        self.access_tokens = tokens
         if persist_tokens is None:
             persist_tokens = self.config.get('persist_access_tokens') or bool(self.config.get('access_tokens'))
         if persist_tokens:
@@ -359,14 +463,35 @@ class InstapaperClient(object):
         """
         r = self.post('account/verify_credentials')
         try:
-            # r.json() has keys "user_id" and "username".
-            userinfo = r.json()
+            # The user object has keys "user_id" and "username".
+            userinfo = response_json(r)
             self.status = userinfo[0]["type"] == 'user' and 'username' in userinfo[0]
             self.username = userinfo[0]["username"]
-        except (ValueError, IndexError, KeyError):
+        except (ValueError, IndexError, KeyError, TypeError):
             print("Userinfo did not produce expected result:", r.text)
+            self.verified = False
+            if self.token_cache is not None and self.access_tokens:
+                self.token_cache.invalidate(self.access_tokens)
+            return False
+        self.verified = self.status
+        if self.status and self.token_cache is not None and self.access_tokens:
+            self.token_cache.put(self.access_tokens, userinfo)
+        return from_json(userinfo) if self.typed_responses else userinfo
+
+    def reverify(self, endpoint):
+        """
+        Verify access tokens after endpoint returned 401/403, unless they have already been verified
+        by this client (or the request was the verification itself).
+        Returns True if the tokens are OK and the request should be retried.
+        """
+        if endpoint == 'account/verify_credentials' or self.verified:
             return False
-        return userinfo
+        with self._verify_lock:
+            # Another thread may have verified the tokens while we waited:
+            if not self.verified:
+                logger.info("%s was rejected; verifying access tokens...", endpoint)
+                self.verify_credentials()
+        return self.verified
 
 
     def update_access_tokens(self, tokens):
@@ -380,17 +505,63 @@ class InstapaperClient(object):
 
     def clear_access_tokens(self):
         """ Removes access tokens from config and saves it. """
+        if self.token_cache is not None and self.config.get('access_tokens'):
+            self.token_cache.invalidate(self.config['access_tokens'])
         del self.config['access_tokens']
         self.save_config()
 
 
-    def post(self, endpoint, data=None):
+    def post(self, endpoint, data=None, stream=False):
         """
         Post data to REST endpoint.
         Instapaper specifies that parameters are never sent in the query string.
+        If stream is True, the body of a successful response is not read (see list_bookmarks).
+        Requests are limited by self.rate_limiter (config: api_rate, requests per second)
+        and self.concurrency (config: api_max_concurrency). Temporary errors (see retry_code)
+        and connection errors are retried up to api_max_retries times, with exponential backoff.
+        Connection errors and timeouts after the request may have been sent are only retried for
+        idempotent endpoints (see is_idempotent); e.g. bookmarks/add could otherwise be done twice.
+        If the access tokens have not been verified (see token_cache), a request rejected with
+        401/403 is retried once, if the tokens are OK.
         """
         url = self.get_resource_url(endpoint)
-        return self.session.post(url, data=data)
+        attempt = 0
+        reverified = False
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            with self.concurrency:
+                try:
+                    r = self.session.post(url, data=data, stream=stream)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    # A connect timeout means the request was never sent:
+                    retryable = isinstance(e, requests.exceptions.ConnectTimeout) or is_idempotent(endpoint)
+                    if attempt >= self.max_retries or not retryable:
+                        raise
+                    r, code = None, e
+                else:
+                    # (API errors are never returned with status 2xx, so a streamed body is only read for errors.)
+                    code = retry_code(r) if not stream or r.status_code >= 300 else None
+            if code is None:
+                self.concurrency.on_success()
+                if not reverified and is_auth_error(r) and self.reverify(endpoint):
+                    reverified = True
+                    continue
+                return r
+            if is_throttle(code):
+                self.concurrency.on_throttle()
+            if attempt >= self.max_retries:
+                logger.warning("%s failed with %s after %s retries.", endpoint, code, attempt)
+                return r
+            delay = self.backoff.delay(attempt)
+            retry_after = r.headers.get('Retry-After') if r is not None else None
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+            logger.info("%s failed with %s; retrying in %.2f s (attempt %s of %s).",
+                        endpoint, code, delay, attempt + 1, self.max_retries)
+            time.sleep(delay)
+            attempt += 1
+            self.retries += 1
 
 
     def check_response(self, response, json=None):
@@ -398,6 +569,8 @@ class InstapaperClient(object):
         Check whether response is ok and return the response's
         parsed json data (or the response object, if json=False).
         Use self.parse_json to control default json-parsing behaviour.
+        The data is returned as typed objects (see models.from_json), unless typed_responses is False.
+        The json is only parsed once.
         """
         if json is None:
             json = self.parse_json
@@ -411,10 +584,27 @@ class InstapaperClient(object):
             logger.debug("Response OK: Status code: %s", response.status_code)
             self.status = True
         if json:
-            return response.json()
+            data = response_json(response)
+            return from_json(data) if self.typed_responses else data
         else:
             return response
 
+    def check_stream(self, response):
+        """
+        Like check_response, for a streamed (stream=True) response: the json is parsed incrementally
+        as the body is downloaded (see models.parse_stream). Returns typed objects.
+        """
+        if response.status_code >= 300:
+            return self.check_response(response)
+        try:
+            data = parse_stream(response.iter_content(STREAM_CHUNK_SIZE))
+        finally:
+            response.close()
+        self.status = not (isinstance(data, list) and data and isinstance(data[0], Error))
+        if not self.status:
+            logger.info("Error response: %s", data)
+        return data
+
 
     ########################
     ##  Bookmark methods  ##
@@ -433,17 +623,91 @@ class InstapaperClient(object):
         highlights = ensure_string(highlights)
         data = {'limit': limit, 'folder_id': folder_id, 'have': have, 'highlights': highlights}
         data = {k: v for k, v in data.items() if v is not None}
+        if self.stream_listings and self.typed_responses and self.parse_json:
+            r = self.post('bookmarks/list', data=data, stream=True)
+            return self.check_stream(r)
         r = self.post('bookmarks/list', data=data)
         return self.check_response(r)
 
+    def iter_bookmarks(self, folders=None, batch=500, with_folder=False, have=None):
+        """
+        Generate all bookmarks in folders, requesting <batch> bookmarks at a time (max 500).
+        Pages are requested with the ids of the bookmarks already received from the folder as 'have',
+        so Instapaper only returns bookmarks we have not seen yet. While the caller consumes a page,
+        the next page (or the first page of the next folder) is requested in a background thread.
+        Only the current page is kept in memory (plus the ids for 'have').
+        Args:
+            folders: folder_id or list of folder_ids. Default: unread, archive and all user folders
+                (starred bookmarks are also in one of these).
+            batch: Number of bookmarks per request.
+            with_folder: Yield (folder_id, bookmark) instead of just the bookmark.
+            have: dict with str(folder_id) -> bookmark ids which the caller already has from the folder.
+                These are included in 'have' from the first page, so they are neither listed nor yielded.
+        Raises ValueError if a bookmarks/list request fails.
+        """
+        if folders is None:
+            folders = ['unread', 'archive'] + [folder['folder_id'] for folder in self.list_folders()
+                                               if folder.get('type') == 'folder']
+        elif isinstance(folders, (str, int)):
+            folders = [folders]
+        folders = list(folders)
+        have = have or {}
+
+        def known(index):
+            """ Return set of bookmark ids the caller already has from folders[index]. """
+            return {int(bid) for bid in have.get(str(folders[index]), ())}
+
+        def fetch(folder_id, have_ids):
+            """ Request a page of bookmarks (called in the read-ahead thread). """
+            listing = self.list_bookmarks(limit=batch, folder_id=folder_id, have=have_ids or None)
+            if not isinstance(listing, (dict, BookmarkList)):
+                raise ValueError("bookmarks/list failed for folder %s: %s" % (folder_id, listing))
+            return [b for b in listing.get('bookmarks', []) if b.get('type', 'bookmark') == 'bookmark']
+
+        executor = ThreadPoolExecutor(max_workers=1)
+        seen = known(0) if folders else set()
+        future = executor.submit(fetch, folders[0], ','.join(str(bid) for bid in seen)) if folders else None
+        index = 0
+        try:
+            while future is not None:
+                folder_id = folders[index]
+                bookmarks = future.result()
+                new = [b for b in bookmarks if b['bookmark_id'] not in seen]
+                seen.update(b['bookmark_id'] for b in new)
+                # Read ahead: request the next page, or the next folder if this was the last page:
+                if len(bookmarks) >= batch and new:
+                    future = executor.submit(fetch, folder_id, ','.join(str(bid) for bid in seen))
+                else:
+                    index += 1
+                    seen = known(index) if index < len(folders) else set()
+                    future = (executor.submit(fetch, folders[index], ','.join(str(bid) for bid in seen))
+                              if index < len(folders) else None)
+                for bookmark in new:
+                    yield (folder_id, bookmark) if with_folder else bookmark
+                bookmarks = new = None
+        finally:
+            if future is not None:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def bulk_apply(self, op, bookmark_ids, folder_id=None, workers=8, retries=1, report=None, progress=None):
+        """
+        Apply op (archive, unarchive, star, unstar, move or delete) to many bookmarks concurrently.
+        Returns BulkReport with the bookmarks that succeeded and failed. See bulk.bulk_apply.
+        """
+        from .bulk import bulk_apply
+        return bulk_apply(self, op, bookmark_ids, folder_id=folder_id, workers=workers, retries=retries,
+                          report=report, progress=progress)
+
 
     def add_bookmark(self, url=None, title=None, description=None, folder_id=None,
-                     resolve_final_url=1, content=None, is_private_from_source=None):
+                     resolve_final_url=1, content=None, is_private_from_source=None, json=None):
         """
         Add a bookmark.
         Returns:
             On success: a list with one dict describing the added bookmark. (json parsed)
             On API err: a list with one dict describing the error.
+            With json=False, the response object is returned instead (see check_response).
         Uh... If parameters are passed in the body as a urlencoded line.. How do I pass the content?
         - should the content be escaped in any way?
         Input parameters:
@@ -461,8 +725,33 @@ class InstapaperClient(object):
                 'folder_id': folder_id, 'resolve_final_url': resolve_final_url,
                 'content': content, 'is_private_from_source': is_private_from_source}
         data = {k: v for k, v in data.items() if v is not None}
+        encode_time = None
+        if self.stream_uploads and self.session.fast_signer:
+            # Escape each value once; the escaped values are signed and sent as-is (see oauth_signer.FormBody):
+            start = time.perf_counter()
+            data = FormBody(data)
+            encode_time = time.perf_counter() - start
         r = self.post('bookmarks/add', data=data)
-        return self.check_response(r)
+        self.record_upload(r, data, encode_time)
+        return self.check_response(r, json=json)
+
+    def record_upload(self, response, data, encode_time=None):
+        """
+        Add an upload to self.upload_stats and log payload bytes and encode time.
+        encode_time is None if the body was encoded by requests (in which case it is not known).
+        """
+        if isinstance(data, FormBody):
+            nbytes = len(data)
+        else:
+            nbytes = int(response.request.headers.get('Content-Length') or 0) if response is not None else 0
+        with self._stats_lock:
+            self.upload_stats['uploads'] += 1
+            self.upload_stats['bytes'] += nbytes
+            self.upload_stats['encode_time'] += encode_time or 0.0
+        if encode_time is not None:
+            logger.info("Upload: %s bytes payload, encoded in %.1f ms.", nbytes, encode_time*1000)
+        else:
+            logger.info("Upload: %s bytes payload.", nbytes)
 
     def delete_bookmark(self, bookmark_id):
         """ Delete bookmark by id. """
@@ -472,7 +761,8 @@ class InstapaperClient(object):
         if ret == []:
             logger.debug("Bookmark successfully deleted: %s", bookmark_id)
         else:
-            logger.info("Bookmark deletion (%s) did not succeed: %s", bookmark_id, r.json())
+            logger.info("Bookmark deletion (%s) did not succeed: %s", bookmark_id, ret)
+        return ret
 
     def star_bookmark(self, bookmark_id):
         """ Star bookmark by id. """
@@ -494,12 +784,23 @@ class InstapaperClient(object):
         r = self.post('bookmarks/move', data={'bookmark_id': bookmark_id, 'folder_id': folder_id})
         return self.check_response(r)
 
-    def get_bookmark_text(self, bookmark_id):
-        """ Get text for bookmark with bookmark_id. """
+    def get_bookmark_text(self, bookmark_id, bookmark_hash=None):
+        """
+        Get text for bookmark with bookmark_id.
+        If the client has a text_cache, the text is read from the cache if present
+        (and stored with the same bookmark_hash, if given), and stored in the cache otherwise.
+        """
+        if self.text_cache is not None:
+            text = self.text_cache.get(bookmark_id, bookmark_hash)
+            if text is not None:
+                self.status = True
+                return text
         r = self.post('bookmarks/get_text', data={'bookmark_id': bookmark_id})
         #return self.check_response(r)
         # You cannot just do check_response since it returns HTML, not JSON.
         self.status = r.ok
+        if r.ok and self.text_cache is not None:
+            self.text_cache.put(bookmark_id, bookmark_hash, r.text)
         return r.text
 
 
@@ -28,9 +28,13 @@ REST API doc: www.instapaper.com/api/full
 
 """
 
+import io
 import os
+import sys
 import re
-import requests
+import json
+import itertools
+import threading
 import argparse
 from urllib.parse import urlparse #urljoin, #, urlsplit
 from six import string_types
@@ -40,21 +44,34 @@ from warnings import warn
 #import pdb
 
 
-try:
-    from ezfetcher.pdffetcher import fetch_pdf
-    from ezfetcher.ezclient import EzClient
-    from ezfetcher.utils import load_config as ez_load_config
-except ImportError as e:
-    warn(e)
-    warn("instaporter.instaporter: Could not import ezfetcher library; ezclient will not be available.")
+# Optional and command-specific modules (ezfetcher, zotero_utils/pyzotero, clipboard backends, the sqlite
+# stores, the server, etc.) are imported by the functions that use them, so a run only pays the import time
+# for what it actually uses. See tests/benchmark_startup.py.
+from .instapaper import InstapaperClient, is_error
+from .utils import init_logging, credentials_prompt, load_consumer_keys, ConfigLoader#, get_config, load_config, save_config
+from .html_utils import make_urls_absolute, html_symbol_repl, find_metadata, find_base_url, get_doi_data, \
+    find_body_span
+from .doi_cache import configure_doi_cache, get_doi_cache
+from .http_session import get_session, configure_sessions, SESSIONS
+from .token_cache import DEFAULT_FILEPATH as TOKEN_CACHE_FILEPATH
 
+LIBDIR = os.path.dirname(os.path.realpath(__file__))
 
-from .instapaper import InstapaperClient
-from .utils import init_logging, credentials_prompt, load_consumer_keys, get_config#, load_config, save_config
-from .html_utils import make_urls_absolute, html_symbol_repl, find_metadata
-from .zotero_utils import add_to_zotero
 
-LIBDIR = os.path.dirname(os.path.realpath(__file__))
+def import_ezfetcher():
+    """
+    Import the ezfetcher library on first use.
+    Returns the ezfetcher module, or None if it is not available.
+    """
+    try:
+        import ezfetcher.pdffetcher
+        import ezfetcher.ezclient
+        import ezfetcher.utils
+    except ImportError as e:
+        warn(e)
+        warn("instaporter.instaporter: Could not import ezfetcher library; ezclient will not be available.")
+        return None
+    return ezfetcher
 
 
 #from html.parser import HTMLParser
@@ -73,20 +90,23 @@ LIBDIR = os.path.dirname(os.path.realpath(__file__))
 def get_body_innerhtml(html):
     """
     Returns document.body.innerHTML.
-    The implementation is currently rather crude, relying soly on a single regex.
-    Returns None if no match is found.
+    The body is located with find_body_span, which runs in linear time;
+    if there is no closing </body> tag, everything after <body> is returned.
+    Returns None if no <body> tag is found.
     """
-    match = re.search("<body ?.*?>(.*)</body>", html, flags=re.DOTALL+re.IGNORECASE)
-    if match:
-        innerhtml = match.group(1)
+    span = find_body_span(html)
+    if span:
+        innerhtml = html[span[0]:span[1]]
         logger.debug("Returning body innerhtml with %s chars.", len(innerhtml))
         return innerhtml
-    logger.debug("Regex search did not find any match for body: %s", match)
+    logger.debug("No <body> tag found in html.")
 
 def transport_files(client, files, args):
     """
     Upload content from files to Instapaper.
     """
+    if isinstance(files, string_types):
+        files = [files]
     for filepath in files:
         with open(filepath) as fd:
             content = fd.read()
@@ -122,7 +142,8 @@ def get_ezclient_config(args):
             ez_config = args
         elif ezclient_config == "default":
             # this together with ez_load_config is only way to get default config.
-            ez_config = ez_load_config()
+            ezfetcher = import_ezfetcher()
+            ez_config = ezfetcher.utils.load_config() if ezfetcher is not None else None
         else:
             if ezclient_config_filepath and ezclient_config:
                 logger.warning("""ezclient_config and ezclient_config_filepath are both specified! \
@@ -140,41 +161,108 @@ it is not a dict or string!""", ezclient_config, ezclient_config_filepath)
     return ez_config, ezclient_config_filepath
 
 
-def transport_url(instaclient, url, args):
+def get_ezclient(args):
     """
-    Download content from url and upload to Instapaper.
+    Create EzClient from ezclient_config/ezclient_config_filepath args.
+    Returns None if neither is specified in args.
     """
-    # Session to download content:
     ezclient_config = args.get('ezclient_config')
     ezclient_config_filepath = args.get('ezclient_config_filepath')
     if ezclient_config or ezclient_config_filepath:
-        # Use ezfetcher.ezclient.EzClient to download content:
+        ezfetcher = import_ezfetcher()
+        if ezfetcher is None:
+            logger.warning("ezclient_config is specified, but ezfetcher is not available; using regular session.")
+            return None
         ezclient_config, ezclient_config_filepath = get_ezclient_config(args)
-        ezclient = EzClient(config=ezclient_config, config_filepath=ezclient_config_filepath)
+        return ezfetcher.ezclient.EzClient(config=ezclient_config, config_filepath=ezclient_config_filepath)
+    logger.warning("""ezclient_config or ezclient_config_filepath not specified in config; will use regular \
+requests.Session object to download content. (%s, %s)""", ezclient_config, ezclient_config_filepath)
+
+
+def fetch_url(url, args, ezclient=None):
+    """
+    Download content from url and find metadata.
+    Uses ezclient if given, otherwise the shared pooled session.
+    Returns (response, metadata).
+    """
+    if ezclient is not None:
+        # Use ezfetcher.ezclient.EzClient to download content:
         r = ezclient.get(url)
     else:
-        logger.warning("""ezclient_config or ezclient_config_filepath not specified in config; will use regular \
-requests.Session object to download content. (%s, %s)""", ezclient_config, ezclient_config_filepath)
-        r = requests.get(url)
-    html = r.text
-    #title = get_doc_title(html)
-    metadata = find_metadata(html, url)
-    # If innerhtml is None, provide the full html document.
-    content = get_body_innerhtml(html) or html
+        r = get_session().get(url)
+    # find_metadata may query dx.doi.org, so this belongs with the fetching.
+    metadata = find_metadata(r.text, url)
+    return r, metadata
+
+
+def fetch_url_stream(url, args, ezclient=None):
+    """
+    Download content from url and process it as it arrives, using a small working buffer
+    instead of holding several full copies of the document in memory.
+    Returns (response, metadata, content).
+    Note: The response content is consumed, so it cannot be used for fetch_pdf.
+    The content is decoded with the response encoding (as r.text is); if the response has none,
+    the encoding is found from the start of the document (r.apparent_encoding would need all of it).
+    """
+    from .html_stream import process_stream
+    get = ezclient.get if ezclient is not None else get_session().get
+    r = get(url, stream=True)
+    out = io.StringIO()
+    processor = process_stream(r.iter_content(args.get('stream_chunk_size', 2**16)), url, out,
+                               symbols_filepath=args.get('html_symbols_filepath'), encoding=r.encoding)
+    r.close()
+    metadata = find_metadata(processor.head, url)
+    if not metadata['html']['doi'] and processor.doi:
+        # The DOI was not in <head>, but found in the body:
+        metadata['html']['doi'] = processor.doi
+        metadata['doi'] = get_doi_data(processor.doi)
+    return r, metadata, out.getvalue()
+
+
+def fetch_and_rewrite(url, args, ezclient=None):
+    """
+    Download content from url, find metadata and rewrite content.
+    Uses streaming processing if the stream_html config parameter is set
+    (and download_pdf is not, since that needs the full response).
+    Returns (response, metadata, content).
+    """
+    if args.get('stream_html'):
+        if not args.get('download_pdf'):
+            return fetch_url_stream(url, args, ezclient)
+        logger.info("stream_html is not compatible with download_pdf; downloading full document.")
+    r, metadata = fetch_url(url, args, ezclient)
+    return r, metadata, rewrite_content(r.text, url, args)
+
+
+def rewrite_content(html, url, args=None):
+    """
+    Extract body.innerHTML from html and rewrite symbols and urls.
+    Extra glyph symbols can be given with the html_symbols_filepath config parameter.
+    Returns the content to upload to Instapaper.
+    """
+    if args is None:
+        args = {}
+    # The <base href> is in <head>, so find it before extracting the body:
+    baseurl = find_base_url(html, url)
+    # Only process body.innerHTML; if there is no <body>, provide the full html document.
+    # The body is not sliced out; symbol replacement works directly on the span of html:
+    start, end = find_body_span(html) or (0, len(html))
+    if start == end:
+        start, end = 0, len(html)
     # FIXED: Get body.innerHTML.
     # FIXED: Rewrite all hrefs to absolute instead of relative URLs + nature's symbol replacement:
     # Fixed: Add title.
-    content = html_symbol_repl(content, url)    # Do this *before* converting URLs.
-    content = make_urls_absolute(content, url)
-    #with open(os.path.expanduser('~\\temp_full.html'), 'w') as fp:
-    #    fp.write(content)
-    # It seems is_private_from_source needs to be set, otherwise
-    # Instapaper will download content from url rather than the content provided by me.
-    #pdb.set_trace()
-    bookmark = add_bookmark(instaclient, content, metadata, args=args)
-    print("Instapaper bookmark added: ", bookmark)
+    content = html_symbol_repl(html, url, args.get('html_symbols_filepath'),
+                               pos=start, endpos=end)    # Do this *before* converting URLs.
+    content = make_urls_absolute(content, baseurl)
+    return content
 
-    # Download pdf from url as well:
+
+def transport_attachments(r, metadata, args, ezclient=None):
+    """
+    Download pdf from the response (if download_pdf is set) and add item to Zotero (if zotero_config is set).
+    """
+    url = metadata.get('url') or r.url
     download_pdf = args.get('download_pdf')
     urlstruct = urlparse(url)
     pdf_filepath = None
@@ -187,28 +275,316 @@ requests.Session object to download content. (%s, %s)""", ezclient_config, ezcli
             # Note: Should args be ezclient_config? Or the Instaporter args/config?
             # TODO: If pdf url filename is too generic, make something more appropriate?
             # DONE: If filename already exists, do checksum calculation to detect identical file.
-            # fetch_pdf returns None if no pdf was found:
-            pdf_filepath = fetch_pdf(r.url, args, ezclient, r=r, metadata=metadata)
+            # fetch_pdf returns None if no pdf was found.
+            # Without an EzClient, the shared session is used for the pdf download:
+            ezfetcher = import_ezfetcher()
+            if ezfetcher is not None:
+                pdf_filepath = ezfetcher.pdffetcher.fetch_pdf(
+                    r.url, args, ezclient if ezclient is not None else get_session(), r=r, metadata=metadata)
         else:
             logger.info("download_pdf is specified and iterable, but url.netloc is not in download_pdf. (%s not in %s)",
                         urlstruct.netloc, download_pdf)
     zotero_config = args.get('zotero_config')
     if zotero_config:
+        # Imports pyzotero, so only import when needed:
+        from .zotero_utils import add_to_zotero
         # Args: config, metadata, pdf=None, collections=None,
         add_to_zotero(zotero_config, metadata, pdf=pdf_filepath)
 
 
+def transport_url(instaclient, url, args, ezclient=None):
+    """
+    Download content from url and upload to Instapaper.
+    Returns the added bookmark (or the upload queue job_id, if the upload queue is used).
+    """
+    # Session to download content:
+    if ezclient is None:
+        ezclient = get_ezclient(args)
+    r, metadata, content = fetch_and_rewrite(url, args, ezclient)
+    #with open(os.path.expanduser('~\\temp_full.html'), 'w') as fp:
+    #    fp.write(content)
+    # It seems is_private_from_source needs to be set, otherwise
+    # Instapaper will download content from url rather than the content provided by me.
+    #pdb.set_trace()
+    queue = get_upload_queue(args)
+    if queue is not None:
+        from .upload_queue import drain_queue
+        # Store content before uploading, so it is not lost if the upload fails:
+        bookmark = enqueue_bookmark(queue, content, metadata, args)
+        stats = drain_queue(queue, instaclient, workers=1)
+        queue.close()
+        print("Instapaper bookmarks uploaded from queue: ", stats)
+    else:
+        bookmark = add_bookmark(instaclient, content, metadata, args=args)
+        print("Instapaper bookmark added: ", bookmark)
+
+    # Download pdf from url as well:
+    transport_attachments(r, metadata, args, ezclient)
+    return bookmark
 
 
-def add_bookmark(client, content, metadata, description=None, args=None):
-    """ Wrapper to add Instapaper bookmark. """
+def transport_urls(instaclient, urls, args, ezclient=None):
+    """
+    Download content from many urls and upload to Instapaper.
+    The urls are processed by a staged pipeline (fetch -> rewrite -> upload),
+    where each stage has its own worker threads and the stages are connected by bounded queues.
+    The number of workers per stage are set by the fetch_workers, rewrite_workers and upload_workers
+    config parameters, and the queue size by pipeline_queue_size.
+    If the upload_queue_filepath config parameter is set, the upload stage only puts the content
+    in the durable upload queue, which is drained by upload_workers threads at the same time.
+    Returns dict with url -> result, as returned by Pipeline.run(), also for a single url
+    (which is transported directly, without the pipeline). Failed uploads have status 'error'.
+    """
+    from .pipeline import Pipeline
+    from .upload_queue import drain_queue
+    urls = [url.strip() for url in urls if url and url.strip()]
+    if ezclient is None:
+        ezclient = get_ezclient(args)
+    if len(urls) == 1:
+        try:
+            return {urls[0]: {'status': 'ok', 'result': transport_url(instaclient, urls[0], args, ezclient)}}
+        except Exception as e:    # pylint: disable=W0703
+            logger.exception("Could not transport %s", urls[0])
+            return {urls[0]: {'status': 'error', 'stage': 'transport', 'error': e}}
+
+    stream = args.get('stream_html') and not args.get('download_pdf')
+
+    def fetch(url):
+        """ Fetch stage: download and find metadata (and rewrite, if streaming). """
+        if stream:
+            return (url,) + fetch_url_stream(url, args, ezclient)
+        r, metadata = fetch_url(url, args, ezclient)
+        return url, r, metadata, None
+
+    def rewrite(job):
+        """ Rewrite stage: extract body, replace symbols and make urls absolute. """
+        url, r, metadata, content = job
+        if content is None:
+            content = rewrite_content(r.text, url, args)
+        return url, r, metadata, content
+
+    queue = get_upload_queue(args)
+
+    def upload(job):
+        """ Upload stage: add Instapaper bookmark (or put it in the upload queue), then pdf and Zotero. """
+        url, r, metadata, content = job
+        if queue is not None:
+            bookmark = enqueue_bookmark(queue, content, metadata, args)
+        else:
+            bookmark = add_bookmark(instaclient, content, metadata, args=args)
+        transport_attachments(r, metadata, args, ezclient)
+        return bookmark
+
+    pipeline = Pipeline([('fetch', fetch, args.get('fetch_workers', 4)),
+                         ('rewrite', rewrite, args.get('rewrite_workers', 2)),
+                         ('upload', upload, 1 if queue is not None else args.get('upload_workers', 2))],
+                        queue_size=args.get('pipeline_queue_size', 8))
+    if queue is not None:
+        # Drain the upload queue while the pipeline fills it:
+        pipeline_done = threading.Event()
+        drainer = threading.Thread(target=drain_queue, args=(queue, instaclient),
+                                   kwargs={'workers': args.get('upload_workers', 2), 'wait': pipeline_done})
+        drainer.start()
+        try:
+            results = pipeline.run(urls)
+        finally:
+            pipeline_done.set()
+            drainer.join()
+        print("Upload queue: %(pending)s pending, %(done)s done, %(failed)s failed." % queue.counts())
+        queue.close()
+    else:
+        results = pipeline.run(urls)
+    failed = {url: res for url, res in results.items() if res['status'] != 'ok'}
+    print("%s of %s urls transported to Instapaper (%s duplicates skipped)." %
+          (len(results) - len(failed), len(results), pipeline.duplicates))
+    if instaclient.upload_stats['uploads']:
+        print("Uploaded %(uploads)s bookmarks, %(bytes)s bytes (encoding took %(encode_time).3f s)."
+              % instaclient.upload_stats)
+    for url, res in failed.items():
+        print(" - FAILED in %s stage: %s (%s)" % (res.get('stage'), url, res.get('error')))
+    return results
+
+
+def sync_mirror(client, folders, args):
+    """
+    Sync local mirror of Instapaper folders, bookmarks and highlights.
+    The mirror file is given by the mirror_filepath config parameter.
+    """
+    from .mirror import BookmarkMirror
+    mirror = BookmarkMirror(client, args.get('mirror_filepath'))
+    try:
+        stats = mirror.sync(folders=folders, workers=args.get('sync_workers', 4))
+    finally:
+        mirror.close()
+    for folder_id, folder_stats in stats.items():
+        print("Folder %(folder)s: %(updated)s bookmarks updated, %(deleted)s deleted (%(requests)s requests)"
+              % dict(folder_stats, folder=folder_id))
+    return stats
+
+
+def prefetch(client, folder_id, args):
+    """
+    Warm the bookmark text cache for all bookmarks in folder.
+    Uses the text_cache_filepath config parameter, or the default cache location.
+    """
+    from .text_cache import TextCache, prefetch_texts
+    if client.text_cache is None:
+        client.text_cache = TextCache(args.get('text_cache_filepath'),
+                                      max_bytes=args.get('text_cache_max_bytes', 200*2**20))
+    stats = prefetch_texts(client, folder_id=folder_id, workers=args.get('prefetch_workers', 4))
+    print("Folder %s: %s texts fetched, %s already cached, %s failed." %
+          (folder_id, stats['fetched'], stats['cached'], stats['failed']))
+    return stats
+
+
+def bulk_operation(client, op, bookmark_ids, from_folder, to_folder, args):
+    """
+    Apply bulk operation (archive, unarchive, star, unstar, move, delete) to bookmark_ids and/or
+    all bookmarks in from_folder. Uses bulk_workers (default 8) concurrent requests and retries
+    failed bookmarks bulk_retries times (default 1).
+    If the bulk_report config parameter is given, the report is saved to that file (also if interrupted),
+    and bookmarks which succeeded in an earlier run with the same report file are skipped.
+    """
+    from .bulk import BulkReport
+    if not bookmark_ids and from_folder is None:
+        print("No bookmark ids or folder given; nothing to do.")
+        return None
+    if op == 'move' and to_folder is None:
+        print("The move operation requires --to_folder.")
+        return None
+    report_filepath = args.get('bulk_report')
+    if report_filepath and os.path.exists(os.path.expanduser(report_filepath)):
+        report = BulkReport.load(report_filepath)
+        print("Resuming from %s: %s bookmarks already done, %s failed." %
+              (report_filepath, len(report.succeeded), len(report.failed)))
+    else:
+        report = BulkReport(op, to_folder)
+    bookmarks = client.iter_bookmarks(from_folder, batch=500) if from_folder is not None else []
+
+    def progress(result, n_done, n_failed):
+        """ Print progress counter. """
+        print("\r%s: %s done, %s failed" % (op, n_done, n_failed), end='', flush=True)
+
+    try:
+        client.bulk_apply(op, itertools.chain(bookmark_ids, bookmarks), folder_id=to_folder,
+                          workers=args.get('bulk_workers') or 8,
+                          retries=args.get('bulk_retries') if args.get('bulk_retries') is not None else 1,
+                          report=report, progress=progress)
+    finally:
+        print()
+        if report_filepath:
+            report.save(report_filepath)
+    print(report.summary())
+    for bookmark_id, error in sorted(report.failed.items()):
+        print(" - FAILED: %s (%s)" % (bookmark_id, error))
+    return report
+
+
+def export_account(client, directory, folders, args):
+    """
+    Export all bookmarks (or the bookmarks in folders) with texts and highlights to directory.
+    Texts and highlights are fetched by export_workers (default 8) concurrent requests.
+    If directory has an earlier (interrupted) export, it is resumed.
+    """
+    from .export import AccountExport
+    exporter = AccountExport(client, directory, workers=args.get('export_workers') or 8)
+
+    def progress(bookmark_id, error, stats):
+        """ Print progress counter. """
+        print("\rExported %s bookmarks (%s resumed), %s failed" %
+              (stats['exported'], stats['resumed'], len(exporter.failed)), end='', flush=True)
+
+    try:
+        stats = exporter.run(folders or None, progress=progress)
+    finally:
+        print()
+    print("Exported %s bookmarks to %s (%s from an earlier run), %.1f MB texts, %s failed, %.1f s." % (
+        stats['exported'], exporter.directory, stats['resumed'], stats['text_bytes'] / 2**20,
+        stats['failed'], stats['elapsed']))
+    for bookmark_id, error in sorted(exporter.failed.items()):
+        print(" - FAILED: %s (%s)" % (bookmark_id, error))
+    if stats['failed']:
+        print("Run the export again to retry the failed bookmarks.")
+    return stats
+
+
+def resolve_doi_list(dois, args):
+    """
+    Resolve DOIs concurrently and print one json line per DOI, as the lookups complete:
+        {"doi": <doi>, "title": <title or null>, "data": <CSL data or null>}
+    Uses the doi_workers and doi_per_host config parameters.
+    """
+    from .doi_resolver import resolve_dois, DOI_FLIGHTS
+    stats = {'resolved': 0, 'failed': 0}
+    for doi, data in resolve_dois(dois, workers=args.get('doi_workers') or 16,
+                                  per_host=args.get('doi_per_host') or 8):
+        stats['resolved' if data else 'failed'] += 1
+        print(json.dumps({'doi': doi, 'title': (data or {}).get('title'), 'data': data}))
+        sys.stdout.flush()
+    logger.info("DOI resolution stats: %s (%s lookups coalesced)", stats, DOI_FLIGHTS.coalesced)
+    return stats
+
+
+def serve_jobs(client, args, config_loader=None):
+    """
+    Run resident server, which keeps the Instapaper client, EzClient and http connection pools
+    in memory and processes url and file jobs submitted by e.g. bin/instap_client.py.
+    See server.serve for config parameters.
+    If config_loader (a utils.ConfigLoader for args) is given, edits to the config file
+    are picked up before each job.
+    """
+    from .server import serve
+    ezclient = get_ezclient(args)
+
+    def reloading(func):
+        """ Reload config (if changed, and between jobs) before calling func. """
+        def handler(items):
+            """ Job handler. """
+            if config_loader is None:
+                return func(items)
+            with config_loader.job():
+                return func(items)
+        return handler
+
+    handlers = {'url': reloading(lambda urls: transport_urls(client, urls, args, ezclient=ezclient)),
+                'file': reloading(lambda files: transport_files(client, files, args))}
+
+    def stats():
+        """ Extra statistics for the /status endpoint. """
+        doi_cache = get_doi_cache()
+        return {'http': SESSIONS.stats(), 'doi_cache': doi_cache.stats() if doi_cache is not None else None,
+                'username': client.username}
+
+    serve(handlers, args, stats_func=stats)
+
+
+def read_urls(filepath):
+    """
+    Read urls from file, one url per line. If filepath is '-', urls are read from stdin.
+    Empty lines and lines starting with '#' are ignored.
+    """
+    if filepath == '-':
+        lines = sys.stdin.readlines()
+    else:
+        with open(filepath) as fd:
+            lines = fd.readlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith('#')]
+
+
+
+def bookmark_payload(content, metadata, description=None, args=None):
+    """ Return add_bookmark keyword arguments for uploading content with metadata. """
     if metadata is None:
         metadata = {}
+    if args is None:
+        args = {}
+    html_metadata = metadata.get('html') or {}
+    doi_metadata = metadata.get('doi') or {}
     is_private_from_source = "Scientific journal"
-    title = metadata['html'].get('title') or args.get('title')
+    title = html_metadata.get('title') or args.get('title')
     if description is None:
-        description = metadata['html'].get('abstract') or \
-                        metadata['doi'].get('abstract') or \
+        description = html_metadata.get('abstract') or \
+                        doi_metadata.get('abstract') or \
                         args.get('description')
     kwargs = {'is_private_from_source': is_private_from_source,
               #'url': url,
@@ -216,12 +592,56 @@ def add_bookmark(client, content, metadata, description=None, args=None):
               'description': description,
               'resolve_final_url': 0,
               'content': content}
+    return kwargs
+
+
+def add_bookmark(client, content, metadata, description=None, args=None):
+    """ Wrapper to add Instapaper bookmark. Raises ValueError if the bookmark could not be added. """
+    kwargs = bookmark_payload(content, metadata, description, args)
     print("Adding bookmark...")
-    bookmark = client.add_bookmark(**kwargs)
+    r = client.add_bookmark(json=False, **kwargs)
+    err = is_error(r)
+    if err:
+        raise ValueError("Could not add bookmark (error %s): %s" % (err, r.text[0:200]))
+    bookmark = client.check_response(r)
     print("Bookmark added:\n", bookmark)
     return bookmark
 
 
+def get_upload_queue(args):
+    """
+    Return UploadQueue if the upload_queue_filepath config parameter is set, otherwise None.
+    Leases last upload_lease_seconds (default 300).
+    """
+    filepath = args.get('upload_queue_filepath')
+    if not filepath:
+        return None
+    from .upload_queue import UploadQueue
+    return UploadQueue(filepath, lease_seconds=args.get('upload_lease_seconds') or 300)
+
+
+def enqueue_bookmark(queue, content, metadata, args=None):
+    """ Put bookmark in the upload queue (keyed by url). Returns job_id. """
+    job_id = queue.enqueue(bookmark_payload(content, metadata, args=args), key=(metadata or {}).get('url'))
+    logger.info("Bookmark for %s queued for upload as job %s.", (metadata or {}).get('url'), job_id)
+    return job_id
+
+
+def drain(client, args):
+    """
+    Upload all pending bookmarks in the upload queue, using drain_workers (default 2) worker threads.
+    Other processes may drain the same queue at the same time.
+    """
+    from .upload_queue import UploadQueue, drain_queue
+    queue = get_upload_queue(args) or UploadQueue(lease_seconds=args.get('upload_lease_seconds') or 300)
+    if args.get('retry_failed'):
+        print("%s failed jobs re-queued." % queue.retry_failed())
+    stats = drain_queue(queue, client, workers=args.get('drain_workers') or 2)
+    counts = queue.counts()
+    queue.close()
+    print("%(done)s bookmarks uploaded, %(retry)s failed (will be retried), %(failed)s failed permanently." % stats)
+    print("Queue: %(pending)s pending, %(leased)s leased, %(done)s done, %(failed)s failed." % counts)
+    return stats
 
 
 
@@ -250,9 +670,22 @@ def get_argparser():
     parser.add_argument('--instapaper_consumer_keys_file', help="Instapaper client/consumer API key and secret.")
     parser.add_argument('--persist_access_tokens', action="store_true", default=None,
                         help="Persist Instapaper API access token after successfull login.")
+    parser.add_argument('--token_verify_window', type=int,
+                        help="Skip verifying access tokens if they were verified less than this many seconds ago "
+                             "(default 1 day; 0 to always verify).")
 
     parser.add_argument('--download_pdf', action="store_true", default=None,
                         help="Attempt to download pdf from web page (in addition to storing as Instapaper bookmark).")
+    parser.add_argument('--stream_html', action="store_true", default=None,
+                        help="Process downloaded html in chunks as it arrives, using less memory.")
+    parser.add_argument('--api_rate', type=float, help="Max number of Instapaper API requests per second.")
+    parser.add_argument('--api_max_concurrency', type=int,
+                        help="Max number of concurrent Instapaper API requests (default 8, reduced when rate limited).")
+    parser.add_argument('--upload_queue_filepath',
+                        help="Durable upload queue file. If given, content is queued before it is uploaded.")
+    parser.add_argument('--doi_cache_filepath',
+                        help="DOI metadata cache file (default: ~/.cache/instaporter/doi.sqlite). Use '' to disable.")
+    parser.add_argument('--doi_cache_ttl', type=int, help="Seconds to keep cached DOI metadata (default 30 days).")
 
     # testing and logging config:
     parser.add_argument('--loglevel', help="Logging level.")
@@ -261,11 +694,66 @@ def get_argparser():
     subparsers = parser.add_subparsers(dest='command')
 
     urlcommand = subparsers.add_parser('url', help="Download content from URL.")
-    urlcommand.add_argument('url', nargs='?', help="The URL to download pdf from.")
+    urlcommand.add_argument('url', nargs='*', help="The URL(s) to download content from.")
+    urlcommand.add_argument('--urlfile', help="Read URLs from this file, one per line. Use '-' to read from stdin.")
+    urlcommand.add_argument('--fetch_workers', type=int, help="Number of concurrent downloads (default 4).")
+    urlcommand.add_argument('--rewrite_workers', type=int, help="Number of content rewrite workers (default 2).")
+    urlcommand.add_argument('--upload_workers', type=int, help="Number of concurrent uploads (default 2).")
+    urlcommand.add_argument('--pipeline_queue_size', type=int,
+                            help="Max number of items waiting between pipeline stages (default 8).")
 
     filecommand = subparsers.add_parser('file', help="Read html content from this/these file(s).")
     filecommand.add_argument('file', help="The URL to download pdf from.")
 
+    synccommand = subparsers.add_parser('sync', help="Sync local mirror of Instapaper bookmarks.")
+    synccommand.add_argument('folders', nargs='*', help="Only sync these folders (default: all folders).")
+    synccommand.add_argument('--mirror_filepath', help="Mirror database file (default: ~/.config/instaporter/mirror.sqlite).")
+    synccommand.add_argument('--sync_workers', type=int, help="Number of folders to sync concurrently (default 4).")
+
+    prefetchcommand = subparsers.add_parser('prefetch', help="Download bookmark texts to the local text cache.")
+    prefetchcommand.add_argument('folder', nargs='?', default='unread',
+                                 help="Folder to prefetch, e.g. unread (default), starred, archive or a folder_id.")
+    prefetchcommand.add_argument('--text_cache_filepath', help="Text cache file (default: ~/.cache/instaporter/texts.sqlite).")
+    prefetchcommand.add_argument('--text_cache_max_bytes', type=int, help="Max size of the text cache (default 200 MB).")
+    prefetchcommand.add_argument('--prefetch_workers', type=int, help="Number of concurrent downloads (default 4).")
+
+    exportcommand = subparsers.add_parser('export', help="Export bookmarks, highlights and texts to a directory (resumable).")
+    exportcommand.add_argument('directory', help="Export directory. An interrupted export in the directory is resumed.")
+    exportcommand.add_argument('--export_folders', nargs='+',
+                               help="Only export these folders (unread, archive or folder_ids). Default: all folders.")
+    exportcommand.add_argument('--export_workers', type=int, help="Number of concurrent downloads (default 8).")
+
+    doicommand = subparsers.add_parser('dois', help="Resolve DOIs and print their metadata as json lines.")
+    doicommand.add_argument('dois', nargs='*', help="The DOIs to resolve.")
+    doicommand.add_argument('--doifile', help="Read DOIs from this file, one per line. Use '-' to read from stdin.")
+    doicommand.add_argument('--doi_workers', type=int, help="Number of concurrent lookups (default 16).")
+    doicommand.add_argument('--doi_per_host', type=int, help="Max concurrent requests per host (default 8).")
+
+    draincommand = subparsers.add_parser('drain', help="Upload pending bookmarks from the upload queue.")
+    draincommand.add_argument('--drain_workers', type=int, help="Number of concurrent uploads (default 2).")
+    draincommand.add_argument('--retry_failed', action="store_true", default=None,
+                              help="Also retry jobs that have failed permanently.")
+
+    servecommand = subparsers.add_parser('serve', help="Run resident server that processes url/file jobs.")
+    servecommand.add_argument('--serve_port', type=int, help="Loopback port to listen on (default 7270).")
+    servecommand.add_argument('--serve_socket', help="Listen on this unix socket instead of a loopback port.")
+    servecommand.add_argument('--serve_workers', type=int, help="Number of jobs processed at the same time (default 2).")
+    servecommand.add_argument('--serve_token_filepath',
+                              help="Write the token clients must send to this file (default ~/.cache/instaporter/serve_token).")
+
+    bulkcommand = subparsers.add_parser('bulk', help="Archive, unarchive, star, unstar, move or delete many bookmarks.")
+    bulkcommand.add_argument('op', choices=['archive', 'unarchive', 'star', 'unstar', 'move', 'delete'],
+                             help="The operation to apply.")
+    bulkcommand.add_argument('bookmark_ids', nargs='*', type=int, help="Bookmark ids.")
+    bulkcommand.add_argument('--idfile', help="Read bookmark ids from this file, one per line. Use '-' to read from stdin.")
+    bulkcommand.add_argument('--from_folder',
+                             help="Apply to all bookmarks in this folder (unread, starred, archive or a folder_id).")
+    bulkcommand.add_argument('--to_folder', help="Folder_id to move the bookmarks to (move only).")
+    bulkcommand.add_argument('--bulk_workers', type=int, help="Number of concurrent requests (default 8).")
+    bulkcommand.add_argument('--bulk_retries', type=int, help="Number of times to retry failed bookmarks (default 1).")
+    bulkcommand.add_argument('--bulk_report',
+                             help="Save report to this json file. If it exists, bookmarks already done are skipped.")
+
     testcommand = subparsers.add_parser('test', help="Test mode.")
 
     return parser
@@ -278,15 +766,18 @@ def main(args=None):
         args = argns.__dict__
     cmd = args.pop('command')
     if cmd == 'url':
-        url = args.pop('url')
-        if url is None:
+        urls = args.pop('url') or []
+        urlfile = args.pop('urlfile', None)
+        if urlfile:
+            urls.extend(read_urls(urlfile))
+        if not urls:
             from .clipboard import get_clipboard
             clipboard = get_clipboard()
             print("No URL given. Clipboard content is:\n  ", clipboard)
-            ok = input("Add this URL to Instapaper? [y/n]  ").lower()
-            parsetest = urlparse(clipboard)
-            if (parsetest.netloc and (not ok or ok[0] != 'n')) or (ok and ok[0] == 'y'):
-                url = clipboard
+            ok = input("Add this/these URL(s) to Instapaper? [y/n]  ").lower()
+            clipboard_urls = [line.strip() for line in clipboard.splitlines() if urlparse(line.strip()).netloc]
+            if (clipboard_urls and (not ok or ok[0] != 'n')) or (ok and ok[0] == 'y'):
+                urls = clipboard_urls or [clipboard]
             else:
                 print("\nNo Url Given, exiting...")
                 return
@@ -294,6 +785,26 @@ def main(args=None):
         pass
     elif cmd == 'file':
         files = args.pop('file')
+    elif cmd == 'sync':
+        folders = args.pop('folders') or None
+    elif cmd == 'prefetch':
+        folder = args.pop('folder')
+    elif cmd == 'export':
+        export_directory = args.pop('directory')
+        export_folders = args.pop('export_folders', None)
+    elif cmd == 'bulk':
+        bulk_op = args.pop('op')
+        bookmark_ids = args.pop('bookmark_ids') or []
+        idfile = args.pop('idfile', None)
+        if idfile:
+            bookmark_ids.extend(int(line) for line in read_urls(idfile))
+        from_folder = args.pop('from_folder', None)
+        to_folder = args.pop('to_folder', None)
+    elif cmd == 'dois':
+        dois = args.pop('dois') or []
+        doifile = args.pop('doifile', None)
+        if doifile:
+            dois.extend(read_urls(doifile))
 
     # Init logging. If you want to have logging for config loading, this must be set before doing that.
     # OTOH, if you want to configure logging in the config, you must init logging *after* loading.
@@ -306,12 +817,20 @@ def main(args=None):
     # configfile arg should also not be merged with or saved to the config:
     config_filepath = args.pop('configfile', None)
     # Load config, keys, credentials, etc:
-    config = get_config(args, config_filepath)
+    # The DOI cache and http sessions are configured from the config (again after each reload):
+    config_loader = ConfigLoader(config_filepath, args, on_reload=[configure_doi_cache, configure_sessions])
+    config = config_loader.config
 
     # Username, OTOH, is ok to persist to config:
     username = config.get('instapaper_username', '')
     logger.info("config (after load): %s", config)
 
+    if cmd == 'dois':
+        # Resolving DOIs does not require an Instapaper login:
+        resolve_doi_list(dois, config)
+        log_stats()
+        return
+
     del args # Make sure we don't accidentally use args later on
 
     if not (config.get('instapaper_login_prompt') == "as-needed" and config.get('access_tokens')):
@@ -324,16 +843,42 @@ def main(args=None):
     # Insta client to upload content:
     client = InstapaperClient(config, consumer_keys['consumer_key'], consumer_keys['consumer_secret'],
                               username, password,
-                              config_filepath=config_filepath)
+                              config_filepath=config_filepath,
+                              # Cache token verifications, so we don't verify the access tokens on every run
+                              # (the default is not put in the config, so it is not saved; '' to disable):
+                              token_cache_filepath=TOKEN_CACHE_FILEPATH)
 
     if cmd == 'url':
-        transport_url(client, url, config)
+        transport_urls(client, urls, config)
     elif cmd == 'test':
         pass
     elif cmd == 'file':
         transport_files(client, files, config)
+    elif cmd == 'sync':
+        sync_mirror(client, folders, config)
+    elif cmd == 'prefetch':
+        prefetch(client, folder, config)
+    elif cmd == 'drain':
+        drain(client, config)
+    elif cmd == 'bulk':
+        bulk_operation(client, bulk_op, bookmark_ids, from_folder, to_folder, config)
+    elif cmd == 'export':
+        export_account(client, export_directory, export_folders, config)
+    elif cmd == 'serve':
+        serve_jobs(client, config, config_loader=config_loader)
     else:
         print("Command not recognized...!?")
+    log_stats()
+
+
+def log_stats():
+    """ Log DOI cache and http connection statistics. """
+    doi_cache = get_doi_cache()
+    if doi_cache is not None and (doi_cache.hits or doi_cache.negative_hits or doi_cache.misses):
+        logger.info("DOI cache stats: %s", doi_cache.stats())
+    http_stats = SESSIONS.stats()
+    if http_stats['requests']:
+        logger.info("HTTP connections: %(opened)s opened, %(reused)s reused for %(requests)s requests.", http_stats)
 
 
 
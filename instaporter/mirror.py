@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Local mirror of Instapaper folders, bookmarks and highlights, stored in an SQLite database.
+
+The mirror is synced incrementally using the 'have' and 'highlights' parameters of bookmarks/list:
+* have: comma-separated list of <bookmark_id>:<hash>:<progress>:<progress_timestamp> for all
+  bookmarks we already have in a folder. Instapaper only returns bookmarks that are new or have changed,
+  plus 'delete_ids' for bookmarks that are no longer in the folder.
+* highlights: '-' delimited list of highlight ids we already have.
+So a re-sync of an unchanged account is just one small request per folder.
+
+All folders are synced at the same time: The requests are made by a pool of worker threads,
+while the responses are applied to the database in the calling thread (sqlite connections
+should not be shared between threads).
+
+Usage:
+    mirror = BookmarkMirror(client, "~/.config/instaporter/mirror.sqlite")
+    stats = mirror.sync()
+
+"""
+
+import os
+import json
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+logger = logging.getLogger(__name__)
+
+from .models import BookmarkList, to_plain
+
+
+# The built-in folders are not returned by folders/list:
+BUILTIN_FOLDERS = ('unread', 'starred', 'archive')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    folder_id TEXT PRIMARY KEY,
+    title TEXT,
+    position REAL,
+    data TEXT
+);
+CREATE TABLE IF NOT EXISTS bookmarks (
+    folder_id TEXT NOT NULL,
+    bookmark_id INTEGER NOT NULL,
+    hash TEXT,
+    progress REAL,
+    progress_timestamp INTEGER,
+    data TEXT,
+    PRIMARY KEY (folder_id, bookmark_id)
+);
+CREATE TABLE IF NOT EXISTS highlights (
+    highlight_id INTEGER PRIMARY KEY,
+    bookmark_id INTEGER NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS highlights_bookmark_id ON highlights (bookmark_id);
+"""
+
+
+def make_have_string(rows):
+    """
+    Make 'have' parameter value from (bookmark_id, hash, progress, progress_timestamp) rows.
+    """
+    entries = []
+    for bookmark_id, bhash, progress, progress_timestamp in rows:
+        if bhash is None:
+            entries.append(str(bookmark_id))
+        elif progress is None:
+            entries.append("%s:%s" % (bookmark_id, bhash))
+        else:
+            entries.append("%s:%s:%s:%s" % (bookmark_id, bhash, progress, progress_timestamp or 0))
+    return ",".join(entries)
+
+
+def parse_delete_ids(delete_ids):
+    """ delete_ids may be a list of ids or a comma-separated string. Returns list of ints. """
+    if not delete_ids:
+        return []
+    if isinstance(delete_ids, str):
+        delete_ids = delete_ids.split(',')
+    return [int(bid) for bid in delete_ids if str(bid).strip()]
+
+
+class BookmarkMirror(object):
+    """
+    Local SQLite mirror of an Instapaper account.
+    """
+
+    def __init__(self, client, filepath=None, batch=500):
+        """
+        Args:
+            client: An InstapaperClient, used to make the requests.
+            filepath: Path to the SQLite database file. Defaults to ~/.config/instaporter/mirror.sqlite
+            batch: Max number of bookmarks per request (Instapaper allows 1-500).
+        """
+        if filepath is None:
+            filepath = "~/.config/instaporter/mirror.sqlite"
+        if filepath != ':memory:':
+            filepath = os.path.expanduser(filepath)
+            dirname = os.path.dirname(filepath)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        self.client = client
+        self.filepath = filepath
+        self.batch = batch
+        self.db = sqlite3.connect(filepath)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """ Close database connection. """
+        self.db.close()
+
+    def folder_ids(self):
+        """ Return ids of all folders, including the built-in folders. """
+        rows = self.db.execute("SELECT folder_id FROM folders ORDER BY position").fetchall()
+        return list(BUILTIN_FOLDERS) + [row[0] for row in rows]
+
+    def have(self, folder_id):
+        """ Return 'have' string for folder, from the stored bookmarks. """
+        rows = self.db.execute("SELECT bookmark_id, hash, progress, progress_timestamp FROM bookmarks "
+                               "WHERE folder_id = ? ORDER BY bookmark_id", (str(folder_id),))
+        return make_have_string(rows)
+
+    def highlight_ids(self, folder_id):
+        """ Return '-' delimited string with ids of stored highlights of bookmarks in folder. """
+        rows = self.db.execute("SELECT h.highlight_id FROM highlights h JOIN bookmarks b "
+                               "ON h.bookmark_id = b.bookmark_id WHERE b.folder_id = ? "
+                               "ORDER BY h.highlight_id", (str(folder_id),))
+        return "-".join(str(row[0]) for row in rows)
+
+    def bookmarks(self, folder_id=None):
+        """ Return list of stored bookmark dicts, optionally only for folder_id. """
+        if folder_id is None:
+            rows = self.db.execute("SELECT data FROM bookmarks ORDER BY folder_id, bookmark_id")
+        else:
+            rows = self.db.execute("SELECT data FROM bookmarks WHERE folder_id = ? ORDER BY bookmark_id",
+                                   (str(folder_id),))
+        return [json.loads(row[0]) for row in rows]
+
+    def highlights(self, bookmark_id):
+        """ Return list of stored highlights for bookmark. """
+        rows = self.db.execute("SELECT data FROM highlights WHERE bookmark_id = ? ORDER BY highlight_id",
+                               (bookmark_id,))
+        return [json.loads(row[0]) for row in rows]
+
+    def sync_folders(self):
+        """
+        Sync the list of (user) folders. Returns number of folders.
+        Bookmarks (and their highlights) in folders that have been deleted on the server are removed.
+        """
+        folders = self.client.list_folders()
+        if not isinstance(folders, list) or (folders and folders[0].get('type') == 'error'):
+            logger.warning("Could not list folders: %s", folders)
+            return 0
+        with self.db:
+            self.db.execute("DELETE FROM folders")
+            self.db.executemany("INSERT INTO folders (folder_id, title, position, data) VALUES (?, ?, ?, ?)",
+                                [(str(f['folder_id']), f.get('title'), f.get('position'), json.dumps(to_plain(f)))
+                                 for f in folders if f.get('type') == 'folder'])
+            cursor = self.db.execute(
+                "DELETE FROM bookmarks WHERE folder_id NOT IN (SELECT folder_id FROM folders) "
+                "AND folder_id NOT IN (%s)" % ", ".join("?" * len(BUILTIN_FOLDERS)), BUILTIN_FOLDERS)
+            if cursor.rowcount:
+                logger.info("Removed %s bookmarks in deleted folders from the mirror.", cursor.rowcount)
+                self.db.execute("DELETE FROM highlights WHERE bookmark_id NOT IN (SELECT bookmark_id FROM bookmarks)")
+        return len(folders)
+
+    def fetch_folder(self, folder_id, have, highlights):
+        """ Request changes for folder. Called from worker threads; must not touch the database. """
+        return self.client.list_bookmarks(limit=self.batch, folder_id=folder_id,
+                                          have=have or None, highlights=highlights or None)
+
+    def apply(self, folder_id, response):
+        """
+        Apply bookmarks/list response for folder to the database.
+        Returns (number of updated bookmarks, number of deleted bookmarks).
+        """
+        if not isinstance(response, (dict, BookmarkList)):
+            logger.warning("Unexpected bookmarks/list response for folder %s: %s", folder_id, response)
+            return 0, 0
+        folder_id = str(folder_id)
+        bookmarks = [b for b in response.get('bookmarks', []) if b.get('type', 'bookmark') == 'bookmark']
+        delete_ids = parse_delete_ids(response.get('delete_ids'))
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO bookmarks (folder_id, bookmark_id, hash, progress, progress_timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [(folder_id, b['bookmark_id'], b.get('hash'), b.get('progress'), b.get('progress_timestamp'),
+                  json.dumps(to_plain(b))) for b in bookmarks])
+            self.db.executemany("DELETE FROM bookmarks WHERE folder_id = ? AND bookmark_id = ?",
+                                [(folder_id, bid) for bid in delete_ids])
+            self.db.executemany("INSERT OR REPLACE INTO highlights (highlight_id, bookmark_id, data) VALUES (?, ?, ?)",
+                                [(hl['highlight_id'], hl['bookmark_id'], json.dumps(to_plain(hl)))
+                                 for hl in response.get('highlights', [])])
+            # Remove highlights of bookmarks that are no longer in any folder:
+            self.db.execute("DELETE FROM highlights WHERE bookmark_id NOT IN (SELECT bookmark_id FROM bookmarks)")
+        return len(bookmarks), len(delete_ids)
+
+    def sync(self, folders=None, workers=4):
+        """
+        Sync folders (default: all folders) with the server.
+        Returns dict with folder_id -> {'updated': <n>, 'deleted': <n>, 'requests': <n>}
+        """
+        if folders is None:
+            self.sync_folders()
+            folders = self.folder_ids()
+        stats = {str(folder_id): {'updated': 0, 'deleted': 0, 'requests': 0} for folder_id in folders}
+        pending = list(stats)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            while pending:
+                # 'have' strings are made in this thread, before submitting:
+                futures = {executor.submit(self.fetch_folder, folder_id, self.have(folder_id),
+                                           self.highlight_ids(folder_id)): folder_id
+                           for folder_id in pending}
+                pending = []
+                for future in as_completed(futures):
+                    folder_id = futures[future]
+                    try:
+                        response = future.result()
+                    except Exception as e:    # pylint: disable=W0703
+                        logger.error("Could not sync folder %s: %s", folder_id, e)
+                        continue
+                    updated, deleted = self.apply(folder_id, response)
+                    folder_stats = stats[folder_id]
+                    folder_stats['requests'] += 1
+                    folder_stats['updated'] += updated
+                    folder_stats['deleted'] += deleted
+                    # A full batch means there may be more; the new 'have' excludes what we just got.
+                    if updated >= self.batch:
+                        pending.append(folder_id)
+        logger.info("Mirror sync stats: %s", stats)
+        return stats
@@ -0,0 +1,441 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0903
+
+"""
+
+Typed objects for Instapaper API responses.
+
+The API returns json lists of dicts, each with a "type" (user, bookmark, folder, highlight, meta, error),
+except bookmarks/list, which returns a dict with user, bookmarks, highlights and delete_ids.
+from_json() turns parsed json into User, Bookmark, Folder, Highlight, Meta and Error objects
+(and BookmarkList for bookmarks/list):
+* The objects use __slots__: a bookmark object takes about 130 bytes, the dict about 470 (plus the values).
+* Fields are stored as returned by the API; derived values (e.g. Bookmark.is_starred, Bookmark.added,
+  BookmarkList.deleted) are only decoded when accessed.
+* The objects can be used as the plain dicts that were returned before: bookmark['title'],
+  bookmark.get('hash'), 'url' in bookmark, bookmark.to_dict() (for json.dumps).
+
+For large bookmarks/list responses, parse_stream() parses the response body as it is downloaded,
+converting each bookmark and highlight to an object as soon as it has been decoded, so neither the
+full body text nor the dicts for all bookmarks are kept in memory.
+
+Usage:
+    bookmarks = from_json(response.json())
+    listing = parse_stream(response.iter_content(65536))    # with requests' stream=True
+    for bookmark in listing.bookmarks:
+        print(bookmark.bookmark_id, bookmark.title, bookmark.is_starred)
+
+"""
+
+import re
+import json
+import codecs
+import datetime
+import logging
+logger = logging.getLogger(__name__)
+
+
+def make_assign(fields):
+    """
+    Return function assign(obj, data) which sets obj.<field> = data[<field>] for all fields
+    (raising KeyError if one is missing). The function is generated, like collections.namedtuple
+    does, since assigning the slots one by one is several times faster than a loop with setattr.
+    """
+    lines = ["def assign(self, data):"] + ["    self.%s = data[%r]" % (name, name) for name in fields]
+    if not fields:
+        lines.append("    pass")
+    namespace = {}
+    exec("\n".join(lines), namespace)    # pylint: disable=W0122
+    return namespace['assign']
+
+
+class Model(object):
+    """
+    Base class for API objects. Subclasses define type and fields (which are also the __slots__).
+    Fields not set in the json data are None (but are not included in keys() and to_dict()).
+    Unknown fields are kept in self.extra.
+    """
+
+    __slots__ = ('extra',)
+    type = None
+    fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Number of keys in the json dict if it has all fields (and type):
+        cls._size = len(cls.fields) + (cls.type is not None)
+        cls._assign = make_assign(cls.fields)
+
+    def __init__(self, data):
+        self.extra = None
+        if len(data) == self._size and data.get('type') == self.type:
+            # The usual case: all fields and no others.
+            try:
+                self._assign(data)
+                return
+            except KeyError:
+                pass
+        extra = {}
+        for key, value in data.items():
+            if key in self.fields:
+                setattr(self, key, value)
+            elif key != 'type' or value != self.type:
+                extra[key] = value
+        self.extra = extra or None
+
+    def __getattr__(self, name):
+        # Only called for fields that were not in the data (unset slots):
+        if name in self.fields:
+            return None
+        raise AttributeError("%s object has no attribute %r" % (self.__class__.__name__, name))
+
+    def _has(self, name):
+        """ Return True if field <name> was set. """
+        try:
+            object.__getattribute__(self, name)
+        except AttributeError:
+            return False
+        return True
+
+    def keys(self):
+        """ Return list of keys, as for the json dict. """
+        keys = ['type'] if self.type is not None else []
+        keys.extend(name for name in self.fields if self._has(name))
+        if self.extra:
+            keys.extend(self.extra)
+        return keys
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            try:
+                return object.__getattribute__(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self.extra and key in self.extra:
+            return self.extra[key]
+        if key == 'type' and self.type is not None:
+            return self.type
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        """ Return value of key, or default, as for the json dict. """
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        """ Return list of (key, value) pairs, as for the json dict. """
+        return [(key, self[key]) for key in self.keys()]
+
+    def to_dict(self):
+        """ Return the json dict for this object. """
+        return {key: to_plain(value) for key, value in self.items()}
+
+    def __eq__(self, other):
+        if isinstance(other, (Model, dict)):
+            return self.to_dict() == to_plain(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.to_dict())
+
+
+def timestamp_to_datetime(timestamp):
+    """ Return (local) datetime for unix timestamp, or None. """
+    if not timestamp:
+        return None
+    return datetime.datetime.fromtimestamp(float(timestamp))
+
+
+class User(Model):
+    """ Instapaper user. """
+    fields = ('user_id', 'username', 'subscription_is_active')
+    __slots__ = fields
+    type = 'user'
+
+
+class Bookmark(Model):
+    """ Instapaper bookmark. """
+    fields = ('bookmark_id', 'url', 'title', 'description', 'time', 'starred', 'private_source',
+              'hash', 'progress', 'progress_timestamp')
+    __slots__ = fields
+    type = 'bookmark'
+
+    @property
+    def is_starred(self):
+        """ True if the bookmark is starred (the API returns starred as "0" or "1"). """
+        return str(self.starred) == '1'
+
+    @property
+    def added(self):
+        """ Time the bookmark was added, as datetime. """
+        return timestamp_to_datetime(self.time)
+
+    @property
+    def progress_time(self):
+        """ Time of the last reading progress update, as datetime. """
+        return timestamp_to_datetime(self.progress_timestamp)
+
+
+class Folder(Model):
+    """ Instapaper (user) folder. """
+    fields = ('folder_id', 'title', 'display_title', 'slug', 'sync_to_mobile', 'position')
+    __slots__ = fields
+    type = 'folder'
+
+
+class Highlight(Model):
+    """ Highlight in a bookmark's text. """
+    fields = ('highlight_id', 'bookmark_id', 'text', 'note', 'position', 'time')
+    __slots__ = fields
+    type = 'highlight'
+
+    @property
+    def created(self):
+        """ Time the highlight was made, as datetime. """
+        return timestamp_to_datetime(self.time)
+
+
+class Meta(Model):
+    """ Meta object (e.g. in old bookmarks/list responses). """
+    __slots__ = ()
+    type = 'meta'
+
+
+class Error(Model):
+    """ API error, e.g. {"type": "error", "error_code": 1240, "message": "Invalid URL specified"} """
+    fields = ('error_code', 'message')
+    __slots__ = fields
+    type = 'error'
+
+
+MODELS = {cls.type: cls for cls in (User, Bookmark, Folder, Highlight, Meta, Error)}
+
+
+def model(data):
+    """ Return typed object for json dict, based on its type (dicts of unknown type are returned as-is). """
+    if isinstance(data, dict):
+        cls = MODELS.get(data.get('type'))
+        if cls is not None:
+            return cls(data)
+    return data
+
+
+class BookmarkList(Model):
+    """ bookmarks/list response: user, bookmarks, highlights and delete_ids. """
+    fields = ('user', 'bookmarks', 'highlights', 'delete_ids')
+    __slots__ = fields
+
+    def __init__(self, data):
+        data = dict(data)
+        if 'user' in data:
+            data['user'] = model(data['user'])
+        for key in ('bookmarks', 'highlights'):
+            if key in data:
+                data[key] = [model(item) for item in data[key]]
+        Model.__init__(self, data)
+
+    @property
+    def deleted(self):
+        """ delete_ids as list of ints (the API returns a comma-separated string). """
+        delete_ids = self.delete_ids
+        if not delete_ids:
+            return []
+        if isinstance(delete_ids, str):
+            delete_ids = delete_ids.split(',')
+        return [int(bid) for bid in delete_ids if str(bid).strip()]
+
+
+def from_json(data):
+    """
+    Return typed objects for parsed json response data:
+    list of Model objects for lists, BookmarkList for bookmarks/list responses, otherwise data.
+    """
+    if isinstance(data, list):
+        return [model(item) for item in data]
+    if isinstance(data, dict):
+        if 'bookmarks' in data or 'delete_ids' in data:
+            return BookmarkList(data)
+        return model(data)
+    return data
+
+
+def to_plain(obj):
+    """ Return obj with Model objects replaced by dicts (e.g. for json.dumps). """
+    if isinstance(obj, Model):
+        return obj.to_dict()
+    if isinstance(obj, list):
+        return [to_plain(item) for item in obj]
+    if isinstance(obj, dict):
+        return {key: to_plain(value) for key, value in obj.items()}
+    return obj
+
+
+def json_default(obj):
+    """ json.dumps default function, for data which may contain Model objects. """
+    if isinstance(obj, Model):
+        return obj.to_dict()
+    return str(obj)
+
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class StreamParser(object):
+    """
+    Incremental json parser for a top-level json object or list, read from an iterable of bytes chunks.
+    Elements of the top-level list, and of lists in the top-level object, are decoded one at a time
+    (with json's C decoder) and converted with model(); only the undecoded rest of the current chunk
+    and the converted objects are kept in memory.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = json.JSONDecoder()
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        """ Read the next chunk into the buffer. Returns False at the end of input. """
+        if self.eof:
+            return False
+        for chunk in self.chunks:
+            text = self.utf8.decode(chunk)
+            if text:
+                self.buf = self.buf[self.pos:] + text
+                self.pos = 0
+                return True
+        self.buf = self.buf[self.pos:] + self.utf8.decode(b'', final=True)
+        self.pos = 0
+        self.eof = True
+        return False
+
+    def peek(self):
+        """ Skip whitespace and return the next character ('' at the end of input). """
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, chars):
+        """ Consume and return the next character, which must be one of chars. """
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expected one of %r at position %s, got %r." % (chars, self.pos, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """ Decode and return the next json value. """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # Value is incomplete (or invalid, which is reported at the end of input):
+                if not self.fill():
+                    raise
+                continue
+            if end == len(self.buf) and not self.eof:
+                # A number at the end of the buffer may continue in the next chunk:
+                if self.fill():
+                    continue
+                end = len(self.buf)
+            self.pos = end
+            return value
+
+    def items(self):
+        """ Yield the elements of the list at the current position, converted with model(). """
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        scan_once, skip = self.decoder.scan_once, WHITESPACE.match
+        while True:
+            # Fast path: the element and the separator after it are in the buffer.
+            buf, pos = self.buf, self.pos
+            try:
+                value, end = scan_once(buf, pos)
+            except (StopIteration, ValueError):
+                end = len(buf)
+            if end < len(buf):
+                self.pos = end
+            else:
+                value = self.value()
+            yield model(value)
+            buf = self.buf
+            pos = skip(buf, self.pos).end()
+            if pos < len(buf) and buf[pos] == ',':
+                self.pos = skip(buf, pos + 1).end()
+            elif self.expect(',]') == ']':
+                return
+
+    def parse(self):
+        """ Parse the input and return the result, as from_json(json.loads(body)) would. """
+        char = self.peek()
+        if char == '[':
+            return list(self.items())
+        if char != '{':
+            return from_json(self.value())
+        self.expect('{')
+        data = {}
+        if self.peek() == '}':
+            self.pos += 1
+        else:
+            while True:
+                key = self.value()
+                self.expect(':')
+                data[key] = list(self.items()) if self.peek() == '[' else self.value()
+                if self.expect(',}') == '}':
+                    break
+        if self.peek():
+            raise ValueError("Extra data after json value at position %s." % self.pos)
+        if 'bookmarks' in data or 'delete_ids' in data:
+            # Lists have already been converted; BookmarkList's model() calls leave the objects as-is.
+            return BookmarkList(data)
+        return model(data)
+
+
+def parse_stream(chunks):
+    """ Parse json response body from iterable of bytes chunks; returns typed objects (see StreamParser). """
+    return StreamParser(chunks).parse()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,R0913,W0703
+
+"""
+Staged worker pipeline for processing many items (e.g. URLs) at once.
+
+Each stage has its own pool of worker threads, and stages are connected
+by bounded queues. A slow stage will fill up its input queue, which makes
+the workers of the preceding stage block (backpressure) instead of piling
+up fetched documents in memory.
+With e.g. fetch -> rewrite -> upload, the stages overlap, so the total
+wall-clock time tracks the slowest stage rather than the sum of all stages.
+
+Usage:
+    pipeline = Pipeline([('fetch', fetch_func, 4),
+                         ('rewrite', rewrite_func, 2),
+                         ('upload', upload_func, 2)],
+                        queue_size=8)
+    results = pipeline.run(urls)
+
+Each stage function takes the output of the previous stage (the first stage
+takes the item) and returns the input for the next stage.
+If a stage raises an exception, the item is dropped from the pipeline and the
+error is recorded in the results.
+"""
+
+import threading
+from queue import Queue
+import logging
+logger = logging.getLogger(__name__)
+
+
+# Sentinel put on a queue to tell a worker to stop:
+_STOP = object()
+
+
+class Pipeline(object):
+    """
+    Run items through a sequence of stages, each with a bounded number of worker threads.
+    """
+
+    def __init__(self, stages, queue_size=8, key=None):
+        """
+        Args:
+            stages: list of (name, func, workers) tuples.
+            queue_size: Max number of items waiting in front of each stage.
+            key: Optional function returning the key used to detect duplicate items.
+                Defaults to the item itself (after stripping, if it is a string).
+        """
+        if not stages:
+            raise ValueError("Pipeline must have at least one stage.")
+        self.stages = [(name, func, max(1, int(workers or 1))) for name, func, workers in stages]
+        self.queue_size = max(1, int(queue_size or 1))
+        self.key = key or (lambda item: item.strip() if isinstance(item, str) else item)
+        self.results = {}
+        self.duplicates = 0
+        self._lock = threading.Lock()
+
+    def _record(self, key, **kwargs):
+        """ Record result for the item with key <key>. """
+        with self._lock:
+            self.results.setdefault(key, {}).update(kwargs)
+
+    def _worker(self, stage_idx, inqueue, outqueue, remaining):
+        """
+        Worker loop for a single stage.
+        When the last worker of a stage receives the stop sentinel,
+        it forwards a stop sentinel for each worker in the next stage.
+        """
+        name, func, _ = self.stages[stage_idx]
+        while True:
+            job = inqueue.get()
+            if job is _STOP:
+                break
+            key, value = job
+            try:
+                value = func(value)
+            except Exception as e:
+                logger.exception("Pipeline stage %s failed for %s", name, key)
+                self._record(key, status='error', stage=name, error=e)
+                continue
+            if outqueue is not None:
+                # This blocks when the next stage is backed up:
+                outqueue.put((key, value))
+            else:
+                self._record(key, status='ok', result=value)
+        with self._lock:
+            remaining[stage_idx] -= 1
+            last = remaining[stage_idx] == 0
+        if last and outqueue is not None:
+            for _ in range(self.stages[stage_idx+1][2]):
+                outqueue.put(_STOP)
+
+    def run(self, items):
+        """
+        Run all items through the pipeline. Blocks until all items are processed.
+        Duplicate items (by key) are only processed once; the number of skipped
+        duplicates is available as self.duplicates afterwards.
+        Returns a dict with key -> result dict, where result dict has a 'status' entry
+        which is either 'ok' or 'error'.
+        """
+        self.results = {}
+        self.duplicates = 0
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = [workers for _, _, workers in self.stages]
+        threads = []
+        for idx, (name, _, workers) in enumerate(self.stages):
+            outqueue = queues[idx+1] if idx+1 < len(queues) else None
+            for n in range(workers):
+                t = threading.Thread(target=self._worker, name="%s-%s" % (name, n),
+                                     args=(idx, queues[idx], outqueue, remaining))
+                t.daemon = True
+                t.start()
+                threads.append(t)
+        seen = set()
+        for item in items:
+            key = self.key(item)
+            if key in seen:
+                logger.info("Skipping duplicate item: %s", key)
+                self.duplicates += 1
+                continue
+            seen.add(key)
+            self._record(key, status='pending')
+            queues[0].put((key, item))
+        for _ in range(self.stages[0][2]):
+            queues[0].put(_STOP)
+        for t in threads:
+            t.join()
+        return self.results
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Rate limiting, backoff and adaptive concurrency, used by InstapaperClient.post to retry
+requests that fail with rate-limit errors (1040), service errors (1500) or HTTP 5xx.
+
+* TokenBucket: Allows <rate> requests per second on average, with bursts of up to <capacity>.
+* Backoff: Exponential backoff with full jitter: sleep a random time in [0, min(cap, base*2**attempt)].
+* AIMDController: Limits the number of requests in flight. The limit is halved (multiplicative
+  decrease) when a rate-limit response is seen, and increased by one (additive increase) after
+  <limit> consecutive successful requests. Threads waiting for a slot are blocked, so a pool of
+  e.g. 8 upload workers effectively shrinks to the sustainable number of concurrent requests.
+
+All classes can be shared between threads.
+
+"""
+
+import time
+import random
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+    """ Token bucket rate limiter. """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Args:
+            rate: Tokens added per second.
+            capacity: Max number of tokens in the bucket (burst size); defaults to max(1, rate).
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity or max(1, rate))
+        self.tokens = self.capacity
+        self.timestamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        """ Add tokens for the time passed since last refill. Must hold lock. """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.timestamp)*self.rate)
+        self.timestamp = now
+
+    def try_acquire(self, tokens=1):
+        """ Take tokens if available. Returns 0 on success, otherwise the number of seconds to wait. """
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens)/self.rate
+
+    def acquire(self, tokens=1):
+        """ Take tokens, waiting until they are available. Returns the time waited. """
+        waited = 0
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+
+class Backoff(object):
+    """ Exponential backoff with full jitter. """
+
+    def __init__(self, base=0.5, cap=30, rng=None):
+        """
+        Args:
+            base: Max delay of the first retry, in seconds.
+            cap: Max delay of any retry, in seconds.
+            rng: random.Random instance (for deterministic tests).
+        """
+        self.base = base
+        self.cap = cap
+        self.rng = rng or random.Random()
+
+    def delay(self, attempt):
+        """ Return delay before retry number <attempt> (0-based). """
+        return self.rng.uniform(0, min(self.cap, self.base*2**attempt))
+
+
+class AIMDController(object):
+    """
+    Additive-increase/multiplicative-decrease limit on the number of concurrent requests.
+    Use as context manager around each request:
+        with controller:
+            r = session.post(...)
+        controller.on_success() or controller.on_throttle()
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=16, decrease=0.5):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.active = 0
+        self.successes = 0
+        self.throttles = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """ Wait until fewer than <limit> requests are active, then take a slot. """
+        with self._cond:
+            while self.active >= self.limit:
+                self._cond.wait()
+            self.active += 1
+
+    def release(self):
+        """ Release a slot. """
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def on_success(self):
+        """ Register successful request; increase limit by one after <limit> successes in a row. """
+        with self._cond:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self.successes = 0
+                logger.debug("Increasing concurrency limit to %s", self.limit)
+                self._cond.notify()
+
+    def on_throttle(self):
+        """ Register rate-limited request; decrease limit multiplicatively. """
+        with self._cond:
+            self.throttles += 1
+            self.successes = 0
+            limit = max(self.minimum, int(self.limit*self.decrease))
+            if limit != self.limit:
+                logger.info("Rate limited; decreasing concurrency limit from %s to %s", self.limit, limit)
+            self.limit = limit
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Resident daemon mode: "instaporter serve".
+
+Starting instaporter for every url means importing requests, yaml, tkinter, pyzotero and ezfetcher,
+loading the config and consumer keys, and verifying the Instapaper credentials -- several seconds
+before any work is done. The server does all of that once and keeps the clients (Instapaper client,
+EzClient, pooled http sessions, DOI cache) in memory. Jobs are submitted over loopback http or a
+unix socket, e.g. with bin/instap_client.py.
+
+API (json in, json out):
+    POST /url       {"urls": [...], "wait": false}   Transport urls to Instapaper.
+    POST /file      {"files": [...], "wait": false}  Upload html files.
+    GET  /jobs/<id>                                  Job status.
+    GET  /status                                     Server status and statistics.
+    POST /shutdown                                   Stop the server.
+POST returns 202 with the job (including job_id), or, with "wait": true, 200 with the finished job.
+
+The server only listens on the loopback interface (or a unix socket which only the user can access);
+it is not meant to be exposed to the network. Web pages in the user's browser can also reach loopback
+addresses, so requests are refused unless:
+    * they have no Origin header (browsers send it with cross-origin requests),
+    * the Host header is a loopback address (prevents DNS rebinding),
+    * POST bodies have Content-Type application/json (browsers must preflight these), and
+    * they carry the server token in the X-Instaporter-Token header. serve() writes a random token
+      to serve_token_filepath (default ~/.cache/instaporter/serve_token, readable only by the user)
+      when it starts; bin/instap_client.py reads it from there.
+
+"""
+
+import os
+import hmac
+import json
+import time
+import socket
+import secrets
+import threading
+import itertools
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+import logging
+logger = logging.getLogger(__name__)
+
+from .models import json_default
+
+
+DEFAULT_PORT = 7270
+DEFAULT_TOKEN_FILEPATH = "~/.cache/instaporter/serve_token"
+TOKEN_HEADER = 'X-Instaporter-Token'
+LOOPBACK_HOSTS = ('127.0.0.1', 'localhost', '::1')
+
+
+class JobRunner(object):
+    """
+    Runs submitted jobs on a pool of worker threads and keeps track of their status.
+    handlers: dict with job kind -> func(items), e.g. {'url': lambda urls: transport_urls(client, urls, config)}
+    """
+
+    def __init__(self, handlers, workers=2, keep=1000):
+        self.handlers = handlers
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.keep = keep
+        self.jobs = {}
+        self.futures = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def submit(self, kind, items):
+        """ Submit job. Returns the job dict. Raises KeyError for unknown job kinds. """
+        handler = self.handlers[kind]
+        with self._lock:
+            job_id = next(self._ids)
+            job = {'job_id': job_id, 'kind': kind, 'items': items, 'status': 'queued',
+                   'submitted': time.time(), 'finished': None, 'result': None, 'error': None}
+            self.jobs[job_id] = job
+            # Forget the oldest finished jobs:
+            for old_id in sorted(self.jobs)[:max(0, len(self.jobs) - self.keep)]:
+                if self.jobs[old_id]['finished']:
+                    del self.jobs[old_id]
+                    self.futures.pop(old_id, None)
+        self.futures[job_id] = self.executor.submit(self._run, job, handler)
+        logger.info("Job %s submitted: %s %s", job_id, kind, items)
+        return job
+
+    def _run(self, job, handler):
+        """ Run job in worker thread. """
+        job['status'] = 'running'
+        try:
+            job['result'] = handler(job['items'])
+            job['status'] = 'done'
+        except Exception as e:    # pylint: disable=W0703
+            logger.exception("Job %s failed", job['job_id'])
+            job['status'] = 'error'
+            job['error'] = "%s: %s" % (type(e).__name__, e)
+        job['finished'] = time.time()
+        return job
+
+    def wait(self, job_id, timeout=None):
+        """ Wait for job to finish and return it. """
+        future = self.futures.get(job_id)
+        if future is not None:
+            future.result(timeout)
+        return self.jobs.get(job_id)
+
+    def get(self, job_id):
+        """ Return job with job_id, or None. """
+        return self.jobs.get(job_id)
+
+    def status(self):
+        """ Return dict with number of jobs by status and uptime. """
+        counts = {}
+        for job in list(self.jobs.values()):
+            counts[job['status']] = counts.get(job['status'], 0) + 1
+        return {'jobs': counts, 'uptime': time.time() - self.started}
+
+    def shutdown(self):
+        """ Wait for running jobs and stop the workers. """
+        self.executor.shutdown(wait=True)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """ Http request handler; self.server.runner is the JobRunner. """
+
+    server_version = "Instaporter/0.1"
+    protocol_version = "HTTP/1.1"
+    job_kinds = {'/url': ('url', 'urls'), '/file': ('file', 'files')}
+
+    def send_json(self, status, data):
+        """ Send data as json response. """
+        body = json.dumps(data, default=json_default).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def refuse(self):
+        """
+        Check that the request comes from a local client and not from a web page (see module docstring).
+        Returns (status, error message) if the request must be refused, otherwise None.
+        """
+        if self.headers.get('Origin') is not None:
+            return 403, "Cross-origin requests are not allowed."
+        host = (self.headers.get('Host') or '').strip().lower()
+        if host.startswith('['):
+            host = host[1:].partition(']')[0]
+        elif host.count(':') == 1:
+            host = host.partition(':')[0]
+        if host not in self.server.allowed_hosts:
+            return 403, "Host must be a loopback address."
+        if self.command == 'POST':
+            content_type = (self.headers.get('Content-Type') or '').partition(';')[0].strip().lower()
+            if content_type != 'application/json':
+                return 415, "Content-Type must be application/json."
+        token = self.server.token
+        if token and not hmac.compare_digest(self.headers.get(TOKEN_HEADER) or '', token):
+            return 403, "Missing or invalid %s header." % TOKEN_HEADER
+        return None
+
+    def read_json(self):
+        """ Read json request body. Returns None if the body is not valid json. """
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            return json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        except ValueError:
+            return None
+
+    def do_GET(self):
+        refused = self.refuse()
+        if refused:
+            return self.send_json(refused[0], {'error': refused[1]})
+        runner = self.server.runner
+        if self.path == '/status':
+            status = runner.status()
+            if self.server.stats_func:
+                status.update(self.server.stats_func())
+            return self.send_json(200, status)
+        if self.path.startswith('/jobs/'):
+            try:
+                job = runner.get(int(self.path[len('/jobs/'):]))
+            except ValueError:
+                job = None
+            if job is None:
+                return self.send_json(404, {'error': "No such job"})
+            return self.send_json(200, job)
+        return self.send_json(404, {'error': "Not found: %s" % self.path})
+
+    def do_POST(self):
+        refused = self.refuse()
+        if refused:
+            # Discard the body, so the client gets the response rather than a reset connection:
+            self.rfile.read(min(int(self.headers.get('Content-Length') or 0), 2**20))
+            self.close_connection = True
+            return self.send_json(refused[0], {'error': refused[1]})
+        runner = self.server.runner
+        data = self.read_json()
+        if data is None:
+            return self.send_json(400, {'error': "Request body must be json."})
+        if self.path == '/shutdown':
+            self.send_json(200, {'status': 'shutting down'})
+            threading.Thread(target=self.server.shutdown).start()
+            return None
+        if self.path not in self.job_kinds or self.job_kinds[self.path][0] not in runner.handlers:
+            return self.send_json(404, {'error': "Not found: %s" % self.path})
+        kind, key = self.job_kinds[self.path]
+        items = data.get(key)
+        if isinstance(items, str):
+            items = [items]
+        if not items:
+            return self.send_json(400, {'error': "No %s given." % key})
+        job = runner.submit(kind, items)
+        if data.get('wait'):
+            return self.send_json(200, runner.wait(job['job_id']))
+        return self.send_json(202, job)
+
+    def address_string(self):
+        # Unix socket clients have no address:
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):    # pylint: disable=W0622
+        logger.info("%s - %s", self.address_string(), format % args)
+
+
+class LoopbackHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    """ Threaded http server. """
+    daemon_threads = True
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """ Threaded http server on a unix socket. """
+    daemon_threads = True
+
+    def server_bind(self):
+        socketserver.UnixStreamServer.server_bind(self)
+        # Only the user may connect:
+        os.chmod(self.server_address, 0o600)
+        self.server_name = 'localhost'
+        self.server_port = 0
+
+
+def make_server(runner, host='127.0.0.1', port=DEFAULT_PORT, socket_path=None, stats_func=None, token=None):
+    """
+    Create (but do not start) server for runner. If socket_path is given, the server listens on
+    that unix socket; otherwise on host:port (use port 0 to get a free port).
+    stats_func: Function returning dict with extra statistics for /status.
+    token: If given, requests must carry this token in the X-Instaporter-Token header.
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = UnixHTTPServer(socket_path, RequestHandler)
+    else:
+        if host not in ('127.0.0.1', 'localhost', '::1'):
+            logger.warning("Serving on non-loopback address %s; anyone who can connect can add bookmarks!", host)
+        server = LoopbackHTTPServer((host, port), RequestHandler)
+    server.runner = runner
+    server.stats_func = stats_func
+    server.token = token
+    # Host headers that are accepted (a non-loopback serve_host is accepted too, if configured):
+    server.allowed_hosts = frozenset(LOOPBACK_HOSTS + (host.lower(),))
+    return server
+
+
+def write_token(filepath=DEFAULT_TOKEN_FILEPATH):
+    """ Create a random server token and write it to filepath, readable only by the user. Returns the token. """
+    filepath = os.path.expanduser(filepath)
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    if os.path.exists(filepath):
+        os.remove(filepath)
+    token = secrets.token_urlsafe(32)
+    with os.fdopen(os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as fd:
+        fd.write(token)
+    return token
+
+
+def serve(handlers, config, stats_func=None):
+    """
+    Run server until shut down (POST /shutdown or Ctrl+C). Config parameters:
+        serve_socket: Listen on this unix socket.
+        serve_host, serve_port: Otherwise listen on this address (default 127.0.0.1:7270).
+        serve_workers: Number of jobs processed at the same time (default 2).
+        serve_token_filepath: Write the server token to this file (default ~/.cache/instaporter/serve_token).
+    """
+    runner = JobRunner(handlers, workers=config.get('serve_workers') or 2)
+    socket_path = config.get('serve_socket')
+    token_filepath = os.path.expanduser(config.get('serve_token_filepath') or DEFAULT_TOKEN_FILEPATH)
+    token = write_token(token_filepath)
+    if socket_path and not hasattr(socket, 'AF_UNIX'):
+        logger.warning("Unix sockets are not available on this platform; using loopback http.")
+        socket_path = None
+    server = make_server(runner, host=config.get('serve_host') or '127.0.0.1',
+                         port=config.get('serve_port') or DEFAULT_PORT,
+                         socket_path=os.path.expanduser(socket_path) if socket_path else None,
+                         stats_func=stats_func, token=token)
+    print("Instaporter serving on %s" % (socket_path or "http://%s:%s" % server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Interrupted, shutting down...")
+    finally:
+        server.server_close()
+        runner.shutdown()
+        if os.path.exists(token_filepath):
+            os.remove(token_filepath)
+        if socket_path and os.path.exists(server.server_address):
+            os.remove(server.server_address)
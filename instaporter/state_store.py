@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Persistence of session state (cookies, token verification stamps, etc.)
+
+Several instaporter processes (and threads) may run at the same time, e.g. a resident server,
+a drain and a couple of url commands started from the browser. To make sure they do not
+corrupt each other's files:
+* Files are written atomically: the data is written to a temporary file in the same directory,
+  which is then renamed over the old file. Readers see either the old or the new file, never half of it.
+* Read-modify-write cycles are done while holding an exclusive lock on <filepath>.lock
+  (fcntl.flock on posix, msvcrt.locking on Windows).
+* The file is only written if the content actually changed.
+
+StateStore keeps a dict of sections in a compact json file:
+    store = StateStore("~/.cache/instaporter/state.json")
+    store.update('verified', {key: entry})      # Merge into section; a value of None deletes the key.
+    store.replace('cookies', cookies_to_list(session.cookies))
+    cookies = store.get('cookies', [])
+
+Cookies are stored as a list of dicts (see cookies_to_list and cookies_from_list) instead of pickled
+cookiejars, which were slow to write and unsafe to load.
+
+"""
+
+import os
+import json
+import stat
+import tempfile
+import threading
+from requests.cookies import create_cookie
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+DEFAULT_FILEPATH = "~/.cache/instaporter/state.json"
+
+
+def atomic_write(filepath, data):
+    """
+    Write data (str or bytes) to filepath atomically: write to a temporary file and rename it.
+    Permissions of an existing file are kept; new files are only readable by the user.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    dirname = os.path.dirname(filepath)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    fd, tmppath = tempfile.mkstemp(dir=dirname or '.', prefix='.%s.' % os.path.basename(filepath), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmpfile:
+            tmpfile.write(data)
+            tmpfile.flush()
+            os.fsync(tmpfile.fileno())
+        if os.path.exists(filepath):
+            os.chmod(tmppath, stat.S_IMODE(os.stat(filepath).st_mode))
+        os.replace(tmppath, filepath)
+    except BaseException:
+        try:
+            os.remove(tmppath)
+        except OSError:
+            pass
+        raise
+
+
+class FileLock(object):
+    """
+    Exclusive lock on <filepath>.lock, across processes and threads. Use as context manager:
+        with FileLock(filepath):
+            (read, modify and write filepath)
+    """
+
+    def __init__(self, filepath):
+        self.lockpath = filepath + '.lock'
+        self._thread_lock = threading.Lock()
+        self._fd = None
+
+    def acquire(self):
+        """ Wait for and take the lock. """
+        self._thread_lock.acquire()
+        try:
+            dirname = os.path.dirname(self.lockpath)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            fd = open(self.lockpath, 'a+')
+            if fcntl is not None:
+                fcntl.flock(fd.fileno(), fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                fd.seek(0)
+                msvcrt.locking(fd.fileno(), msvcrt.LK_LOCK, 1)
+            self._fd = fd
+        except BaseException:
+            self._thread_lock.release()
+            raise
+
+    def release(self):
+        """ Release the lock. """
+        fd, self._fd = self._fd, None
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd.fileno(), fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                fd.seek(0)
+                msvcrt.locking(fd.fileno(), msvcrt.LK_UNLCK, 1)
+            fd.close()
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class StateStore(object):
+    """ Json file with sections of state, which can be shared by several processes. """
+
+    def __init__(self, filepath=None):
+        """ filepath: Path to the json file. Defaults to ~/.cache/instaporter/state.json """
+        self.filepath = os.path.expanduser(filepath or DEFAULT_FILEPATH)
+        self.lock = FileLock(self.filepath)
+        self.writes = 0
+
+    def load(self):
+        """ Return dict with all sections from file (empty dict if the file does not exist or is invalid). """
+        try:
+            with open(self.filepath, 'rb') as fd:
+                state = json.loads(fd.read().decode('utf-8'))
+        except (IOError, OSError):
+            return {}
+        except ValueError:
+            # Includes UnicodeDecodeError, e.g. for an old pickled cookie file:
+            logger.warning("%s is not a valid state file; ignoring its content.", self.filepath)
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def get(self, section, default=None):
+        """ Return section from file. """
+        return self.load().get(section, default)
+
+    def modify(self, func):
+        """
+        Call func(state) with the current state (dict of sections) while holding the lock; func modifies
+        state in place. The file is written if the state changed. Returns True if the file was written.
+        """
+        with self.lock:
+            current = self.load()
+            state = json.loads(json.dumps(current))
+            func(state)
+            if state == current:
+                return False
+            atomic_write(self.filepath, json.dumps(state, separators=(',', ':'), sort_keys=True))
+            self.writes += 1
+            return True
+
+    def update(self, section, values):
+        """ Merge dict values into section. Keys with a value of None are removed. Returns True if written. """
+        def merge(state):
+            """ Merge values into state[section]. """
+            data = state.setdefault(section, {})
+            for key, value in values.items():
+                if value is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+        return self.modify(merge)
+
+    def replace(self, section, data):
+        """ Replace section with data (None removes the section). Returns True if written. """
+        def replace(state):
+            """ Set state[section]. """
+            if data is None:
+                state.pop(section, None)
+            else:
+                state[section] = data
+        return self.modify(replace)
+
+
+def cookies_to_list(cookiejar):
+    """ Return list of dicts with the (unexpired) cookies of cookiejar. """
+    return [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path,
+             'expires': cookie.expires, 'secure': cookie.secure, 'rest': getattr(cookie, '_rest', {})}
+            for cookie in cookiejar if not cookie.is_expired()]
+
+
+def cookies_from_list(cookies, cookiejar):
+    """ Add cookies (list of dicts, as returned by cookies_to_list) to cookiejar. """
+    for cookie in cookies:
+        cookiejar.set_cookie(create_cookie(**cookie))
+    return cookiejar
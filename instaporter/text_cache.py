@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+On-disk cache for bookmark texts (bookmarks/get_text).
+
+Texts are stored zlib-compressed in an SQLite database, keyed by bookmark_id
+together with the bookmark's hash (which changes when the bookmark changes).
+The total size of the compressed texts is capped at max_bytes; when the cap
+is exceeded, the least recently used texts are evicted.
+
+Usage:
+    cache = TextCache("~/.cache/instaporter/texts.sqlite", max_bytes=200*2**20)
+    client.text_cache = cache
+    text = client.get_bookmark_text(bookmark_id, bookmark_hash)   # Only requests text if not cached.
+
+    prefetch_texts(client, folder_id='unread', workers=4)   # Warm the cache for all unread bookmarks.
+
+"""
+
+import os
+import time
+import zlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import logging
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS texts (
+    bookmark_id INTEGER PRIMARY KEY,
+    hash TEXT,
+    size INTEGER NOT NULL,
+    last_access REAL NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS texts_last_access ON texts (last_access);
+"""
+
+
+class TextCache(object):
+    """
+    Size-capped LRU cache of compressed bookmark texts.
+    Can be used from several threads.
+    """
+
+    def __init__(self, filepath=None, max_bytes=200*2**20, level=6):
+        """
+        Args:
+            filepath: Path to the SQLite database file. Defaults to ~/.cache/instaporter/texts.sqlite
+            max_bytes: Max total size of the (compressed) texts in the cache.
+            level: zlib compression level.
+        """
+        if filepath is None:
+            filepath = "~/.cache/instaporter/texts.sqlite"
+        if filepath != ':memory:':
+            filepath = os.path.expanduser(filepath)
+            dirname = os.path.dirname(filepath)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        self.filepath = filepath
+        self.max_bytes = max_bytes
+        self.level = level
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(filepath, check_same_thread=False)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """ Close database connection. """
+        with self._lock:
+            self.db.close()
+
+    @property
+    def total_bytes(self):
+        """ Total size of the compressed texts in the cache. """
+        with self._lock:
+            return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM texts").fetchone()[0]
+
+    def __contains__(self, key):
+        """ key is either a bookmark_id or a (bookmark_id, hash) tuple. """
+        bookmark_id, bhash = key if isinstance(key, tuple) else (key, None)
+        with self._lock:
+            row = self.db.execute("SELECT hash FROM texts WHERE bookmark_id = ?", (bookmark_id,)).fetchone()
+        return row is not None and (bhash is None or row[0] == bhash)
+
+    def get(self, bookmark_id, bhash=None):
+        """
+        Return cached text for bookmark, or None if not cached.
+        If bhash is given, the cached text is only returned if it was stored with the same hash.
+        """
+        with self._lock:
+            row = self.db.execute("SELECT hash, data FROM texts WHERE bookmark_id = ?", (bookmark_id,)).fetchone()
+            if row is None or (bhash is not None and row[0] != bhash):
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.db:
+                self.db.execute("UPDATE texts SET last_access = ? WHERE bookmark_id = ?", (time.time(), bookmark_id))
+        return zlib.decompress(row[1]).decode('utf-8')
+
+    def put(self, bookmark_id, bhash, text):
+        """ Store text for bookmark and evict least recently used texts if the cache is too big. """
+        data = zlib.compress(text.encode('utf-8'), self.level)
+        if len(data) > self.max_bytes:
+            logger.info("Text for bookmark %s is larger than the cache (%s bytes), not caching.", bookmark_id, len(data))
+            return
+        with self._lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO texts (bookmark_id, hash, size, last_access, data) "
+                            "VALUES (?, ?, ?, ?, ?)", (bookmark_id, bhash, len(data), time.time(), data))
+            self._evict()
+
+    def _evict(self):
+        """ Evict least recently used texts until total size is below max_bytes. Must hold lock. """
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM texts").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evict = []
+        for bookmark_id, size in self.db.execute("SELECT bookmark_id, size FROM texts ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            evict.append((bookmark_id,))
+            total -= size
+        self.db.executemany("DELETE FROM texts WHERE bookmark_id = ?", evict)
+        logger.debug("Evicted %s texts from cache.", len(evict))
+
+    def delete(self, bookmark_id):
+        """ Remove text for bookmark from the cache. """
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM texts WHERE bookmark_id = ?", (bookmark_id,))
+
+
+def prefetch_texts(client, folder_id='unread', workers=4, limit=500):
+    """
+    Warm client.text_cache with the texts of all bookmarks in folder.
+    The bookmarks are listed <limit> at a time (see InstapaperClient.iter_bookmarks).
+    Texts are fetched by up to <workers> concurrent requests. Bookmarks which are
+    already cached (with the same hash) are skipped.
+    Returns dict with counts of 'cached', 'fetched' and 'failed' bookmarks.
+    """
+    cache = client.text_cache
+    if cache is None:
+        raise ValueError("Client does not have a text_cache.")
+    stats = {'cached': 0, 'fetched': 0, 'failed': 0}
+    todo = []
+    for bookmark in client.iter_bookmarks(folder_id, batch=limit):
+        if (bookmark['bookmark_id'], bookmark.get('hash')) in cache:
+            stats['cached'] += 1
+        else:
+            todo.append(bookmark)
+
+    def fetch(bookmark):
+        """ Fetch text (which stores it in the cache). """
+        try:
+            client.get_bookmark_text(bookmark['bookmark_id'], bookmark.get('hash'))
+        except Exception as e:    # pylint: disable=W0703
+            logger.error("Could not fetch text for bookmark %s: %s", bookmark['bookmark_id'], e)
+            return False
+        return (bookmark['bookmark_id'], bookmark.get('hash')) in cache
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for ok in executor.map(fetch, todo):
+            stats['fetched' if ok else 'failed'] += 1
+    logger.info("Prefetched texts for folder %s: %s", folder_id, stats)
+    return stats
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Cache of access token verifications.
+
+InstapaperClient used to call account/verify_credentials every time it was created with
+existing access tokens, adding a full round trip to every run. Instead, the client records
+when the tokens were last verified (and for which user), and skips the verification if that
+was less than <window> seconds ago. If the tokens have been revoked in the meantime,
+the first API call fails with 401/403; the client then verifies the tokens and retries the call
+(see InstapaperClient.post).
+
+Tokens are identified by a hash of the token and secret; the tokens themselves are not stored.
+The verifications are kept in the 'verified' section of a StateStore file.
+
+Usage:
+    cache = TokenCache("~/.cache/instaporter/state.json", window=86400)
+    userinfo = cache.get(tokens)    # None if not verified within the window.
+    cache.put(tokens, userinfo)
+
+"""
+
+import time
+import hashlib
+import logging
+logger = logging.getLogger(__name__)
+
+from .state_store import StateStore, DEFAULT_FILEPATH
+
+
+DEFAULT_WINDOW = 86400
+
+
+def token_key(tokens):
+    """ Return cache key for access tokens dict (with oauth_token and oauth_token_secret). """
+    text = "%s&%s" % (tokens.get('oauth_token', ''), tokens.get('oauth_token_secret', ''))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+
+class TokenCache(object):
+    """ Token verification stamps, stored in a StateStore. """
+
+    def __init__(self, filepath=None, window=DEFAULT_WINDOW):
+        """
+        Args:
+            filepath: Path to the state file. Defaults to ~/.cache/instaporter/state.json
+            window: Number of seconds a verification is trusted. 0 means always verify.
+        """
+        self.store = StateStore(filepath or DEFAULT_FILEPATH)
+        self.window = window
+
+    def get(self, tokens, username=None):
+        """
+        Return cached userinfo if tokens were verified less than <window> seconds ago, otherwise None.
+        If username is given, the entry must be for that user.
+        """
+        if not self.window or not tokens:
+            return None
+        entry = self.store.get('verified', {}).get(token_key(tokens))
+        if not entry or time.time() - entry['verified'] > self.window:
+            return None
+        if username and entry.get('username') != username:
+            return None
+        return entry['userinfo']
+
+    def put(self, tokens, userinfo):
+        """ Record that tokens were verified just now, with the returned userinfo. """
+        try:
+            username = userinfo[0]['username']
+        except (IndexError, KeyError, TypeError):
+            username = None
+        entry = {'verified': time.time(), 'username': username, 'userinfo': userinfo}
+        self.store.update('verified', {token_key(tokens): entry})
+
+    def invalidate(self, tokens):
+        """ Remove the verification of tokens. """
+        self.store.update('verified', {token_key(tokens): None})
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,C0301,R0913
+
+"""
+
+Durable queue of bookmark uploads, stored in an SQLite database (WAL mode).
+
+Processed content is put in the queue before it is uploaded, so if the upload fails
+(or the program crashes), nothing is lost; the job is simply uploaded by the next drain.
+
+Workers claim jobs with a time-limited lease. A job whose lease has expired (e.g. because the
+worker died) can be claimed by another worker. Several threads, processes, or machines sharing
+the database file can drain the same queue. Marking a job as done is idempotent.
+
+Job states: pending -> leased -> done, or back to pending if the upload failed
+(until max_attempts is reached, then failed). A failed job is not retried until
+retry_delay*2**(attempts-1) seconds have passed.
+
+Usage:
+    queue = UploadQueue("~/.cache/instaporter/uploads.sqlite")
+    queue.enqueue({'title': title, 'content': content, ...}, key=url)
+    stats = drain_queue(queue, client, workers=2)
+
+"""
+
+import os
+import json
+import time
+import socket
+import sqlite3
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT UNIQUE,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    error TEXT,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires);
+"""
+
+
+def make_owner():
+    """ Return a worker id that is unique across threads, processes and machines. """
+    return "%s:%s:%s" % (socket.gethostname(), os.getpid(), threading.get_ident())
+
+
+class Job(object):
+    """ A claimed job. """
+
+    def __init__(self, job_id, key, payload, attempts, owner):
+        self.job_id = job_id
+        self.key = key
+        self.payload = payload
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self):
+        return "<Job %s (%s), attempt %s>" % (self.job_id, self.key, self.attempts)
+
+
+class UploadQueue(object):
+    """
+    SQLite-backed job queue with leases.
+    The connection is shared by the threads of this process (serialized with a lock);
+    other processes use their own UploadQueue on the same file.
+    """
+
+    def __init__(self, filepath=None, lease_seconds=300, max_attempts=5, retry_delay=30):
+        """
+        Args:
+            filepath: Path to the SQLite database file. Defaults to ~/.cache/instaporter/uploads.sqlite
+            lease_seconds: How long a claimed job is reserved for the claiming worker.
+            max_attempts: Number of failed uploads before a job is marked as failed.
+            retry_delay: Seconds to wait before retrying a failed upload (doubled for each attempt).
+        """
+        if filepath is None:
+            filepath = "~/.cache/instaporter/uploads.sqlite"
+        if filepath != ':memory:':
+            filepath = os.path.expanduser(filepath)
+            dirname = os.path.dirname(filepath)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+        self.filepath = filepath
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        # isolation_level=None: we manage transactions ourselves (BEGIN IMMEDIATE when claiming).
+        self.db = sqlite3.connect(filepath, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        """ Close database connection. """
+        with self._lock:
+            self.db.close()
+
+    def _transaction(self, func, *args):
+        """ Call func(*args) in an immediate (write-locked) transaction. Must hold lock. """
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(*args)
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+        return result
+
+    def enqueue(self, payload, key=None):
+        """
+        Add job with payload (a json-serializable dict) to the queue. Returns job_id.
+        If a job with the same key already exists, it is reset to pending with the new payload,
+        unless it is currently leased by a worker.
+        """
+        now = time.time()
+        def insert():
+            row = self.db.execute("SELECT job_id, state, lease_expires FROM jobs WHERE key = ?", (key,)).fetchone() \
+                if key is not None else None
+            if row is None:
+                return self.db.execute("INSERT INTO jobs (key, payload, created, updated) VALUES (?, ?, ?, ?)",
+                                       (key, json.dumps(payload), now, now)).lastrowid
+            job_id, state, lease_expires = row
+            if state == 'leased' and lease_expires > now:
+                logger.info("Job %s (%s) is being uploaded by another worker; not re-queued.", job_id, key)
+                return job_id
+            self.db.execute("UPDATE jobs SET payload = ?, state = 'pending', attempts = 0, lease_owner = NULL, "
+                            "lease_expires = NULL, error = NULL, updated = ? WHERE job_id = ?",
+                            (json.dumps(payload), now, job_id))
+            return job_id
+        with self._lock:
+            return self._transaction(insert)
+
+    def claim(self, owner=None, n=1):
+        """
+        Claim up to n jobs that are pending (and not waiting for a retry), or leased with an expired lease.
+        Returns list of Job objects (empty if there is nothing to do).
+        """
+        owner = owner or make_owner()
+        now = time.time()
+        def claim():
+            rows = self.db.execute("SELECT job_id, key, payload, attempts FROM jobs "
+                                   "WHERE state IN ('pending', 'leased') AND (lease_expires IS NULL OR lease_expires < ?) "
+                                   "ORDER BY job_id LIMIT ?", (now, n)).fetchall()
+            self.db.executemany("UPDATE jobs SET state = 'leased', lease_owner = ?, lease_expires = ?, "
+                                "attempts = attempts + 1, updated = ? WHERE job_id = ?",
+                                [(owner, now + self.lease_seconds, now, row[0]) for row in rows])
+            return [Job(job_id, key, json.loads(payload), attempts + 1, owner)
+                    for job_id, key, payload, attempts in rows]
+        with self._lock:
+            return self._transaction(claim)
+
+    def extend(self, job, seconds=None):
+        """ Extend the lease of job. Returns False if the job is no longer leased by job.owner. """
+        with self._lock:
+            cursor = self.db.execute("UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND state = 'leased' "
+                                     "AND lease_owner = ?",
+                                     (time.time() + (seconds or self.lease_seconds), job.job_id, job.owner))
+        return cursor.rowcount == 1
+
+    def complete(self, job, result=None):
+        """
+        Mark job as done. Idempotent: completing a job that is already done has no effect.
+        A job can be completed even if its lease expired (the upload did happen).
+        Returns True if the job was marked as done by this call.
+        """
+        with self._lock:
+            cursor = self.db.execute("UPDATE jobs SET state = 'done', lease_owner = NULL, lease_expires = NULL, "
+                                     "result = ?, error = NULL, updated = ? WHERE job_id = ? AND state != 'done'",
+                                     (json.dumps(result), time.time(), job.job_id))
+        return cursor.rowcount == 1
+
+    def fail(self, job, error):
+        """
+        Release job after a failed upload. The job is made pending again (to be retried after a delay),
+        or marked as failed if it has been attempted max_attempts times.
+        Has no effect if another worker has taken over the job. Returns the new state.
+        """
+        state = 'failed' if job.attempts >= self.max_attempts else 'pending'
+        # For pending jobs, lease_expires is the earliest time of the next attempt:
+        now = time.time()
+        retry_at = now + min(3600, self.retry_delay*2**(job.attempts - 1)) if state == 'pending' else None
+        with self._lock:
+            self.db.execute("UPDATE jobs SET state = ?, lease_owner = NULL, lease_expires = ?, error = ?, "
+                            "updated = ? WHERE job_id = ? AND state = 'leased' AND lease_owner = ?",
+                            (state, retry_at, str(error), now, job.job_id, job.owner))
+        return state
+
+    def retry_failed(self):
+        """ Make all failed jobs pending again. Returns number of jobs. """
+        with self._lock:
+            cursor = self.db.execute("UPDATE jobs SET state = 'pending', attempts = 0, lease_expires = NULL, "
+                                     "updated = ? WHERE state = 'failed'", (time.time(),))
+        return cursor.rowcount
+
+    def counts(self):
+        """ Return dict with number of jobs in each state. """
+        with self._lock:
+            rows = self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        counts.update(rows)
+        return counts
+
+    def purge_done(self, older_than=0):
+        """ Delete done jobs (and their content) last updated more than older_than seconds ago. """
+        with self._lock:
+            cursor = self.db.execute("DELETE FROM jobs WHERE state = 'done' AND updated < ?",
+                                     (time.time() - older_than,))
+        return cursor.rowcount
+
+
+def upload_job(client, job):
+    """
+    Upload job payload with client.add_bookmark.
+    Returns the bookmark_id. Raises ValueError if the upload did not succeed.
+    """
+    bookmark = client.add_bookmark(**job.payload)
+    try:
+        if not client.status or bookmark[0]['type'] != 'bookmark':
+            raise ValueError("Unexpected add_bookmark response: %s" % (bookmark,))
+        return bookmark[0]['bookmark_id']
+    except (TypeError, IndexError, KeyError):
+        raise ValueError("Unexpected add_bookmark response: %s" % (bookmark,))
+
+
+def drain_queue(queue, client, workers=2, wait=None, poll=0.5):
+    """
+    Upload jobs from queue with <workers> worker threads, until the queue is empty.
+    If wait is a threading.Event, the workers keep polling the queue (every <poll> seconds)
+    until the event is set, so the queue can be drained while it is being filled.
+    Returns dict with number of jobs 'done', 'retry' (failed, but will be retried) and 'failed'.
+    """
+    stats = {'done': 0, 'retry': 0, 'failed': 0}
+    stats_lock = threading.Lock()
+
+    def work():
+        """ Worker: claim and upload jobs until there are no more. """
+        owner = make_owner()
+        while True:
+            # Check the event *before* claiming, so jobs enqueued before the event was set are not missed:
+            finished = wait is None or wait.is_set()
+            jobs = queue.claim(owner)
+            if not jobs:
+                if finished:
+                    return
+                time.sleep(poll)
+                continue
+            job = jobs[0]
+            try:
+                bookmark_id = upload_job(client, job)
+            except Exception as e:    # pylint: disable=W0703
+                state = queue.fail(job, e)
+                logger.warning("Upload of %s failed (%s); job is now %s.", job, e, state)
+                outcome = 'failed' if state == 'failed' else 'retry'
+            else:
+                queue.complete(job, result=bookmark_id)
+                outcome = 'done'
+            with stats_lock:
+                stats[outcome] += 1
+
+    threads = [threading.Thread(target=work, name="drain-%s" % i) for i in range(max(1, workers))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    logger.info("Upload queue drained: %s (queue: %s)", stats, queue.counts())
+    return stats
@@ -20,22 +20,42 @@
 """
 Instaporter utility module.
 
+Config files are parsed with the C yaml loader (if PyYAML was built with libyaml), and the parsed
+data is cached in ~/.cache/instaporter/config.cache (marshal format), keyed by each file's
+mtime and size, so an unchanged config is not parsed again on every run. See load_yaml.
+Long-running processes can use ConfigLoader.job() (or reload_if_changed()) to pick up config edits.
 
 """
 
 
 import os
 import yaml
+import marshal
 import argparse
 import getpass
+import threading
+from contextlib import contextmanager
 #from six import string_types
 import logging
 logger = logging.getLogger(__name__)
 #from urllib.parse import urljoin, urlsplit
 
+from .state_store import FileLock, atomic_write
+
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
 
 LIBDIR = os.path.dirname(os.path.realpath(__file__))
 
+DEFAULT_CONFIG_FILEPATH = "~/.config/instaporter/config.yaml"
+# Cache of parsed yaml files; set to None to disable:
+CONFIG_CACHE_FILEPATH = "~/.cache/instaporter/config.cache"
+# Bump if the cache format changes:
+CONFIG_CACHE_VERSION = 1
+
 
 
 def credentials_prompt(user='', password=''):
@@ -48,13 +68,63 @@ def credentials_prompt(user='', password=''):
 
 
 
+def file_stamp(filepath):
+    """ Return (mtime in ns, size) of file, or None if it does not exist. """
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def read_config_cache():
+    """ Return the config cache dict, {'version': n, 'files': {filepath: (stamp, data)}}. """
+    try:
+        with open(os.path.expanduser(CONFIG_CACHE_FILEPATH), 'rb') as fd:
+            cache = marshal.load(fd)
+    except (IOError, OSError, EOFError, ValueError, TypeError):
+        return {}
+    if not isinstance(cache, dict) or cache.get('version') != CONFIG_CACHE_VERSION:
+        return {}
+    return cache
+
+
+def load_yaml(filepath):
+    """
+    Load yaml file. The parsed data is cached in CONFIG_CACHE_FILEPATH,
+    and used as long as the file's mtime and size are unchanged.
+    Raises FileNotFoundError if the file does not exist.
+    """
+    filepath = os.path.abspath(filepath)
+    stamp = file_stamp(filepath)
+    if stamp is None:
+        raise FileNotFoundError("No such file: %s" % filepath)
+    cache = read_config_cache() if CONFIG_CACHE_FILEPATH else {}
+    files = cache.get('files', {})
+    if filepath in files and tuple(files[filepath][0]) == stamp:
+        return files[filepath][1]
+    with open(filepath) as fd:
+        data = yaml.load(fd, Loader=YamlLoader)
+    if CONFIG_CACHE_FILEPATH:
+        files[filepath] = (stamp, data)
+        try:
+            atomic_write(os.path.expanduser(CONFIG_CACHE_FILEPATH),
+                         marshal.dumps({'version': CONFIG_CACHE_VERSION, 'files': files}))
+        except ValueError:
+            # marshal only supports basic types; e.g. yaml dates cannot be cached.
+            logger.debug("Could not cache %s: unsupported data types.", filepath)
+        except (IOError, OSError) as e:
+            logger.debug("Could not write config cache: %s", e)
+    return data
+
+
 def load_config(filepath=None):
     """ Load config from filesystem. """
     if filepath is None:
-        filepath = os.path.expanduser("~/.config/instaporter/config.yaml")
+        filepath = os.path.expanduser(DEFAULT_CONFIG_FILEPATH)
     filepath = os.path.normpath(filepath)
     try:
-        config = yaml.load(open(filepath))
+        config = load_yaml(filepath) or {}
         logger.debug("Config with %s keys loaded from file: %s", len(config), filepath)
         return config
     except FileNotFoundError:
@@ -63,11 +133,25 @@ def load_config(filepath=None):
 
 
 def save_config(config, filepath=None):
-    """ Load config from filesystem. """
+    """
+    Save config to filesystem. The file is written atomically (while holding a lock, so concurrent
+    instaporter processes do not clobber each other), and only if the content changed.
+    Returns True if the file was written.
+    """
     if filepath is None:
         filepath = os.path.expanduser("~/.instaporter.yaml")
-    yaml.dump(config, open(filepath, 'w'))
+    text = yaml.dump(config)
+    with FileLock(filepath):
+        try:
+            with open(filepath) as fd:
+                if fd.read() == text:
+                    logger.debug("Config unchanged, not writing file: %s", filepath)
+                    return False
+        except (IOError, OSError):
+            pass
+        atomic_write(filepath, text)
     logger.debug("Config with %s keys dumped to file: %s", len(config), filepath)
+    return True
 
 
 def get_config(args=None, config_filepath=None):
@@ -90,6 +174,90 @@ def get_config(args=None, config_filepath=None):
     return config
 
 
+class ConfigLoader(object):
+    """
+    Loads config (with get_config) and reloads it if the config file has changed.
+    The config dict is updated in place, so objects holding a reference to it see the changes.
+    Keys added to the config after loading (e.g. by the client) are kept, unless the file now has them.
+    Functions in on_reload are called with the config after each reload (e.g. to re-apply derived settings).
+    Usage:
+        loader = ConfigLoader(config_filepath, args, on_reload=[configure_sessions])
+        client = InstapaperClient(loader.config, ...)
+        ...
+        with loader.job():     # e.g. for each job in a long-running, multi-threaded process.
+            ...
+    """
+
+    def __init__(self, config_filepath=None, args=None, on_reload=None):
+        self.config_filepath = os.path.expanduser(config_filepath or DEFAULT_CONFIG_FILEPATH)
+        self.args = dict(args or {})
+        self.on_reload = list(on_reload or [])
+        self.config = {}
+        # The config as loaded (without keys added later):
+        self.loaded = {}
+        self.stamp = None
+        self._cond = threading.Condition()
+        self._active = 0
+        self._pending = False
+        self.reload()
+
+    def reload(self):
+        """
+        Load config file and merge with args. Must not be called while other threads use the
+        config (the dict is updated in place); see job().
+        """
+        with self._cond:
+            self.stamp = file_stamp(self.config_filepath)
+            config = get_config(dict(self.args), self.config_filepath)
+            loaded = dict(config)
+            for key, value in self.config.items():
+                if key not in self.loaded and key not in config:
+                    config[key] = value
+            for key in [key for key in self.config if key not in config]:
+                del self.config[key]
+            self.config.update(config)
+            self.loaded = loaded
+            for func in self.on_reload:
+                func(self.config)
+            return self.config
+
+    def reload_if_changed(self):
+        """ Reload config if the config file has changed (cheap, only stats the file). Returns True if reloaded. """
+        with self._cond:
+            if file_stamp(self.config_filepath) == self.stamp:
+                return False
+            logger.info("Config file %s changed, reloading.", self.config_filepath)
+            self.reload()
+            return True
+
+    @contextmanager
+    def job(self):
+        """
+        Context manager for a job using the config, which may run concurrently with other jobs.
+        If the config file has changed, it is reloaded before the job starts, but only when no
+        other jobs are running: the job waits for the running jobs to finish (and new jobs wait
+        for the reload), so a job never sees a config that is being replaced.
+        """
+        with self._cond:
+            if not self._pending and file_stamp(self.config_filepath) != self.stamp:
+                self._pending = True
+            while self._pending and self._active:
+                self._cond.wait()
+            if self._pending:
+                try:
+                    self.reload_if_changed()
+                finally:
+                    self._pending = False
+                    self._cond.notify_all()
+            self._active += 1
+        try:
+            yield self.config
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify_all()
+
+
 def load_consumer_keys(path=None):
     """
     Load Instapaper client/consumer key and secret.
@@ -104,8 +272,7 @@ def load_consumer_keys(path=None):
         path = os.path.expanduser("~/.config/instaporter/instaporter_key_and_secret.yaml")
     if not os.path.isfile(path):
         path = os.path.join(os.path.dirname(LIBDIR), "consumer_key_and_secret.yaml")
-    with open(path) as fd:
-        keys = yaml.load(fd)
+    keys = load_yaml(path)
     logger.debug("Client/Consumer API key and secret loaded from file %s", path)
     return keys
 
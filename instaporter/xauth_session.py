@@ -99,6 +99,8 @@ oauthlib details:
 from urllib.parse import parse_qsl
 #import oauthlib
 from requests_oauthlib import OAuth1Session #, OAuth1
+from oauthlib.oauth1 import SIGNATURE_HMAC, SIGNATURE_TYPE_AUTH_HEADER
+from .oauth_signer import FastOAuth1
 #from six import string_types
 import logging
 logger = logging.getLogger(__name__)
@@ -107,8 +109,36 @@ logger = logging.getLogger(__name__)
 class XAuthSession(OAuth1Session):
     """
     Requests session with xAuth style OAuth authorization.
+    Call enable_fast_signer() to sign requests with oauth_signer.FastOAuth1
+    instead of requests_oauthlib/oauthlib (same signatures, less CPU time).
     """
 
+    fast_signer = False
+
+    def enable_fast_signer(self, enable=True):
+        """
+        Use (or stop using) the fast signer. Only has effect for HMAC-SHA1 signatures in
+        the Authorization header (the Instapaper setup). Returns True if the fast signer is used.
+        """
+        client = self._client.client
+        self.fast_signer = enable and client.signature_method == SIGNATURE_HMAC \
+            and client.signature_type == SIGNATURE_TYPE_AUTH_HEADER
+        self.update_auth()
+        return self.fast_signer
+
+    def update_auth(self):
+        """ Set the session's auth from the current client/consumer keys and tokens. """
+        client = self._client.client
+        if self.fast_signer:
+            self.auth = FastOAuth1(client.client_key, client.client_secret,
+                                   client.resource_owner_key, client.resource_owner_secret)
+        else:
+            self.auth = self._client
+
+    def _populate_attributes(self, token):
+        super()._populate_attributes(token)
+        self.update_auth()
+
 
     def request_access_tokens(self, url, username, password='', mode='client_auth'):
         """
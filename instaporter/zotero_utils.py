@@ -31,6 +31,8 @@ from six import string_types
 from functools import partial
 from copy import deepcopy
 
+from .html_utils import get_doi_data
+
 try:
     from pyzotero import zotero
 except ImportError:
@@ -68,6 +70,12 @@ def add_to_zotero(config, metadata, pdf=None, collections=None, template=None):
     if collections is None:
         collections = config.get('collection_ids')
 
+    if not metadata.get('doi') and metadata['html'].get('doi'):
+        metadata['doi'] = get_doi_data(metadata['html']['doi'])
+    if not metadata.get('doi'):
+        print("No DOI data available, cannot add item to Zotero.")
+        return
+
     html_title = metadata['html'].get('title')
     doi_data = metadata['doi'].copy() # zotero_data_from_cls will modify input doi_data
     if not (html_title and html_title.lower() == doi_data.get('title', '').strip(" []<>").lower()):
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142,W0212
+
+
+"""
+Benchmark: handling a bookmarks/list response with limit=500 and highlights.
+Cases:
+* json x2: the response is parsed by is_error and again by check_response, giving dicts (the old client).
+* typed: parsed once (instapaper.response_json) and converted to models (models.from_json).
+* stream: parsed incrementally from 64 kB chunks as they are downloaded (models.parse_stream).
+
+For each case: CPU time per listing, peak memory while handling it (including the downloaded body,
+which a streamed response never holds in full), and memory kept by the result.
+
+Run with:
+    python tests/benchmark_bookmark_list.py [n_bookmarks]
+"""
+
+import os
+import sys
+import time
+import json
+import tracemalloc
+import requests
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter.instapaper import response_json, is_error, STREAM_CHUNK_SIZE
+from instaporter.models import from_json, parse_stream
+
+
+def make_listing(n):
+    """ Return bookmarks/list response body (bytes) with n bookmarks and 2n highlights. """
+    bookmarks = [{"type": "bookmark", "bookmark_id": 500000000 + i, "hash": "%032x" % (i * 7919),
+                  "url": "http://www.example.com/journal/2016/article-%s.html" % i,
+                  "title": "A long, descriptive article title number %s — with ünïcode" % i,
+                  "description": "Author A, Author B & Author C. Journal of Examples %s (2016)" % i,
+                  "time": 1450000000 + i, "starred": str(i % 3 == 0 and 1 or 0), "private_source": "",
+                  "progress": (i % 100) / 100, "progress_timestamp": 1460000000 + i} for i in range(n)]
+    highlights = [{"type": "highlight", "highlight_id": 900000 + i, "bookmark_id": 500000000 + i // 2,
+                   "text": "An interesting sentence that was highlighted while reading article %s." % (i // 2),
+                   "note": None, "position": i % 2, "time": 1455000000 + i} for i in range(2 * n)]
+    data = {"user": {"type": "user", "user_id": 54321, "username": "benchuser"},
+            "bookmarks": bookmarks, "highlights": highlights, "delete_ids": ""}
+    return json.dumps(data).encode('utf-8')
+
+
+def make_response(body):
+    """ Return requests.Response with (a copy of) body, as if it had been downloaded. """
+    response = requests.models.Response()
+    response.status_code = 200
+    response.headers['Content-Type'] = 'application/json'
+    response.encoding = 'utf-8'
+    response._content = bytes(bytearray(body))
+    return response
+
+
+def json_twice(body):
+    """ The old check_response: is_error parses the json, then it is parsed again. """
+    response = make_response(body)
+    response.json()
+    return response.json()
+
+
+def typed(body):
+    """ Parse once and convert to typed objects. """
+    response = make_response(body)
+    is_error(response)
+    return from_json(response_json(response))
+
+
+def stream(body):
+    """ Parse incrementally from chunks (as from response.iter_content). """
+    chunks = (body[i:i+STREAM_CHUNK_SIZE] for i in range(0, len(body), STREAM_CHUNK_SIZE))
+    return parse_stream(chunks)
+
+
+def measure(func, body, repeat):
+    """ Return (ms per call, peak MB, retained MB) for func(body). """
+    func(body)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(body)
+    elapsed = (time.perf_counter() - start) / repeat
+    tracemalloc.start()
+    result = func(body)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed * 1000, peak / 2**20, current / 2**20
+
+
+def main(n=500):
+    """ Run benchmark and print results. """
+    body = make_listing(n)
+    print("bookmarks/list: %s bookmarks, %s highlights, %.0f kB body\n" % (n, 2 * n, len(body) / 1024))
+    print("%-10s %10s %10s %12s" % ("case", "ms", "peak MB", "retained MB"))
+    for label, func in [('json x2', json_twice), ('typed', typed), ('stream', stream)]:
+        print("%-10s %10.2f %10.2f %12.2f" % ((label,) + measure(func, body, repeat=20)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
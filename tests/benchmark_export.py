@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Benchmark: exporting an account against the Instapaper stub, with simulated API latency
+on the bookmarks/get_text and bookmarks/<id>/highlights requests.
+Cases:
+* serial: one request at a time (like calling get_bookmark_text and bookmark_highlights in a loop).
+* export: AccountExport with 1, 4 and 8 workers.
+* resume: running the export again on the complete export directory.
+
+Run with:
+    python tests/benchmark_export.py [n_bookmarks] [latency_ms]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.export import AccountExport
+from instapaper_stub import InstapaperStub, make_bookmark
+
+
+TEXT = "<html><body>%s</body></html>" % ("<p>Some paragraph of article text.</p>" * 500)
+
+
+def main(n=200, latency_ms=20):
+    """ Run benchmark and print results. """
+    with InstapaperStub() as stub:
+        stub.server.bookmarks['unread'] = [make_bookmark(i) for i in range(1, n + 1)]
+
+        def slow_text(params):
+            time.sleep(latency_ms / 1000)
+            return 200, TEXT
+
+        def slow_highlights(params):
+            time.sleep(latency_ms / 1000)
+            return 200, [{"type": "highlight", "highlight_id": 1, "bookmark_id": 1, "text": "highlighted",
+                          "position": 0, "time": 1400000000}]
+
+        stub.server.overrides['bookmarks/get_text'] = slow_text
+        for i in range(1, n + 1):
+            stub.server.overrides['bookmarks/%s/highlights' % i] = slow_highlights
+        config = stub.config(token_cache_filepath=os.path.join(tempfile.mkdtemp(), "tokens.json"),
+                             api_rate=0, api_max_concurrency=32)
+        client = InstapaperClient(config, *stub.consumer_keys)
+        print("%s bookmarks, %s ms latency per request\n" % (n, latency_ms))
+        print("%-12s %10s %14s" % ("case", "seconds", "bookmarks/s"))
+
+        start = time.perf_counter()
+        for bookmark in client.iter_bookmarks('unread'):
+            client.get_bookmark_text(bookmark['bookmark_id'])
+            client.bookmark_highlights(bookmark['bookmark_id'])
+        elapsed = time.perf_counter() - start
+        print("%-12s %10.2f %14.1f" % ("serial", elapsed, n / elapsed))
+
+        for workers in (1, 4, 8):
+            directory = tempfile.mkdtemp()
+            start = time.perf_counter()
+            AccountExport(client, directory, workers=workers).run(['unread'])
+            elapsed = time.perf_counter() - start
+            print("%-12s %10.2f %14.1f" % ("export x%s" % workers, elapsed, n / elapsed))
+        start = time.perf_counter()
+        stats = AccountExport(client, directory, workers=8).run(['unread'])
+        elapsed = time.perf_counter() - start
+        print("%-12s %10.2f %14s" % ("resume", elapsed, "(%s resumed)" % stats['resumed']))
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
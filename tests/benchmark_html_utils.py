@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Benchmarks for the html rewriting functions, on large publisher-like pages.
+
+Run with:
+    python tests/benchmark_html_utils.py [size_in_MB]
+"""
+
+import os
+import re
+import sys
+import time
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter import html_utils
+
+
+# A paragraph from a nature.com methods section, with glyph images:
+PARAGRAPH = """<p class="norm">The sample (5&nbsp;<img src="/__chars/mu/black/med/base/glyph.gif"
+style="border:0; vertical-align:baseline;" alt="mu" />l) was deposited on a freshly cleaved mica surface
+(<a href="/nature/journal/v459/n7243/full/nature07971.html#ref12">Ted Pella</a>) and left to adsorb
+for 5&nbsp;min. 512&nbsp;<img src="/__chars/math/special/times/black/med/base/glyph.gif"
+style="border:0; vertical-align:middle;" alt="times" />&nbsp;512 pixels, with <img
+src="/__chars/math/special/sim/black/med/base/glyph.gif" style="border:0; vertical-align:baseline;"
+alt="approx" />10&#8211;30 class members, <i><img src="/__chars/theta/black/ital/base/glyph.gif"
+style="border:0; vertical-align:middle;" alt="theta" /></i> and an unknown <img
+src="/__chars/math/special/odot/black/med/base/glyph.gif" alt="odot" />.
+<img src="/nature/journal/v459/n7243/images/nature07971-m1.jpg"/> See
+<a href="#ref3">ref. 3</a> and <a href="/nature/journal/v459/n7243/full/nature07971.html#ref12">12</a>.</p>
+"""
+
+
+def make_page(size):
+    """ Return html page with (at least) size characters. """
+    n = size // len(PARAGRAPH) + 1
+    return "<html><head><title>Benchmark</title></head><body>\n" + PARAGRAPH * n + "</body></html>"
+
+
+def legacy_html_symbol_repl(html):
+    """ The previous implementation: one re.subn pass per symbol. """
+    symbols = """alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi
+              omicron pi rho sigma tau upsilon phi chi psi omega""".split()
+    greek = [(r'<img\s[^>]*?src="/__chars/%s/[^>]*>' % char, "&#%s;" % code)
+             for code, char in enumerate(symbols, 945)]
+    symbols = (("sim", 126), ("plusmn", 177), ("times", 215), ("lfen", 9001), ("rfen", 9002))
+    math = [(r'<img\s[^>]*?src="/__chars/math/special/%s/[^>]*>' % char, "&#%s;" % code)
+            for char, code in symbols]
+    other = [(r'<img\s[^>]*?src="/__chars/less/special/le/[^>]*>', "&#8804;"),
+             (r'<img\s[^>]*?src="/__chars/micro/[^>]*>', "&#956;"),
+             (r'<img\s[^>]*?src="/__chars/plus/special/plusmn/[^>]*>', "&#177;")]
+    for regex, rep in greek + math + other:
+        html = re.subn(regex, lambda match, rep=rep: rep, html, flags=re.MULTILINE+re.DOTALL)[0]
+    return html, html.count('src="/__chars')
+
+
+def legacy_make_urls_absolute(html, baseurl):
+    """ The previous implementation: one re.subn pass per attribute, no memoization. """
+    for tag in ('href', 'src'):
+        fmt = tag + '="%s"'
+        repl = lambda match, fmt=fmt: fmt % html_utils.urljoin(baseurl, match.group(1))
+        html = re.subn(tag+'="([^"]*?)"', repl, html, flags=re.MULTILINE)[0]
+    return html
+
+
+def timeit(func, *args, repeat=3):
+    """ Return (best time, result) of calling func(*args). """
+    best, result = None, None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def bench_symbol_repl(html):
+    """ Compare legacy and single-pass symbol replacement. """
+    replacer = html_utils.get_symbol_replacer()
+    t_old, (old_html, _) = timeit(legacy_html_symbol_repl, html)
+    t_new, (new_html, n, unrecognized) = timeit(replacer.subn, html)
+    assert new_html == old_html, "Single-pass output differs from legacy output!"
+    print("html_symbol_repl: legacy %.3f s, single-pass %.3f s, speedup %.1fx (%s replaced, %s unrecognized)"
+          % (t_old, t_new, t_old/t_new, n, sum(unrecognized.values())))
+
+
+def bench_make_urls_absolute(html):
+    """ Compare legacy and fused url absolutizer. """
+    baseurl = "http://www.nature.com/nature/journal/v459/n7243/full/nature07971.html"
+    t_old, _ = timeit(legacy_make_urls_absolute, html, baseurl)
+    t_new, _ = timeit(html_utils.make_urls_absolute, html, baseurl)
+    print("make_urls_absolute: legacy %.3f s, fused %.3f s, speedup %.1fx" % (t_old, t_new, t_old/t_new))
+
+
+def legacy_get_body_innerhtml(html):
+    """ The previous implementation: a single lazy/greedy DOTALL regex. """
+    match = re.search("<body ?.*?>(.*)</body>", html, flags=re.DOTALL+re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def bench_body_innerhtml(html, legacy_size=20000):
+    """
+    Compare regex and index-based body locators on a page without </body>.
+    The legacy regex is quadratic in this case, so it is only run on a small page.
+    """
+    pathological = html.replace("</body>", "")
+    small = pathological[:legacy_size]
+    t_old, _ = timeit(legacy_get_body_innerhtml, small, repeat=1)
+    t_new_small, _ = timeit(html_utils.find_body_span, small)
+    t_new, span = timeit(html_utils.find_body_span, pathological)
+    assert span[1] == len(pathological)
+    print("get_body_innerhtml (no </body>): legacy %.3f s and index-based %.5f s on %s chars; "
+          "index-based %.3f s on %.1f MB" % (t_old, t_new_small, legacy_size, t_new, len(pathological)/2**20))
+
+
+def legacy_find_tag_end(html, pos):
+    """ The previous tag end search: a regex with nested quantifiers. """
+    match = re.compile(r"""(?:[^>"']+|"[^"]*"|'[^']*')*>""").match(html, pos)
+    return match.end() if match else -1
+
+
+def bench_unterminated_body_tag(legacy_n=20, n=2**20):
+    """
+    Compare regex and scanning tag end search on an unterminated '<body aaa...' tag.
+    The legacy regex backtracks exponentially in this case, so it is only run on a tiny tag.
+    """
+    small = '<body ' + 'a' * legacy_n
+    t_old, _ = timeit(legacy_find_tag_end, small, 5, repeat=1)
+    t_new_small, _ = timeit(html_utils.find_body_span, small)
+    t_new, span = timeit(html_utils.find_body_span, '<body ' + 'a' * n)
+    assert span is None
+    print("find_body_span (unterminated <body): legacy regex %.3f s and scan %.6f s on %s chars; "
+          "scan %.3f s on %.1f MB" % (t_old, t_new_small, legacy_n, t_new, n/2**20))
+
+
+def main(size_mb=2):
+    """ Run benchmarks on a page of size_mb megabytes. """
+    html = make_page(int(size_mb*2**20))
+    print("Page size: %.1f MB" % (len(html)/2**20))
+    bench_symbol_repl(html)
+    bench_make_urls_absolute(html)
+    bench_body_innerhtml(html)
+    bench_unterminated_body_tag()
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 2)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Microbenchmark: OAuth signatures per second, oauthlib vs. oauth_signer.HmacSha1Signer,
+for typical Instapaper requests. Signing is measured both directly and as requests auth
+(preparing a request with a session, as InstapaperClient.post does, without sending it).
+
+Run with:
+    python tests/benchmark_oauth_signer.py [seconds_per_case]
+"""
+
+import os
+import sys
+import time
+import requests
+from urllib.parse import urlencode
+from oauthlib.oauth1 import Client
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter.oauth_signer import HmacSha1Signer
+from instaporter.xauth_session import XAuthSession
+
+
+APIURL = 'https://www.instapaper.com/api/1.1/'
+TOKENS = {'oauth_token': 'aabbccddeeff00112233', 'oauth_token_secret': '44556677889900aabbcc'}
+
+REQUESTS = {
+    'bookmarks/archive': {'bookmark_id': 123456789},
+    'bookmarks/list': {'limit': 500, 'folder_id': 'unread',
+                       'have': ','.join('%s:%032x' % (i, i) for i in range(100000, 100200))},
+    'bookmarks/add': {'url': 'http://www.nature.com/nature/journal/v459/n7243/full/nature07971.html',
+                      'title': 'Folding DNA into twisted and curved nanoscale shapes',
+                      'description': 'Dietz, Douglas & Shih, Science 2009'},
+}
+
+
+def rate(func, seconds):
+    """ Call func repeatedly for (about) <seconds> seconds; return calls per second. """
+    n, start = 0, time.perf_counter()
+    deadline = start + seconds
+    while True:
+        for _ in range(100):
+            func()
+        n += 100
+        now = time.perf_counter()
+        if now > deadline:
+            return n / (now - start)
+
+
+def oauthlib_signer(uri, body):
+    """ Sign with oauthlib, the way requests_oauthlib does for every request. """
+    def sign():
+        client = Client('consumer_key', 'consumer_secret', resource_owner_key=TOKENS['oauth_token'],
+                        resource_owner_secret=TOKENS['oauth_token_secret'])
+        client.sign(uri, 'POST', body=body, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    return sign
+
+
+def fast_signer(uri, body):
+    """ Sign with HmacSha1Signer (created once, as by the session). """
+    signer = HmacSha1Signer('consumer_key', 'consumer_secret', TOKENS['oauth_token'], TOKENS['oauth_token_secret'])
+    return lambda: signer.sign('POST', uri, body)
+
+
+def session_prepare(fast, uri, data):
+    """ Prepare (sign) request with an XAuthSession. """
+    session = XAuthSession('consumer_key', 'consumer_secret')
+    session.enable_fast_signer(fast)
+    session._populate_attributes(TOKENS)    # pylint: disable=W0212
+    return lambda: session.prepare_request(requests.Request('POST', uri, data=data))
+
+
+def main(seconds=1.0):
+    """ Run benchmark and print results. """
+    print("%-20s %8s %14s %14s %8s" % ("endpoint", "body", "oauthlib/s", "fast/s", "speedup"))
+    for endpoint, data in REQUESTS.items():
+        uri = APIURL + endpoint
+        body = urlencode(data)
+        slow = rate(oauthlib_signer(uri, body), seconds)
+        fast = rate(fast_signer(uri, body), seconds)
+        print("%-20s %8s %14.0f %14.0f %7.1fx" % (endpoint, len(body), slow, fast, fast/slow))
+    print("\nAs session auth (requests.Session.prepare_request):")
+    for endpoint, data in REQUESTS.items():
+        uri = APIURL + endpoint
+        slow = rate(session_prepare(False, uri, data), seconds)
+        fast = rate(session_prepare(True, uri, data), seconds)
+        print("%-20s %8s %14.0f %14.0f %7.1fx" % (endpoint, "", slow, fast, fast/slow))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 1.0)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Cold-start benchmark: For each subcommand, start bin/instap.py in a fresh interpreter
+(against the local Instapaper stub) and measure:
+* import time: total time spent importing modules, from python -X importtime.
+* time to first request: from process start until the stub receives the first API request.
+* total: wall time until the process exits.
+
+Also lists the slowest top-level imports, so regressions (e.g. a module that imports
+pyzotero or Tk at import time) are easy to spot.
+
+Run with:
+    python tests/benchmark_startup.py [repeats]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import subprocess
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instapaper_stub import InstapaperStub
+
+INSTAP = os.path.join(os.path.dirname(testsdir), "bin", "instap.py")
+
+
+def write_config(stub, tmpdir):
+    """ Write config and consumer keys files for running instap.py against stub. Returns config filepath. """
+    keys_filepath = os.path.join(tmpdir, "keys.yaml")
+    with open(keys_filepath, 'w') as fd:
+        fd.write("consumer_key: %s\nconsumer_secret: %s\n" % stub.consumer_keys)
+    config_filepath = os.path.join(tmpdir, "config.yaml")
+    lines = ["apiurl: %s" % stub.apiurl,
+             "instapaper_login_prompt: false",
+             "instapaper_consumer_keys_file: %s" % keys_filepath,
+             "doi_cache_filepath: ''",
+             "mirror_filepath: %s" % os.path.join(tmpdir, "mirror.sqlite"),
+             "text_cache_filepath: %s" % os.path.join(tmpdir, "texts.sqlite"),
+             "access_tokens:"]
+    lines += ["  %s: %s" % item for item in stub.access_tokens.items()]
+    with open(config_filepath, 'w') as fd:
+        fd.write("\n".join(lines) + "\n")
+    return config_filepath
+
+
+def parse_importtime(stderr):
+    """ Parse python -X importtime output. Returns (total import time in ms, list of (ms, top-level module)). """
+    total, toplevel = 0, []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        total += int(self_us)
+        # Nested imports are indented by two spaces per level:
+        if not name.startswith("  "):
+            toplevel.append((int(cumulative_us) / 1000, name.strip()))
+    return total / 1000, toplevel
+
+
+def run_command(stub, config_filepath, command, timeout=60):
+    """ Run instap.py <command> in a fresh interpreter. Returns dict with timings (in ms). """
+    first_request = []
+    handle = stub.server.handle
+    def timed_handle(endpoint, params):
+        """ Record time of first request. """
+        if not first_request:
+            first_request.append(time.perf_counter())
+        return handle(endpoint, params)
+    stub.server.handle = timed_handle
+    argv = [sys.executable, "-X", "importtime", INSTAP, "--configfile", config_filepath, "--loglevel", "WARNING"]
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(argv + command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True, timeout=timeout)
+    finally:
+        stub.server.handle = handle
+    end = time.perf_counter()
+    import_ms, toplevel = parse_importtime(proc.stderr)
+    errors = [line for line in proc.stderr.splitlines() if not line.startswith("import time:")]
+    return {'import': import_ms,
+            'first_request': (first_request[0] - start) * 1000 if first_request else None,
+            'total': (end - start) * 1000,
+            'returncode': proc.returncode,
+            'error': errors[-1] if proc.returncode and errors else None,
+            'toplevel': sorted(toplevel, reverse=True)}
+
+
+def main(repeats=3):
+    """ Run benchmark and print results. """
+    tmpdir = tempfile.mkdtemp(prefix="instaporter_startup_")
+    html_filepath = os.path.join(tmpdir, "article.html")
+    with open(html_filepath, 'w') as fd:
+        fd.write("<html><head><title>Startup benchmark</title></head><body><p>Hello</p></body></html>")
+    commands = [['test'], ['file', html_filepath], ['sync'], ['prefetch'],
+                ['drain'], ['--upload_queue_filepath', os.path.join(tmpdir, "q.sqlite"), 'file', html_filepath]]
+    with InstapaperStub() as stub:
+        config_filepath = write_config(stub, tmpdir)
+        print("%-32s %10s %16s %10s" % ("command", "import ms", "first request ms", "total ms"))
+        slowest = {}
+        for command in commands:
+            results = [run_command(stub, config_filepath, command) for _ in range(repeats)]
+            best = min(results, key=lambda r: r['total'])
+            name = " ".join(os.path.basename(arg) for arg in command)
+            if best['returncode']:
+                print("%-32s FAILED (exit code %s): %s" % (name, best['returncode'], best['error']))
+                continue
+            first_request = min((r['first_request'] for r in results if r['first_request'] is not None), default=None)
+            print("%-32s %10.1f %16s %10.1f" % (name, min(r['import'] for r in results),
+                                                 "%.1f" % first_request if first_request is not None else "-",
+                                                 best['total']))
+            for ms, module in best['toplevel']:
+                slowest[module] = max(ms, slowest.get(module, 0))
+    print("\nSlowest top-level imports (ms):")
+    for module, ms in sorted(slowest.items(), key=lambda item: -item[1])[:10]:
+        print("  %-30s %8.1f" % (module, ms))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
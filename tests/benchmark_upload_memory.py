@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142,W0221
+
+
+"""
+Memory benchmark: peak memory used by InstapaperClient.add_bookmark for a large article,
+measured with tracemalloc and given as the number of article-sized copies held at the same time.
+Cases:
+* oauthlib: requests urlencodes the body, requests_oauthlib/oauthlib signs it (fast_oauth_signer: false).
+* fast signer: requests urlencodes the body, HmacSha1Signer signs it (stream_uploads: false).
+* FormBody: values are escaped once, signed in chunks and sent as pieces (the default).
+
+Requests are not sent over the network: a transport adapter consumes the body the way urllib3 does
+(chunk by chunk) and replies with a canned bookmark.
+
+Run with:
+    python tests/benchmark_upload_memory.py [article_megabytes]
+"""
+
+import os
+import sys
+import time
+import json
+import tempfile
+import tracemalloc
+import requests
+from requests.adapters import BaseAdapter
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter.instapaper import InstapaperClient
+
+
+TOKENS = {'oauth_token': 'aabbccddeeff00112233', 'oauth_token_secret': '44556677889900aabbcc'}
+USER = {"type": "user", "user_id": 1, "username": "benchuser"}
+
+
+class SinkAdapter(BaseAdapter):
+    """ Transport adapter which reads the request body and replies with a bookmark. """
+
+    def send(self, request, **kwargs):
+        body = request.body
+        if isinstance(body, (str, bytes)) or body is None:
+            nbytes = len(body or '')
+        else:
+            nbytes = sum(len(chunk) for chunk in body)
+        response = requests.models.Response()
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        response._content = json.dumps([{"type": "bookmark", "bookmark_id": 1, "bytes": nbytes}]).encode('utf-8')
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self):
+        pass
+
+
+def make_client(fast_oauth_signer=True, stream_uploads=True):
+    """ Return InstapaperClient with (recently verified) access tokens, sending to SinkAdapter. """
+    tmpdir = tempfile.mkdtemp()
+    token_cache_filepath = os.path.join(tmpdir, "state.json")
+    config = {'access_tokens': TOKENS, 'instapaper_login_prompt': False,
+              'token_cache_filepath': token_cache_filepath, 'instapaper_username': 'benchuser',
+              'fast_oauth_signer': fast_oauth_signer, 'stream_uploads': stream_uploads}
+    from instaporter.token_cache import TokenCache
+    TokenCache(token_cache_filepath).put(TOKENS, [USER])
+    client = InstapaperClient(config, 'consumer_key', 'consumer_secret')
+    client.session.mount('https://', SinkAdapter())
+    return client
+
+
+def make_article(megabytes):
+    """ Return html article of about <megabytes> MB, with a realistic mix of text, markup and non-ascii. """
+    paragraph = ("<p>DNA origami &amp; self-assembly: the scaffold (7249 nt) is folded by ~200 staples, "
+                 "yielding 2D/3D shapes with 6 nm resolution — see Rothemund, Nature 440, 297. Æøå.</p>\n")
+    return "<html><body>%s</body></html>" % (paragraph * int(megabytes * 2**20 / len(paragraph)))
+
+
+def measure(client, content):
+    """ Return (peak bytes, seconds) for client.add_bookmark(content). """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    base = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    result = client.add_bookmark(url="http://example.com/article", title="Article", content=content)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] - base
+    tracemalloc.stop()
+    assert result[0]['bytes'] > len(content)
+    return peak, elapsed
+
+
+def main(megabytes=5.0):
+    """ Run benchmark and print results. """
+    content = make_article(megabytes)
+    size = len(content.encode('utf-8'))
+    print("Article: %.1f MB (utf-8)\n" % (size / 2**20))
+    print("%-14s %12s %8s %10s" % ("path", "peak MB", "copies", "time ms"))
+    for label, kwargs in [('oauthlib', {'fast_oauth_signer': False, 'stream_uploads': False}),
+                          ('fast signer', {'fast_oauth_signer': True, 'stream_uploads': False}),
+                          ('FormBody', {'fast_oauth_signer': True, 'stream_uploads': True})]:
+        client = make_client(**kwargs)
+        measure(client, content[:1000])  # warm up (imports, url caches)
+        peak, elapsed = measure(client, content)
+        print("%-14s %12.1f %8.1f %10.0f" % (label, peak / 2**20, peak / size, elapsed * 1000))
+        stats = client.upload_stats
+        if stats['encode_time']:
+            print("%14s upload stats: %s bytes, encode %.1f ms" % ('', stats['bytes'], stats['encode_time'] * 1000))
+
+
+if __name__ == '__main__':
+    main(float(sys.argv[1]) if len(sys.argv) > 1 else 5.0)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Local stub of the Instapaper REST API, for testing clients.
+
+Runs a threaded http server on localhost, which answers POST requests
+to /api/1.1/<endpoint> with canned json data. Every request's OAuth
+HMAC-SHA1 signature is verified with oauthlib, and all requests are
+recorded in server.requests as (endpoint, params) tuples.
+
+Usage:
+    with InstapaperStub() as stub:
+        client = InstapaperClient({'apiurl': stub.apiurl, ...}, *stub.consumer_keys)
+"""
+
+import json
+import threading
+from types import SimpleNamespace
+from urllib.parse import parse_qsl, urlencode, unquote
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from oauthlib.oauth1.rfc5849 import signature as oauth_signature
+from oauthlib.oauth1.rfc5849.utils import parse_authorization_header
+
+
+CONSUMER_KEY = 'stub-consumer-key'
+CONSUMER_SECRET = 'stub-consumer-secret'
+ACCESS_TOKENS = {'oauth_token': 'stub-token', 'oauth_token_secret': 'stub-token-secret'}
+
+USER = {"type": "user", "user_id": 54321, "username": "stubuser"}
+
+
+def make_bookmark(bookmark_id, **kwargs):
+    """ Return bookmark dict, as returned by the API. """
+    bookmark = {"type": "bookmark", "bookmark_id": bookmark_id, "url": "http://example.com/%s" % bookmark_id,
+                "title": "Bookmark %s" % bookmark_id, "description": "", "time": 1400000000 + bookmark_id,
+                "starred": "0", "private_source": "", "hash": "h%s" % bookmark_id,
+                "progress": 0.0, "progress_timestamp": 0}
+    bookmark.update(kwargs)
+    return bookmark
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """ Request handler for the Instapaper stub. """
+
+    def log_message(self, *args):    # pylint: disable=W0221
+        pass
+
+    def reply(self, status, data, content_type='application/json'):
+        """ Send response. """
+        body = data.encode('utf-8') if isinstance(data, str) else json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def verify_signature(self, body):
+        """ Verify the OAuth HMAC-SHA1 signature of the request. Returns True if valid. """
+        auth = self.headers.get('Authorization', '')
+        if not auth.startswith('OAuth '):
+            return False
+        oauth_params = dict(parse_authorization_header(auth))
+        token = oauth_params.get('oauth_token')
+        token_secret = self.server.token_secrets.get(token) if token else None
+        headers = {'Authorization': auth}
+        uri = 'http://%s:%s%s' % (self.server.server_address[0], self.server.server_address[1], self.path)
+        request = SimpleNamespace(
+            uri=uri, http_method='POST', signature=unquote(oauth_params.get('oauth_signature', '')),
+            params=oauth_signature.collect_parameters(body=body, headers=headers))
+        return oauth_signature.verify_hmac_sha1(request, CONSUMER_SECRET, token_secret)
+
+    def do_POST(self):    # pylint: disable=C0111
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        params = dict(parse_qsl(body, keep_blank_values=True))
+        endpoint = self.path.split('/api/1.1/', 1)[-1]
+        server = self.server
+        with server.lock:
+            server.requests.append((endpoint, params))
+        if not self.verify_signature(body):
+            return self.reply(401, [{"type": "error", "error_code": 401, "message": "Invalid signature"}])
+        status, data = server.handle(endpoint, params)
+        if isinstance(data, str):
+            return self.reply(status, data, content_type='text/html')
+        return self.reply(status, data)
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    """ Threaded http server with the stub's state. """
+    daemon_threads = True
+
+    def __init__(self, address, handler):
+        HTTPServer.__init__(self, address, handler)
+        self.lock = threading.Lock()
+        self.requests = []
+        self.token_secrets = {ACCESS_TOKENS['oauth_token']: ACCESS_TOKENS['oauth_token_secret']}
+        self.folders = [{"type": "folder", "folder_id": 100, "title": "Papers", "position": 1}]
+        self.bookmarks = {'unread': [make_bookmark(i) for i in range(1, 6)]}
+        self.highlights = {1: [{"type": "highlight", "highlight_id": 11, "bookmark_id": 1,
+                                "text": "highlighted", "position": 0, "time": 1400000000}]}
+        self.texts = {}
+        # Custom handlers, endpoint -> func(params) -> (status, data):
+        self.overrides = {}
+
+    def handle(self, endpoint, params):
+        """ Return (status, data) for request to endpoint. """
+        if endpoint in self.overrides:
+            return self.overrides[endpoint](params)
+        if endpoint == 'oauth/access_token':
+            if params.get('x_auth_username') == USER['username']:
+                return 200, urlencode(ACCESS_TOKENS)
+            return 401, [{"type": "error", "error_code": 401, "message": "Invalid credentials"}]
+        if endpoint == 'account/verify_credentials':
+            return 200, [USER]
+        if endpoint == 'bookmarks/list':
+            return 200, self.list_bookmarks(params)
+        if endpoint == 'bookmarks/add':
+            bookmark = make_bookmark(1000, title=params.get('title', ''), url=params.get('url', ''))
+            return 200, [bookmark]
+        if endpoint == 'bookmarks/get_text':
+            bookmark_id = int(params['bookmark_id'])
+            return 200, self.texts.get(bookmark_id, "<html><body>Text of %s</body></html>" % bookmark_id)
+        if endpoint == 'bookmarks/delete':
+            return 200, []
+        if endpoint in ('bookmarks/star', 'bookmarks/unstar', 'bookmarks/archive', 'bookmarks/unarchive', 'bookmarks/move'):
+            return 200, [make_bookmark(int(params['bookmark_id']))]
+        if endpoint == 'folders/list':
+            return 200, self.folders
+        if endpoint == 'folders/add':
+            return 200, [{"type": "folder", "folder_id": 101, "title": params['title'], "position": 2}]
+        if endpoint in ('folders/delete', 'folders/set_order'):
+            return 200, []
+        if endpoint.startswith('bookmarks/') and endpoint.endswith('/highlights'):
+            return 200, self.highlights.get(int(endpoint.split('/')[1]), [])
+        if endpoint.startswith('bookmarks/') and endpoint.endswith('/highlight'):
+            return 200, [{"type": "highlight", "highlight_id": 12, "bookmark_id": int(endpoint.split('/')[1]),
+                          "text": params['text'], "position": int(params['position']), "time": 1400000001}]
+        if endpoint.startswith('highlights/') and endpoint.endswith('/delete'):
+            return 200, []
+        return 404, [{"type": "error", "error_code": 404, "message": "Unknown endpoint"}]
+
+
+    def list_bookmarks(self, params):
+        """
+        Emulate bookmarks/list, including 'have' and 'highlights' parameters:
+        Bookmarks in 'have' with matching hash are not returned, and ids in 'have'
+        which are no longer in the folder are returned in delete_ids.
+        """
+        folder_id = params.get('folder_id', 'unread')
+        bookmarks = self.bookmarks.get(folder_id, [])
+        limit = int(params.get('limit', 25))
+        have = {}
+        for elem in params.get('have', '').split(','):
+            if elem:
+                fields = elem.split(':')
+                have[int(fields[0])] = fields[1] if len(fields) > 1 else None
+        current = {b['bookmark_id'] for b in bookmarks}
+        delete_ids = [bid for bid in have if bid not in current]
+        bookmarks = [b for b in bookmarks if b['bookmark_id'] not in have
+                     or (have[b['bookmark_id']] is not None and have[b['bookmark_id']] != b['hash'])][:limit]
+        have_hl = {int(hid) for hid in params.get('highlights', '').split('-') if hid}
+        highlights = [hl for b in bookmarks for hl in self.highlights.get(b['bookmark_id'], [])
+                      if hl['highlight_id'] not in have_hl]
+        return {"user": USER, "bookmarks": bookmarks, "highlights": highlights,
+                "delete_ids": ",".join(str(bid) for bid in delete_ids)}
+
+
+class InstapaperStub(object):
+    """ Context manager running StubServer in a background thread. """
+
+    consumer_keys = (CONSUMER_KEY, CONSUMER_SECRET)
+    access_tokens = ACCESS_TOKENS
+
+    def __init__(self):
+        self.server = StubServer(('127.0.0.1', 0), StubHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    @property
+    def apiurl(self):
+        """ Base api url of the stub server. """
+        return 'http://%s:%s/api/1.1/' % self.server.server_address
+
+    @property
+    def requests(self):
+        """ List of (endpoint, params) for all requests received. """
+        return self.server.requests
+
+    def config(self, **kwargs):
+        """ Return InstapaperClient config for using this stub with existing access tokens. """
+        config = {'apiurl': self.apiurl, 'access_tokens': dict(ACCESS_TOKENS),
+                  'instapaper_login_prompt': False}
+        config.update(kwargs)
+        return config
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
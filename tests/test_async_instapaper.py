@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Parity tests for AsyncInstapaperClient vs InstapaperClient, using a local stub server.
+"""
+
+import os
+import sys
+import asyncio
+import pytest
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+pytest.importorskip('aiohttp')
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.async_instapaper import AsyncInstapaperClient
+from instaporter.models import User, BookmarkList
+from instapaper_stub import InstapaperStub
+
+
+# (method name, args) pairs to compare:
+CALLS = [('verify_credentials', ()),
+         ('list_bookmarks', ()),
+         ('list_bookmarks', (), {'limit': 2, 'have': ['1:h1', '2:h2']}),
+         ('add_bookmark', (), {'title': "Test", 'content': "<p>&amp; ø café</p>" * 100,
+                               'is_private_from_source': "Scientific journal", 'resolve_final_url': 0}),
+         ('get_bookmark_text', (3,)),
+         ('star_bookmark', (3,)),
+         ('archive_bookmark', (3,)),
+         ('unarchive_bookmark', (3,)),
+         ('move_bookmark', (3, 100)),
+         ('delete_bookmark', (3,)),
+         ('list_folders', ()),
+         ('add_folder', ("New folder",)),
+         ('delete_folder', (101,)),
+         ('set_folder_order', ("100:1,101:2",)),
+         ('bookmark_highlights', (1,)),
+         ('bookmark_highlight', (1, "some text", 2)),
+         ('delete_highlight', (12,))]
+
+
+def _calls():
+    for call in CALLS:
+        name, args = call[:2]
+        kwargs = call[2] if len(call) > 2 else {}
+        yield name, args, kwargs
+
+
+def result_types(result):
+    """ Return the type of result, and of its items if it is a list. """
+    if isinstance(result, list):
+        return type(result), [type(item) for item in result]
+    return type(result)
+
+
+def test_async_client_parity():
+    """ Async client must return the same results and send the same requests as the sync client. """
+    with InstapaperStub() as stub:
+        client = InstapaperClient(stub.config(), *stub.consumer_keys)
+        n_init = len(stub.requests)
+        sync_results = [getattr(client, name)(*args, **kwargs) for name, args, kwargs in _calls()]
+        sync_requests = stub.requests[n_init:]
+
+        async def run_async():
+            async with AsyncInstapaperClient(*stub.consumer_keys, access_tokens=stub.access_tokens,
+                                             apiurl=stub.apiurl) as aclient:
+                return [await getattr(aclient, name)(*args, **kwargs) for name, args, kwargs in _calls()]
+        n_sync = len(stub.requests)
+        async_results = asyncio.run(run_async())
+        async_requests = stub.requests[n_sync:]
+
+    assert async_results == sync_results
+    # Same (typed) return types, not just equal values:
+    assert [result_types(result) for result in async_results] == [result_types(result) for result in sync_results]
+    assert isinstance(async_results[0][0], User) and isinstance(async_results[1], BookmarkList)
+    assert async_requests == sync_requests
+    # Stub replies 401 if signature verification fails:
+    assert async_results[0][0]['username'] == 'stubuser'
+
+
+def test_async_client_login_and_concurrency():
+    """ Login with xAuth and then multiplex many calls over the shared connection pool. """
+    with InstapaperStub() as stub:
+        async def run():
+            async with AsyncInstapaperClient(*stub.consumer_keys, apiurl=stub.apiurl, limit=10) as aclient:
+                tokens = await aclient.login('stubuser', '')
+                assert tokens == stub.access_tokens
+                return await asyncio.gather(*[aclient.archive_bookmark(i) for i in range(50)])
+        results = asyncio.run(run())
+    assert [res[0]['bookmark_id'] for res in results] == list(range(50))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for bulk bookmark operations.
+"""
+
+import os
+import sys
+import threading
+import tempfile
+import pytest
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.bulk import BulkReport, bulk_apply
+from instapaper_stub import InstapaperStub, make_bookmark
+
+
+def make_client(stub):
+    """ Return client for stub. """
+    config = stub.config(token_cache_filepath=os.path.join(tempfile.mkdtemp(), "tokens.json"))
+    return InstapaperClient(config, *stub.consumer_keys)
+
+
+def test_bulk_apply_retries_only_failed_bookmarks():
+    with InstapaperStub() as stub:
+        client = make_client(stub)
+        attempts = {}
+        lock = threading.Lock()
+
+        def flaky_archive(params):
+            """ Fail the first request for odd bookmark ids, and always for bookmark 13. """
+            bookmark_id = int(params['bookmark_id'])
+            with lock:
+                attempts[bookmark_id] = attempts.get(bookmark_id, 0) + 1
+                n = attempts[bookmark_id]
+            if bookmark_id == 13 or (bookmark_id % 2 and n == 1):
+                return 400, [{"type": "error", "error_code": 1241, "message": "Invalid or missing bookmark_id"}]
+            return 200, [make_bookmark(bookmark_id)]
+
+        stub.server.overrides['bookmarks/archive'] = flaky_archive
+        report = client.bulk_apply('archive', range(1, 21), workers=4, retries=2)
+        assert sorted(report.succeeded) == [i for i in range(1, 21) if i != 13]
+        assert list(report.failed) == [13] and report.failed[13].startswith('1241')
+        assert report.rounds == 3
+        # Succeeded bookmarks are never repeated; odd ids take two requests, 13 takes three:
+        assert attempts == {i: (3 if i == 13 else 2 if i % 2 else 1) for i in range(1, 21)}
+        try:
+            bulk_apply(client, 'move', [1])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("move without folder_id should raise ValueError.")
+
+
+def test_bulk_apply_resumes_from_saved_report_and_accepts_bookmarks():
+    report_filepath = os.path.join(tempfile.mkdtemp(), "bulk_report.json")
+    with InstapaperStub() as stub:
+        client = make_client(stub)
+        report = BulkReport('move', 100)
+        report.succeeded = [1, 2]
+        report.failed = {3: "1241: Invalid or missing bookmark_id"}
+        report.save(report_filepath)
+        del stub.requests[:]
+        calls = []
+        report = client.bulk_apply('move', client.iter_bookmarks('unread', batch=2), folder_id=100,
+                                   report=BulkReport.load(report_filepath),
+                                   progress=lambda result, n_done, n_failed: calls.append((n_done, n_failed)))
+        moved = sorted(int(p['bookmark_id']) for e, p in stub.requests if e == 'bookmarks/move')
+        assert moved == [3, 4, 5]
+        assert {p['folder_id'] for e, p in stub.requests if e == 'bookmarks/move'} == {'100'}
+        assert sorted(report.succeeded) == [1, 2, 3, 4, 5] and not report.failed
+        assert calls[-1] == (3, 0) and len(calls) == 3
+        report.save(report_filepath)
+        assert BulkReport.load(report_filepath).to_dict() == report.to_dict()
+        # A report for a move to another folder cannot be resumed:
+        with pytest.raises(ValueError):
+            client.bulk_apply('move', [1, 2], folder_id=101, report=BulkReport.load(report_filepath))
+        with pytest.raises(ValueError):
+            client.bulk_apply('archive', [1, 2], report=BulkReport.load(report_filepath))
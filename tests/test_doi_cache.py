@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the DOI metadata cache.
+"""
+
+import os
+import sys
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter import html_utils, doi_cache
+from instaporter.doi_cache import DoiCache
+
+
+class FakeResponse(object):
+    """ Response from dx.doi.org """
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.data = data
+        self.text = str(data)
+
+    def json(self):
+        return self.data
+
+
+def test_get_doi_data_uses_cache(monkeypatch):
+    requested = []
+    responses = {"10.1038/nature07971": FakeResponse(200, {'title': "DNA box"}),
+                 "10.1038/unknown": FakeResponse(404),
+                 "10.1038/down": FakeResponse(503)}
+    def get_doi_response(doi, session=None):
+        requested.append(doi)
+        return responses[doi.lower()]
+    monkeypatch.setattr(html_utils, 'get_doi_response', get_doi_response)
+    cache = DoiCache(':memory:')
+    for _ in range(2):
+        assert html_utils.get_doi_data("doi:10.1038/NATURE07971", cache=cache) == {'title': "DNA box"}
+        assert html_utils.get_doi_data("10.1038/unknown", cache=cache) is None
+        assert html_utils.get_doi_data("10.1038/down", cache=cache) is None
+    # Server errors are not cached, everything else is only requested once:
+    assert requested == ["10.1038/NATURE07971", "10.1038/unknown", "10.1038/down", "10.1038/down"]
+    assert cache.stats() == {'hits': 1, 'negative_hits': 1, 'misses': 4}
+    # The default cache is used unless disabled:
+    monkeypatch.setattr(doi_cache, '_default_cache', [cache])
+    html_utils.get_doi_data("10.1038/nature07971")
+    assert len(requested) == 4
+    html_utils.get_doi_data("10.1038/nature07971", cache=None)
+    assert len(requested) == 5
+
+
+def test_doi_cache_ttl(monkeypatch):
+    cache = DoiCache(':memory:', ttl=100, negative_ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(doi_cache.time, 'time', lambda: now[0])
+    cache.put("10.1/a", {'title': "A"})
+    cache.put("10.1/b", None)
+    now[0] += 50
+    assert cache.get("10.1/A") == (True, {'title': "A"})
+    assert cache.get("10.1/b") == (False, None)
+    assert cache.purge() == 1
+    now[0] += 100
+    assert cache.get("10.1/a") == (False, None)
+    assert len(cache) == 1
+
+
+def test_configure_doi_cache_zero_ttl():
+    default = doi_cache._default_cache[:]
+    cache = doi_cache.configure_doi_cache({'doi_cache_filepath': ':memory:', 'doi_cache_negative_ttl': 0})
+    try:
+        assert cache.ttl == doi_cache.DEFAULT_TTL and cache.negative_ttl == 0
+        cache.put("10.1/b", None)
+        assert cache.get("10.1/b") == (False, None)
+    finally:
+        doi_cache._default_cache[:] = default
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for concurrent DOI resolution.
+"""
+
+import os
+import sys
+import time
+import threading
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter import html_utils
+from instaporter.doi_cache import DoiCache
+from instaporter.doi_resolver import resolve_dois, SingleFlight
+
+
+class FakeResponse(object):
+    """ Response from dx.doi.org """
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+def test_singleflight():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    def slow():
+        started.set()
+        release.wait(5)
+        return 42
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flights.do('k', slow)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do('k', slow))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flights.coalesced < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join()
+    assert results == [42]*4
+    assert flights.calls == 1 and flights.coalesced == 3
+
+
+def test_resolve_dois(monkeypatch):
+    lock = threading.Lock()
+    active = [0, 0]    # current, max
+    requested = []
+    def get_doi_response(doi, session=None):
+        with lock:
+            requested.append(doi)
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return FakeResponse(404) if 'missing' in doi else FakeResponse(200, {'title': doi})
+    monkeypatch.setattr(html_utils, 'get_doi_response', get_doi_response)
+    dois = ["10.1000/%s" % i for i in range(12)] + ["doi:10.1000/1", "10.1000/missing", "not a doi"]
+    t0 = time.time()
+    results = dict(resolve_dois(dois, workers=8, per_host=4, cache=DoiCache(':memory:')))
+    elapsed = time.time() - t0
+    assert len(requested) == 13    # Duplicate and invalid DOIs are not requested.
+    assert active[1] <= 4
+    assert elapsed < 13*0.05
+    assert results["10.1000/3"] == {'title': "10.1000/3"}
+    assert results["10.1000/missing"] is None and results["not a doi"] is None
+
+
+def test_resolve_dois_streams_and_shares_host_limit(monkeypatch):
+    lock = threading.Lock()
+    active = [0, 0]    # current, max
+    def get_doi_response(doi, session=None):
+        with lock:
+            active[0] += 1
+            active[1] = max(active)
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return FakeResponse(200, {'title': doi})
+    monkeypatch.setattr(html_utils, 'get_doi_response', get_doi_response)
+    cache = DoiCache(':memory:')
+    cache.put("10.1000/cached", {'title': 'cached'})
+    consumed = []
+    def dois(n):
+        for i in range(n):
+            consumed.append(i)
+            yield "10.1000/%s" % i
+    # Results are yielded before the whole input has been read (at most 2*workers queued):
+    first_doi, _ = next(resolve_dois(dois(100), workers=2, per_host=2, cache=cache))
+    assert first_doi.startswith("10.1000/") and len(consumed) <= 2*2 + 1
+    # Concurrent calls share the per-host limit, and cache hits do not wait for a slot:
+    results = []
+    threads = [threading.Thread(target=lambda: results.extend(resolve_dois(dois(6), workers=4, per_host=2, cache=None)))
+               for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    assert dict(resolve_dois(["10.1000/cached"], cache=cache)) == {"10.1000/cached": {'title': 'cached'}}
+    for thread in threads:
+        thread.join()
+    assert active[1] <= 2
+    assert len(results) == 18
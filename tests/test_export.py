@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the resumable account export.
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.export import AccountExport, read_export, read_text
+from instapaper_stub import InstapaperStub, make_bookmark
+
+
+def make_client(stub):
+    """ Return client for stub. """
+    config = stub.config(token_cache_filepath=os.path.join(tempfile.mkdtemp(), "tokens.json"))
+    return InstapaperClient(config, *stub.consumer_keys)
+
+
+def downloads(stub):
+    """ Return sorted list of (endpoint, bookmark_id) for the text and highlights requests made to stub. """
+    return sorted((endpoint.split('/')[-1], int(params.get('bookmark_id') or endpoint.split('/')[1]))
+                  for endpoint, params in stub.requests
+                  if endpoint == 'bookmarks/get_text' or endpoint.endswith('/highlights'))
+
+
+def test_export_writes_jsonl_texts_and_highlights():
+    directory = tempfile.mkdtemp()
+    with InstapaperStub() as stub:
+        stub.server.bookmarks['100'] = [make_bookmark(i) for i in range(101, 104)]
+        stub.server.texts[2] = "<html><body>Æblegrød – \U0001F34E</body></html>"
+        stub.server.overrides['bookmarks/get_text'] = lambda params: (
+            (400, [{"type": "error", "error_code": 1550, "message": "Error generating text version"}])
+            if params['bookmark_id'] == '103' else
+            (200, stub.server.texts.get(int(params['bookmark_id']), "<html>%s</html>" % params['bookmark_id'])))
+        client = make_client(stub)
+        client.max_retries = 0
+        stats = AccountExport(client, directory, workers=3, batch=2).run()
+        assert stats['exported'] == 8 and stats['failed'] == 0 and stats['resumed'] == 0
+        records = list(read_export(directory))
+        assert sorted((str(r['folder_id']), r['bookmark_id']) for r in records) == \
+            [('100', 101), ('100', 102), ('100', 103)] + [('unread', i) for i in range(1, 6)]
+        by_id = {r['bookmark_id']: r for r in records}
+        assert by_id[1]['highlights'][0]['text'] == "highlighted" and by_id[2]['highlights'] == []
+        assert read_text(directory, by_id[2]) == stub.server.texts[2]
+        assert by_id[2]['title'] == "Bookmark 2" and by_id[2]['text_file'] == 'texts/2.html.gz'
+        assert by_id[103]['text_file'] is None and by_id[103]['text_error'].startswith('1550')
+        with open(os.path.join(directory, 'checkpoint.json')) as fd:
+            checkpoint = json.load(fd)
+        assert checkpoint['complete'] and checkpoint['exported'] == 8
+        assert checkpoint['offset'] == os.path.getsize(os.path.join(directory, 'bookmarks.jsonl'))
+        with open(os.path.join(directory, 'folders.json')) as fd:
+            assert json.load(fd)[0]['folder_id'] == 100
+        # Running the export again only lists the folders (with all bookmarks as 'have'):
+        del stub.requests[:]
+        stats = AccountExport(client, directory, workers=3, batch=2).run()
+        assert stats['exported'] == 0 and stats['resumed'] == 8 and downloads(stub) == []
+        assert [p['have'] for e, p in stub.requests if e == 'bookmarks/list' and p['folder_id'] == '100'] == \
+            ['101,102,103']
+        assert len(list(read_export(directory))) == 8
+
+
+def test_interrupted_export_resumes_without_downloading_again():
+    directory = tempfile.mkdtemp()
+    with InstapaperStub() as stub:
+        stub.server.bookmarks['unread'] = [make_bookmark(i) for i in range(1, 31)]
+        stub.server.overrides['bookmarks/7/highlights'] = lambda params: (
+            400, [{"type": "error", "error_code": 1241, "message": "Invalid or missing bookmark_id"}])
+        client = make_client(stub)
+        exported = []
+
+        def interrupt(bookmark_id, error, stats):
+            """ Stop the export (like Ctrl-C) after 10 bookmarks. """
+            if error is None:
+                exported.append(bookmark_id)
+            if len(exported) == 10:
+                raise KeyboardInterrupt()
+
+        try:
+            AccountExport(client, directory, workers=2, batch=500, checkpoint_every=3).run(['unread'], progress=interrupt)
+        except KeyboardInterrupt:
+            pass
+        else:
+            raise AssertionError("Export was not interrupted.")
+        first = [bid for _, bid in downloads(stub) if _ == 'get_text']
+        records = list(read_export(directory))
+        # The bookmarks in flight when interrupted were also written:
+        assert len(records) >= 10 and set(exported) <= {r['bookmark_id'] for r in records}
+        # Simulate an export that was killed while writing a line:
+        with open(os.path.join(directory, 'bookmarks.jsonl'), 'ab') as fd:
+            fd.write(b'{"bookmark_id": 99, "fol')
+        stub.server.overrides.clear()
+        del stub.requests[:]
+        stats = AccountExport(client, directory, workers=2).run(['unread'])
+        assert stats['resumed'] == len(records) and stats['exported'] == 30 - len(records) and stats['failed'] == 0
+        records = list(read_export(directory))
+        assert sorted(r['bookmark_id'] for r in records) == list(range(1, 31))
+        # Texts were only downloaded once (bookmark 7 failed, but its text file is reused):
+        second = [bid for _, bid in downloads(stub) if _ == 'get_text']
+        assert not set(first) & set(second) and sorted(first + second) == list(range(1, 31))
+        assert 7 in {bid for _, bid in downloads(stub)}
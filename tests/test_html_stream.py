@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for streaming html processing.
+"""
+
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter.html_stream import process_stream
+from instaporter.instaporter import rewrite_content
+
+
+URL = "http://www.nature.com/nature/journal/v459/n7243/full/nature07971.html"
+HEAD = """<html><head><title>Self-assembly of a nanoscale DNA box</title>
+<meta name="citation_doi" content="doi:10.1038/nature07971"/></head>
+<body
+ class="article">
+"""
+PARAGRAPH = """<p>Then 200&nbsp;<img src="/__chars/mu/black/med/base/glyph.gif" style="border:0;" alt="mu" />l
+of <a href="/nature/journal/v459/n7243/full/nature07971.html#ref12">buffer</a> with <img
+src="/__chars/math/special/times/black/med/base/glyph.gif" alt="times" /> and <img src='fig1.jpg'/>.</p>
+"""
+TAIL = "</body></html>"
+
+
+def chunked(text, size):
+    """ Split text into chunks of size. """
+    return (text[i:i+size] for i in range(0, len(text), size))
+
+
+def test_stream_matches_rewrite_content():
+    """ Streaming output must be identical to the in-memory rewrite, for any chunk size. """
+    html = HEAD + PARAGRAPH * 50 + TAIL
+    expected = rewrite_content(html, URL)
+    for size in (7, 100, 4096):
+        out = io.StringIO()
+        processor = process_stream(chunked(html, size), URL, out)
+        assert out.getvalue() == expected
+        assert processor.head == HEAD[:HEAD.index("<body")]
+        assert processor.replaced == 100
+    # Bytes chunks, split in the middle of a multi-byte character:
+    html = HEAD + "<p>café ø</p>" * 10 + TAIL
+    out = io.StringIO()
+    process_stream(chunked(html.encode('utf-8'), 5), URL, out)
+    assert out.getvalue() == rewrite_content(html, URL)
+    # A long body tag split across chunks (must not backtrack on the partial tag):
+    body_tag = '<body leftmargin=0 topmargin=0 marginwidth=0 marginheight=0 bgcolor=#ffffff>'
+    html = HEAD[:HEAD.index("<body")] + body_tag + PARAGRAPH * 5 + TAIL
+    for size in (3, 40, 70):
+        out = io.StringIO()
+        t0 = time.perf_counter()
+        processor = process_stream(chunked(html, size), URL, out)
+        assert time.perf_counter() - t0 < 1
+        assert out.getvalue() == rewrite_content(html, URL)
+        assert processor.head == HEAD[:HEAD.index("<body")]
+
+
+def test_stream_encoding_and_last_body_close_tag():
+    """ Non-utf-8 bytes are decoded like r.text would, and the body ends at the last </body>. """
+    html = HEAD + "<p>Ångström café</p>" * 10 + TAIL
+    expected = rewrite_content(html, URL)
+    for size in (5, 4096):
+        # Response encoding:
+        out = io.StringIO()
+        process_stream(chunked(html.encode('latin-1'), size), URL, out, encoding='ISO-8859-1')
+        assert out.getvalue() == expected
+    # No response encoding, but declared in the document:
+    declared = html.replace("<head>", '<head><meta charset="iso-8859-1">')
+    out = io.StringIO()
+    processor = process_stream(chunked(declared.encode('latin-1'), 4096), URL, out)
+    assert processor.encoding == 'iso-8859-1' and out.getvalue() == expected
+    # A </body> in the body (e.g. in a script string) does not end the body:
+    html = HEAD + PARAGRAPH + '<script>w("</body>")</script>' + PARAGRAPH + "</BODY>\n<p>after</p></body></html>"
+    expected = rewrite_content(html, URL)
+    assert "after" in expected
+    for size in (3, 17, 4096):
+        out = io.StringIO()
+        process_stream(chunked(html, size), URL, out)
+        assert out.getvalue() == expected
+
+
+class CountingSink(object):
+    """ File-like object that only counts what is written. """
+    def __init__(self):
+        self.n = 0
+    def write(self, text):
+        self.n += len(text)
+
+
+def generate_document(n_paragraphs, chunk_size=2**16):
+    """ Generate a document in chunks, without ever holding all of it in memory. """
+    yield HEAD
+    block = PARAGRAPH * (chunk_size // len(PARAGRAPH))
+    n_blocks = n_paragraphs * len(PARAGRAPH) // len(block)
+    for _ in range(n_blocks):
+        yield block
+    yield TAIL
+
+
+def peak_memory(n_paragraphs):
+    """ Return peak traced memory while stream-processing a document. """
+    tracemalloc.start()
+    try:
+        sink = CountingSink()
+        process_stream(generate_document(n_paragraphs), URL, sink)
+        return tracemalloc.get_traced_memory()[1], sink.n
+    finally:
+        tracemalloc.stop()
+
+
+def test_stream_memory_is_flat():
+    """ Peak memory should not grow with the size of the document. """
+    peak_small, n_small = peak_memory(2000)      # About 0.6 MB
+    peak_large, n_large = peak_memory(32000)     # About 10 MB
+    assert n_large > 10 * n_small
+    assert peak_large < 1.5 * peak_small
+    assert peak_large < 2**20
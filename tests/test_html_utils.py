@@ -24,11 +24,13 @@ Test module for html utility module.
 
 import os
 import sys
+import time
 
 testsdir = os.path.dirname(os.path.realpath(__file__))
 sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
 
-from instaporter.html_utils import html_symbol_repl, get_doc_title #make_urls_absolute
+from instaporter.html_utils import html_symbol_repl, get_doc_title, SymbolReplacer, load_symbol_table, \
+    make_urls_absolute, scan_metadata, find_keywords, find_body_span
 
 
 def test_html_symbol_repl():
@@ -74,6 +76,93 @@ style="border:0; vertical-align:baseline;" alt="mu" />l.
     print("New HTML:", new, sep='\n')
 
 
+def test_symbol_replacer():
+    """ Recognized glyphs are replaced in one pass, unrecognized glyphs are reported. """
+    replacer = SymbolReplacer(load_symbol_table())
+    html = """5&nbsp;<img src="/__chars/mu/black/med/base/glyph.gif" alt="mu" />l,
+4<i>k</i>&nbsp;<img
+src="/__chars/math/special/times/black/med/base/glyph.gif" style="border:0;" alt="times" />,
+<img class="x" src="/__chars/micro/black/med/base/glyph.gif"/> <img src="/__chars/less/special/le/black/med/base/glyph.gif" />
+<img src="/__chars/math/special/notdefined/black/med/base/glyph.gif" alt="?" />
+<img src="/images/figure1.jpg" />"""
+    new, n, unrecognized = replacer.subn(html)
+    assert n == 4
+    assert new.startswith("5&nbsp;&#956;l,\n4<i>k</i>&nbsp;&#215;,\n&#956; &#8804;\n")
+    assert unrecognized == {'math/special/notdefined/black/med/base/glyph.gif': 1}
+    assert '<img src="/images/figure1.jpg" />' in new
+
+
+def test_make_urls_absolute():
+    """ All url attributes, quote styles, srcset and CSS url() are rewritten; <base href> is honoured. """
+    html = """<a href="x.html">x</a> <img SRC='/i.png' srcset="a.jpg 1x, /b.jpg 2x">
+<div style="background: url('bg.png')"></div> <a href = "#ref1">1</a> <a href="mailto:a@b.c">m</a>"""
+    new = make_urls_absolute(html, "http://example.com/dir/page.html")
+    assert new == """<a href="http://example.com/dir/x.html">x</a> <img SRC='http://example.com/i.png' \
+srcset="http://example.com/dir/a.jpg 1x, http://example.com/b.jpg 2x">
+<div style="background: url('http://example.com/dir/bg.png')"></div> \
+<a href = "http://example.com/dir/page.html#ref1">1</a> <a href="mailto:a@b.c">m</a>"""
+    new = make_urls_absolute('<base href="/other/"><a href="y">', "http://example.com/dir/page.html")
+    assert new.endswith('<a href="http://example.com/other/y">')
+
+
+def test_make_urls_absolute_ignores_text_and_scripts():
+    """ Prose and script content that look like url() or attributes are not rewritten. """
+    base = "http://ex.com/a/"
+    html = """<p>Enter the URL(s) of each curl(x) page, e.g. src = "here"</p>
+<script>var data = "abc"; el.innerHTML = '<img src="x.png">';</script>
+<style>p { background: URL( "c.png" ) }</style><object data="d.swf"></object>"""
+    new = make_urls_absolute(html, base)
+    assert new == """<p>Enter the URL(s) of each curl(x) page, e.g. src = "here"</p>
+<script>var data = "abc"; el.innerHTML = '<img src="http://ex.com/a/x.png">';</script>
+<style>p { background: URL( "http://ex.com/a/c.png" ) }</style><object data="http://ex.com/a/d.swf"></object>"""
+
+
+def test_scan_metadata():
+    """ Metadata is taken from head meta tags, with fallback to the body for missing fields. """
+    html = """<html><head>
+<title>Self-assembly of a nanoscale DNA box with a
+controllable lid : Article : Nature</title>
+<meta content="Self-assembly of a nanoscale DNA box with a controllable lid" name="citation_title"/>
+<meta name='citation_doi' content='doi:10.1038/nature07971'>
+<meta name="keywords" lang="en" content="DNA origami; self-assembly, nanotechnology" />
+<meta name="description" content="The unique structural motifs &amp; self-recognition properties of DNA..." />
+<link rel="canonical" href="http://www.nature.com/nature/journal/v459/n7243/full/nature07971.html"/>
+</head><body><p>doi:10.1038/other.123</p></body></html>"""
+    record = scan_metadata(html)
+    assert record['title'] == "Self-assembly of a nanoscale DNA box with a controllable lid"
+    assert record['doi'] == "10.1038/nature07971"
+    assert record['keywords'] == ["DNA origami", "self-assembly", "nanotechnology"]
+    assert record['abstract'].startswith("The unique structural motifs & self")
+    assert record['links'][0]['rel'] == 'canonical'
+    # Missing head fields fall back to the body:
+    record = scan_metadata("<html><head><title>T</title></head><body><p>doi: 10.1021/nl503000v</p></body></html>")
+    assert record['title'] == "T"
+    assert record['doi'] == "10.1021/nl503000v"
+    # find_keywords handles any attribute order and extra attributes:
+    assert find_keywords('<meta lang="en" content="a, b" name="keywords">') == ["a", "b"]
+
+
+def test_find_body_span():
+    """ Body start tag may span lines and have '>' in attributes; </body> may be missing. """
+    html = """<html><head></head><body\n class="main"\n data-x="a>b">inner <b>text</b></BODY></html>"""
+    start, end = find_body_span(html)
+    assert html[start:end] == "inner <b>text</b>"
+    html = "<html><body onload='f(1>0)'><p>unclosed"
+    start, end = find_body_span(html)
+    assert html[start:end] == "<p>unclosed"
+    assert find_body_span("<p>no body</p>") is None
+    # The body is matched up to the last </body>, like the old greedy regex:
+    html = "<body>a</body>b</body >"
+    start, end = find_body_span(html)
+    assert html[start:end] == "a</body>b"
+    # An unterminated body tag is found in linear time (no catastrophic backtracking):
+    t0 = time.perf_counter()
+    assert find_body_span('<body ' + 'a' * 100000) is None
+    assert find_body_span('<body class="' + 'a' * 100000) is None
+    assert find_body_span("<body x='1>2' " + 'a "b" ' * 20000) is None
+    assert time.perf_counter() - t0 < 1
+
+
 def test_get_doc_title():
     html = """
 <link rel="search" type="application/sru+xml" href="http://www.nature.com.ez.statsbiblioteket.dk:2048/opensearch/request" title="nature.com" />
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the shared http session registry.
+"""
+
+import os
+import sys
+import time
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import pytest
+import requests
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter.http_session import SessionRegistry
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """ Answers GET requests with a small page, keeping the connection open. """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/slow':
+            time.sleep(1)
+        body = b"<html><body>ok</body></html>"
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):    # pylint: disable=W0221
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    """ Handles each connection in a thread, so a connection left open by a client does not block shutdown. """
+    daemon_threads = True
+    block_on_close = False
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingServer(('127.0.0.1', 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:%s" % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_are_reused(server_url):
+    registry = SessionRegistry()
+    for i in range(5):
+        assert registry.get().get(server_url + "/page%s" % i).ok
+    assert registry.get() is registry.get('default')
+    stats = registry.stats()
+    assert stats['requests'] == 5
+    assert stats['opened'] == 1 and stats['reused'] == 4
+    registry.close()
+
+
+def test_default_timeout(server_url):
+    registry = SessionRegistry(timeout=0.2)
+    with pytest.raises(requests.exceptions.Timeout):
+        registry.get().get(server_url + "/slow")
+    # Timeout given explicitly takes precedence:
+    assert registry.get().get(server_url + "/slow", timeout=5).ok
+    registry.close()
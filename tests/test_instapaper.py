@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the InstapaperClient.
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.models import User
+from instapaper_stub import InstapaperStub, make_bookmark
+
+
+def endpoints(stub):
+    """ Return list of endpoints requested from stub. """
+    return [endpoint for endpoint, _ in stub.requests]
+
+
+def test_token_verification_is_cached():
+    token_cache_filepath = os.path.join(tempfile.mkdtemp(), "tokens.json")
+    with InstapaperStub() as stub:
+        client = InstapaperClient(stub.config(token_cache_filepath=token_cache_filepath), *stub.consumer_keys)
+        assert client.status and client.verified
+        assert endpoints(stub) == ['account/verify_credentials']
+        # Within the window, the tokens are not verified again:
+        client = InstapaperClient(stub.config(token_cache_filepath=token_cache_filepath), *stub.consumer_keys)
+        assert client.status and not client.verified
+        assert client.username == 'stubuser'
+        assert endpoints(stub) == ['account/verify_credentials']
+        # Window 0 means always verify:
+        InstapaperClient(stub.config(token_cache_filepath=token_cache_filepath, token_verify_window=0),
+                         *stub.consumer_keys)
+        assert endpoints(stub) == ['account/verify_credentials']*2
+        # The default given to the client is used, but not added to the (saved) config:
+        config = stub.config()
+        client = InstapaperClient(config, *stub.consumer_keys, token_cache_filepath=token_cache_filepath)
+        assert client.token_cache is not None and not client.verified
+        assert 'token_cache_filepath' not in config
+        config = stub.config(token_cache_filepath='')
+        assert InstapaperClient(config, *stub.consumer_keys, token_cache_filepath=token_cache_filepath).verified
+        # verify_credentials and delete_bookmark return typed objects, like the other methods:
+        userinfo = client.verify_credentials()
+        assert isinstance(userinfo[0], User) and userinfo[0].username == 'stubuser'
+        assert client.delete_bookmark(1) == [] and client.status
+
+
+def test_rejected_request_reverifies_once_and_retries():
+    token_cache_filepath = os.path.join(tempfile.mkdtemp(), "tokens.json")
+    with InstapaperStub() as stub:
+        InstapaperClient(stub.config(token_cache_filepath=token_cache_filepath), *stub.consumer_keys)
+        client = InstapaperClient(stub.config(token_cache_filepath=token_cache_filepath), *stub.consumer_keys)
+        del stub.requests[:]
+        def reject_once(params):
+            """ Fail the first request with 401, as if the tokens were revoked. """
+            del stub.server.overrides['bookmarks/list']
+            return 401, [{"type": "error", "error_code": 401, "message": "Invalid token"}]
+        stub.server.overrides['bookmarks/list'] = reject_once
+        bookmarks = client.list_bookmarks()
+        assert len(bookmarks['bookmarks']) == 5
+        assert endpoints(stub) == ['bookmarks/list', 'account/verify_credentials', 'bookmarks/list']
+        # Once verified, a rejected request is not retried:
+        stub.server.overrides['bookmarks/list'] = lambda params: (401, [{"type": "error", "error_code": 401}])
+        client.list_bookmarks()
+        assert endpoints(stub)[3:] == ['bookmarks/list']
+
+
+def test_add_bookmark_streams_encoded_content():
+    token_cache_filepath = os.path.join(tempfile.mkdtemp(), "tokens.json")
+    content = "<html><body>%s</body></html>" % ("Æble & grød = 100%% + ½ ~ π? " * 20000)
+    with InstapaperStub() as stub:
+        client = InstapaperClient(stub.config(token_cache_filepath=token_cache_filepath), *stub.consumer_keys)
+        bookmark = client.add_bookmark(url="http://example.com/a b", title="Æble", content=content)
+        # The stub verifies the signature (with oauthlib) and decodes the body:
+        assert client.status and bookmark[0]['bookmark_id'] == 1000
+        endpoint, params = stub.requests[-1]
+        assert endpoint == 'bookmarks/add'
+        assert params['content'] == content and params['url'] == "http://example.com/a b"
+        assert params['resolve_final_url'] == '1'
+        assert client.upload_stats['uploads'] == 1
+        assert client.upload_stats['bytes'] > len(content.encode('utf-8'))
+        # Without the fast signer, requests encodes the body (and oauthlib signs it):
+        client.session.enable_fast_signer(False)
+        client.add_bookmark(url="http://example.com/b", content=content)
+        assert stub.requests[-1][1]['content'] == content
+        assert client.upload_stats['uploads'] == 2
+
+
+def test_iter_bookmarks_pages_with_have_and_reads_ahead():
+    token_cache_filepath = os.path.join(tempfile.mkdtemp(), "tokens.json")
+    with InstapaperStub() as stub:
+        stub.server.bookmarks['100'] = [make_bookmark(i) for i in range(101, 104)]
+        client = InstapaperClient(stub.config(token_cache_filepath=token_cache_filepath), *stub.consumer_keys)
+        del stub.requests[:]
+        bookmarks = client.iter_bookmarks(batch=2, with_folder=True)
+        assert next(bookmarks) == ('unread', client.list_bookmarks(limit=1)['bookmarks'][0])
+        # The next page was requested while the first one was consumed:
+        for _ in range(100):
+            if len([p for e, p in stub.requests if e == 'bookmarks/list' and p.get('have') == '1,2']):
+                break
+            time.sleep(0.01)
+        else:
+            raise AssertionError("Next page was not requested: %s" % stub.requests)
+        rest = list(bookmarks)
+        assert [(f, b.bookmark_id) for f, b in rest] == \
+            [('unread', 2), ('unread', 3), ('unread', 4), ('unread', 5), (100, 101), (100, 102), (100, 103)]
+        pages = [(p['folder_id'], p.get('have')) for e, p in stub.requests if e == 'bookmarks/list' and p['limit'] == '2']
+        assert pages == [('unread', None), ('unread', '1,2'), ('unread', '1,2,3,4'), ('archive', None),
+                         ('100', None), ('100', '101,102')]
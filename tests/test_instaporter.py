@@ -16,3 +16,23 @@
 ##    You should have received a copy of the GNU General Public License
 
 # pylint: disable=C0103,W0142
+
+import os
+import sys
+import subprocess
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+
+def test_lazy_imports():
+    """ Importing instaporter.instaporter must not import optional or command-specific modules. """
+    code = ("import sys, instaporter.instaporter\n"
+            "print(' '.join(sorted(sys.modules)))")
+    out = subprocess.check_output([sys.executable, "-c", code], cwd=os.path.dirname(testsdir),
+                                  universal_newlines=True)
+    modules = set(out.split())
+    for name in ('ezfetcher', 'pyzotero', 'tkinter', 'instaporter.zotero_utils', 'instaporter.clipboard',
+                 'instaporter.server', 'instaporter.pipeline', 'instaporter.upload_queue', 'instaporter.text_cache'):
+        assert name not in modules, name
+
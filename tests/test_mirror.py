@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the local bookmark mirror.
+"""
+
+import os
+import sys
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.mirror import BookmarkMirror, make_have_string
+from instapaper_stub import InstapaperStub, make_bookmark
+
+
+def test_make_have_string():
+    rows = [(1, None, None, None), (2, 'abc', None, None), (3, 'def', 0.5, 1288584076)]
+    assert make_have_string(rows) == "1,2:abc,3:def:0.5:1288584076"
+
+
+def test_mirror_incremental_sync():
+    """ Initial sync gets everything; re-sync only gets changes and applies delete_ids. """
+    with InstapaperStub() as stub:
+        stub.server.bookmarks['unread'] = [make_bookmark(i) for i in range(1, 13)]
+        stub.server.bookmarks['100'] = [make_bookmark(50)]
+        client = InstapaperClient(stub.config(), *stub.consumer_keys)
+        mirror = BookmarkMirror(client, ':memory:', batch=5)
+        stats = mirror.sync()
+        assert stats['unread'] == {'updated': 12, 'deleted': 0, 'requests': 3}
+        assert stats['100']['updated'] == 1
+        assert len(mirror.bookmarks('unread')) == 12
+        assert [hl['highlight_id'] for hl in mirror.highlights(1)] == [11]
+
+        # Change one bookmark and remove another:
+        unread = stub.server.bookmarks['unread']
+        unread[2] = make_bookmark(3, hash='changed', title="Changed")
+        del unread[5]
+        n_before = len(stub.requests)
+        stats = mirror.sync()
+        assert stats['unread'] == {'updated': 1, 'deleted': 1, 'requests': 1}
+        assert stats['100'] == {'updated': 0, 'deleted': 0, 'requests': 1}
+        # folders/list + one request per folder:
+        assert len(stub.requests) - n_before == 1 + 4
+        bookmarks = {b['bookmark_id']: b for b in mirror.bookmarks('unread')}
+        assert len(bookmarks) == 11 and 6 not in bookmarks
+        assert bookmarks[3]['title'] == "Changed"
+        # The already-mirrored highlight is passed in the 'highlights' parameter:
+        last_unread_params = [params for endpoint, params in stub.requests
+                              if endpoint == 'bookmarks/list' and params.get('folder_id') == 'unread'][-1]
+        assert last_unread_params['highlights'] == '11'
+        mirror.close()
+
+
+def test_mirror_removes_deleted_folders():
+    """ Bookmarks and highlights in folders that were deleted on the server are removed. """
+    with InstapaperStub() as stub:
+        stub.server.bookmarks['100'] = [make_bookmark(50)]
+        stub.server.highlights[50] = [{'type': 'highlight', 'highlight_id': 500, 'bookmark_id': 50,
+                                       'text': "text", 'position': 0}]
+        client = InstapaperClient(stub.config(), *stub.consumer_keys)
+        mirror = BookmarkMirror(client, ':memory:')
+        mirror.sync()
+        assert len(mirror.bookmarks('100')) == 1 and len(mirror.highlights(50)) == 1
+        n_unread = len(mirror.bookmarks('unread'))
+        assert n_unread > 0
+        stub.server.folders = []
+        stats = mirror.sync()
+        assert '100' not in stats and mirror.folder_ids() == ['unread', 'starred', 'archive']
+        assert mirror.bookmarks('100') == [] and mirror.highlights(50) == []
+        # The built-in folders are kept:
+        assert len(mirror.bookmarks('unread')) == n_unread
+        mirror.close()
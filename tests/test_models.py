@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the typed API response objects and the incremental json parser.
+"""
+
+import os
+import sys
+import json
+import tempfile
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.models import from_json, parse_stream, Bookmark, BookmarkList, User, Error, json_default
+from instaporter.instapaper import InstapaperClient
+from instapaper_stub import InstapaperStub
+
+
+LISTING = {
+    "user": {"type": "user", "user_id": 42, "username": "stubuser"},
+    "bookmarks": [{"type": "bookmark", "bookmark_id": 1000 + i, "url": "http://example.com/%s" % i,
+                   "title": "Æble \"%s\" – \U0001F34E" % i, "description": "", "time": 1400000000 + i,
+                   "starred": str(i % 2), "private_source": "", "hash": "h%s" % i, "progress": 0.5,
+                   "progress_timestamp": 1400000100, "new_field": [i]} for i in range(20)],
+    "highlights": [{"type": "highlight", "highlight_id": 11, "bookmark_id": 1000, "text": "x\ny",
+                    "note": None, "position": 0, "time": 1400000000}],
+    "delete_ids": "7,8, 9",
+}
+
+
+def test_typed_objects_behave_like_the_json_dicts():
+    listing = from_json(json.loads(json.dumps(LISTING)))
+    assert isinstance(listing, BookmarkList) and isinstance(listing.user, User)
+    bookmark = listing.bookmarks[1]
+    assert isinstance(bookmark, Bookmark) and not hasattr(bookmark, '__dict__')
+    assert bookmark.bookmark_id == bookmark['bookmark_id'] == 1001
+    assert bookmark['type'] == 'bookmark' and bookmark.get('nope', 'x') == 'x' and 'hash' in bookmark
+    assert bookmark['new_field'] == [1] and bookmark.is_starred and not listing.bookmarks[0].is_starred
+    assert bookmark.added.year == 2014
+    assert listing.deleted == [7, 8, 9] and listing['delete_ids'] == "7,8, 9"
+    assert listing.highlights[0].created is not None
+    # Round trip and json serialization:
+    assert listing.to_dict() == LISTING and listing == LISTING
+    assert json.loads(json.dumps(listing, default=json_default)) == LISTING
+    # Missing fields are None, but not keys:
+    partial = from_json([{"type": "bookmark", "bookmark_id": 1}])[0]
+    assert partial.title is None and 'title' not in partial and partial.keys() == ['type', 'bookmark_id']
+    error = from_json([{"type": "error", "error_code": 1240, "message": "Invalid URL specified"}])[0]
+    assert isinstance(error, Error) and error.error_code == 1240
+
+
+def test_stream_parser_matches_json_loads_for_any_chunking():
+    for data in (LISTING, [{"type": "folder", "folder_id": 100, "position": 1.5}], [], {"delete_ids": ""}, 12345):
+        body = json.dumps(data, ensure_ascii=False, indent=1).encode('utf-8')
+        expected = from_json(json.loads(body.decode('utf-8')))
+        for size in (1, 2, 3, 7, 64, len(body) + 1):
+            chunks = [body[i:i+size] for i in range(0, len(body), size)]
+            assert parse_stream(chunks) == expected, (size, data)
+    try:
+        parse_stream([b'{"bookmarks": [1, 2'])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("Truncated json should raise ValueError.")
+    # Streamed bookmarks/list through the client:
+    with InstapaperStub() as stub:
+        config = stub.config(token_cache_filepath=os.path.join(tempfile.mkdtemp(), "tokens.json"))
+        client = InstapaperClient(config, *stub.consumer_keys)
+        listing = client.list_bookmarks(limit=3)
+        assert isinstance(listing, BookmarkList) and client.status
+        assert [b.bookmark_id for b in listing.bookmarks] == [1, 2, 3]
+        client.stream_listings = False
+        assert client.list_bookmarks(limit=3) == listing
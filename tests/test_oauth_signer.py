@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the fast OAuth signer, which must produce exactly the same
+Authorization headers as oauthlib.
+"""
+
+import os
+import sys
+import pytest
+import requests
+from oauthlib.oauth1 import Client
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter.oauth_signer import HmacSha1Signer, FastOAuth1
+from instaporter.xauth_session import XAuthSession
+
+
+# (uri, form-encoded body) test vectors:
+VECTORS = [
+    ('https://www.instapaper.com/api/1.1/bookmarks/add',
+     'url=http%3A%2F%2Fwww.nature.com%2Fa%3Fb%3Dc&title=Hello+W%C3%B8rld%21&content=%3Cp%3E~*%27%28%29%3C%2Fp%3E'),
+    ('https://WWW.Instapaper.com:443/api/1.1/bookmarks/list', 'limit=500&have=1%3Aabc%2C2&folder_id=unread&x=&x=a'),
+    ('http://127.0.0.1:8123/api/1.1/account/verify_credentials', ''),
+    ('http://127.0.0.1:8123/api/1.1/oauth/access_token?a=1&b=%20x',
+     'x_auth_username=me%40example.com&x_auth_password=p%26w+d&x_auth_mode=client_auth'),
+    ('http://[::1]:80/p ath', 'a=b&c'),
+]
+
+
+@pytest.mark.parametrize('tokens', [(None, None), ('tok~en', 'sec ret&')])
+def test_signatures_match_oauthlib(tokens):
+    signer = HmacSha1Signer('ck', 'cs&x', *tokens)
+    for uri, body in VECTORS:
+        client = Client('ck', 'cs&x', resource_owner_key=tokens[0], resource_owner_secret=tokens[1],
+                        nonce='123nonce 1', timestamp='1400000000')
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'} if body else {}
+        _, headers, _ = client.sign(uri, 'POST', body=body or None, headers=headers)
+        assert signer.sign('POST', uri, body, nonce='123nonce 1', timestamp='1400000000') == headers['Authorization']
+    with pytest.raises(ValueError):
+        signer.sign('POST', VECTORS[0][0], 'a=b%zz')
+
+
+def test_session_with_fast_signer_matches_oauthlib_session():
+    requests_ = []
+    for fast in (False, True):
+        session = XAuthSession('ck', 'cs')
+        assert session.enable_fast_signer(fast) is fast
+        session._populate_attributes({'oauth_token': 'tok', 'oauth_token_secret': 'sec'})    # pylint: disable=W0212
+        assert isinstance(session.auth, FastOAuth1) is fast
+        request = requests.Request('POST', VECTORS[0][0], data={'title': 'Hello Wørld!', 'limit': 25})
+        requests_.append(session.prepare_request(request))
+    # Nonces and timestamps differ, but the signed parameters are the same:
+    headers = [r.headers['Authorization'] for r in requests_]
+    headers = [h.decode('utf-8') if isinstance(h, bytes) else h for h in headers]
+    plain, fast = [dict(part.split('=', 1) for part in header[6:].split(', ')) for header in headers]
+    assert plain.keys() == fast.keys()
+    assert plain['oauth_token'] == fast['oauth_token'] == '"tok"'
+    assert requests_[0].body.decode('utf-8') == requests_[1].body
+    assert requests_[1].headers['Content-Type'] == 'application/x-www-form-urlencoded'
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the staged worker pipeline.
+"""
+
+import os
+import sys
+import time
+import threading
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter import instaporter
+from instaporter.instapaper import InstapaperClient
+from instaporter.pipeline import Pipeline
+from instapaper_stub import InstapaperStub, make_bookmark
+
+
+def test_pipeline_results_and_duplicates():
+    """ All unique items are processed once; duplicates are skipped; errors are recorded. """
+    calls = []
+    lock = threading.Lock()
+    def fetch(url):
+        with lock:
+            calls.append(url)
+        if 'bad' in url:
+            raise ValueError("bad url")
+        return url.upper()
+    pipeline = Pipeline([('fetch', fetch, 3), ('rewrite', lambda s: s + "!", 2), ('upload', len, 1)],
+                        queue_size=2)
+    urls = ["http://a", "http://b", " http://a", "http://bad", "http://c"]
+    results = pipeline.run(urls)
+    assert sorted(calls) == sorted(["http://a", "http://b", "http://bad", "http://c"])
+    assert pipeline.duplicates == 1
+    assert results["http://a"] == {'status': 'ok', 'result': len("HTTP://A!")}
+    assert results["http://bad"]['status'] == 'error'
+    assert results["http://bad"]['stage'] == 'fetch'
+
+
+def test_pipeline_stages_overlap():
+    """ Wall-clock time should track the slowest stage, not the sum of the stages. """
+    delay = 0.05
+    def slow(value):
+        time.sleep(delay)
+        return value
+    n = 8
+    pipeline = Pipeline([('fetch', slow, 1), ('rewrite', slow, 1), ('upload', slow, 1)], queue_size=2)
+    t0 = time.time()
+    results = pipeline.run(range(n))
+    elapsed = time.time() - t0
+    assert all(res['status'] == 'ok' for res in results.values())
+    # Sequential would take 3*n*delay; pipelined takes about (n+2)*delay.
+    assert elapsed < 2*n*delay
+
+
+def test_transport_urls_reports_failed_uploads(monkeypatch):
+    """ API errors from bookmarks/add are failed results, for one url as well as for many. """
+    class FakeResponse(object):
+        text = "<html><body><p>Hello</p></body></html>"
+    monkeypatch.setattr(instaporter, 'fetch_url', lambda url, args, ezclient=None:
+                        (FakeResponse(), {'url': url, 'html': {'title': url}}))
+    monkeypatch.setattr(instaporter, 'transport_attachments', lambda *args, **kwargs: None)
+    with InstapaperStub() as stub:
+        stub.server.overrides['bookmarks/add'] = lambda params: (
+            (400, [{'type': 'error', 'error_code': 1240, 'message': "Invalid URL specified"}])
+            if 'bad' in params['title'] else (200, [make_bookmark(1000, title=params['title'])]))
+        client = InstapaperClient(stub.config(), *stub.consumer_keys)
+        args = {'upload_workers': 1}
+        results = instaporter.transport_urls(client, ["http://a/ok", "http://a/bad"], args, ezclient=object())
+        assert results["http://a/ok"]['status'] == 'ok'
+        assert results["http://a/bad"]['status'] == 'error' and results["http://a/bad"]['stage'] == 'upload'
+        assert '1240' in str(results["http://a/bad"]['error'])
+        results = instaporter.transport_urls(client, ["http://a/bad"], args, ezclient=object())
+        assert results["http://a/bad"]['status'] == 'error'
+        results = instaporter.transport_urls(client, ["http://a/ok"], args, ezclient=object())
+        assert results["http://a/ok"]['status'] == 'ok'
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for rate limiting and retries.
+"""
+
+import os
+import sys
+import time
+import requests
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.ratelimit import TokenBucket, AIMDController
+from instapaper_stub import InstapaperStub, make_bookmark
+
+
+def test_token_bucket_and_aimd():
+    bucket = TokenBucket(rate=50, capacity=5)
+    t0 = time.monotonic()
+    for _ in range(15):
+        bucket.acquire()
+    # 5 tokens burst, then 10 more at 50/s:
+    assert 0.15 < time.monotonic() - t0 < 1
+    controller = AIMDController(initial=8, maximum=10)
+    controller.on_throttle()
+    controller.on_throttle()
+    assert controller.limit == 2
+    for _ in range(2 + 3):
+        controller.on_success()
+    assert controller.limit == 4
+
+
+def test_client_retries_rate_limit_and_service_errors():
+    with InstapaperStub() as stub:
+        errors = [(400, [{"type": "error", "error_code": 1040, "message": "Rate-limit exceeded"}]),
+                  (503, "Service unavailable"),
+                  (400, [{"type": "error", "error_code": 1500, "message": "Error in the service"}])]
+        def star(params):
+            if errors:
+                return errors.pop(0)
+            return 200, [make_bookmark(int(params['bookmark_id']), starred="1")]
+        stub.server.overrides['bookmarks/star'] = star
+        client = InstapaperClient(stub.config(api_backoff_base=0.01, api_max_concurrency=4), *stub.consumer_keys)
+        result = client.star_bookmark(1)
+        assert result[0]['starred'] == "1"
+        assert client.retries == 3
+        assert client.concurrency.throttles == 2    # 1040 and 503; 1500 is not a rate limit.
+        # Non-temporary errors are not retried:
+        stub.server.overrides['bookmarks/star'] = lambda params: (
+            400, [{"type": "error", "error_code": 1241, "message": "Invalid bookmark"}])
+        n_requests = len(stub.requests)
+        assert client.star_bookmark(1)[0]['error_code'] == 1241
+        assert len(stub.requests) == n_requests + 1
+        # Neither are per-request service errors, like 1550 for get_text of a video:
+        stub.server.overrides['bookmarks/get_text'] = lambda params: (
+            400, [{"type": "error", "error_code": 1550, "message": "Error generating text version"}])
+        n_requests = len(stub.requests)
+        assert not client.get_bookmark_text(1).startswith('<html')
+        assert len(stub.requests) == n_requests + 1
+
+
+def test_timeouts_are_only_retried_for_idempotent_endpoints():
+    with InstapaperStub() as stub:
+        client = InstapaperClient(stub.config(api_backoff_base=0.01, api_max_retries=2), *stub.consumer_keys)
+        calls = []
+
+        def post(url, error=requests.exceptions.ReadTimeout, **kwargs):
+            calls.append(url)
+            raise error("timed out")
+
+        client.session.post = post
+        for endpoint, expected in (('bookmarks/add', 1), ('bookmarks/delete', 1), ('folders/add', 1),
+                                   ('bookmarks/star', 3), ('bookmarks/list', 3), ('bookmarks/12/highlights', 3)):
+            del calls[:]
+            try:
+                client.post(endpoint, data={'bookmark_id': 12})
+            except requests.exceptions.ReadTimeout:
+                pass
+            else:
+                raise AssertionError("Timeout was not raised.")
+            assert len(calls) == expected, (endpoint, calls)
+        # A connect timeout means the request was not sent, so it is always retried:
+        del calls[:]
+        client.session.post = lambda url, **kwargs: post(url, error=requests.exceptions.ConnectTimeout)
+        try:
+            client.post('bookmarks/add', data={'url': 'http://example.com'})
+        except requests.exceptions.ConnectTimeout:
+            pass
+        assert len(calls) == 3
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the resident server and the bin/instap_client.py client.
+"""
+
+import os
+import sys
+import json
+import stat
+import socket
+import http.client
+import threading
+import pytest
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir), "bin"))
+
+from instaporter.server import JobRunner, make_server, write_token
+import instap_client
+
+
+TOKEN = "secret-token"
+
+
+def run_server(tmpdir, socket_path=None):
+    """ Start server with a fake url handler. Returns (server, list of transported urls). """
+    transported = []
+    def transport(urls):
+        if "http://fail" in urls:
+            raise ValueError("Could not download")
+        transported.extend(urls)
+        return {url: {'status': 'ok'} for url in urls}
+    runner = JobRunner({'url': transport, 'file': transport}, workers=2)
+    server = make_server(runner, port=0, socket_path=socket_path, stats_func=lambda: {'username': "stubuser"},
+                         token=TOKEN)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, transported
+
+
+def test_server_over_loopback_http(tmpdir):
+    server, transported = run_server(tmpdir)
+    kwargs = {'port': server.server_address[1], 'token': TOKEN}
+    status, job = instap_client.request('POST', '/url', {'urls': ["http://a", "http://b"], 'wait': True}, **kwargs)
+    assert status == 200 and job['status'] == 'done'
+    assert transported == ["http://a", "http://b"]
+    status, job = instap_client.request('POST', '/url', {'urls': "http://fail", 'wait': True}, **kwargs)
+    assert job['status'] == 'error' and "Could not download" in job['error']
+    status, job = instap_client.request('POST', '/url', {'urls': ["http://c"]}, **kwargs)
+    assert status == 202
+    server.runner.wait(job['job_id'])
+    assert instap_client.request('GET', '/jobs/%s' % job['job_id'], **kwargs)[1]['status'] == 'done'
+    status, info = instap_client.request('GET', '/status', **kwargs)
+    assert info['jobs'] == {'done': 2, 'error': 1} and info['username'] == "stubuser"
+    assert instap_client.request('POST', '/nothing', {'files': ["a.html"]}, **kwargs)[0] == 404
+    instap_client.request('POST', '/shutdown', {}, **kwargs)
+    server.server_close()
+
+
+@pytest.mark.skipif(not hasattr(socket, 'AF_UNIX'), reason="Unix sockets not available")
+def test_server_over_unix_socket_and_client_main(tmpdir, capsys):
+    socket_path = str(tmpdir.join("instaporter.sock"))
+    token_file = str(tmpdir.join("serve_token"))
+    server, transported = run_server(tmpdir, socket_path=socket_path)
+    assert instap_client.main(['--socket', socket_path, '--token_file', token_file, "http://a"]) == 1
+    server.token = write_token(token_file)
+    assert stat.S_IMODE(os.stat(token_file).st_mode) == 0o600
+    assert instap_client.main(['--socket', socket_path, '--token_file', token_file, '--wait', "http://a"]) == 0
+    assert transported == ["http://a"]
+    assert '"status": "done"' in capsys.readouterr().out
+    server.shutdown()
+    server.server_close()
+    # Exit status 2 if the server is not running:
+    assert instap_client.main(['--socket', socket_path, "http://a"]) == 2
+
+
+def test_server_refuses_requests_from_web_pages(tmpdir):
+    """ Cross-origin, rebound-host, non-json and token-less requests are refused and no job is run. """
+    server, transported = run_server(tmpdir)
+    body = json.dumps({'files': ["/etc/passwd"], 'wait': True})
+    good = {'Content-Type': 'application/json', 'X-Instaporter-Token': TOKEN}
+    cases = [
+        # What a web page can send without a preflight:
+        {'Content-Type': 'text/plain', 'Origin': "https://evil.example", 'Host': "evil.example"},
+        {'Content-Type': 'text/plain', 'X-Instaporter-Token': TOKEN},
+        dict(good, Origin="https://evil.example"),
+        dict(good, Host="evil.example:%s" % server.server_address[1]),
+        {'Content-Type': 'application/json'},
+        dict(good, **{'X-Instaporter-Token': "guess"}),
+    ]
+    for headers in cases:
+        conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+        conn.request('POST', '/file', body=body, headers=headers)
+        response = conn.getresponse()
+        assert response.status in (403, 415), headers
+        conn.close()
+    conn = http.client.HTTPConnection('127.0.0.1', server.server_address[1], timeout=5)
+    conn.request('GET', '/status', headers={'Origin': "https://evil.example"})
+    assert conn.getresponse().status == 403
+    conn.close()
+    assert transported == [] and server.runner.status()['jobs'] == {}
+    status, job = instap_client.request('POST', '/file', {'files': ["a.html"], 'wait': True},
+                                        port=server.server_address[1], token=TOKEN)
+    assert status == 200 and transported == ["a.html"]
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the session state store.
+"""
+
+import os
+import sys
+import tempfile
+import threading
+import requests
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter.state_store import StateStore
+from instaporter.instapaper import InstapaperClient
+from instaporter.utils import save_config
+
+
+def test_concurrent_updates_and_writes_only_on_change():
+    filepath = os.path.join(tempfile.mkdtemp(), "state.json")
+    # Separate stores (as in separate processes) updating the same file:
+    def worker(i):
+        store = StateStore(filepath)
+        for j in range(20):
+            store.update('stamps', {'%s-%s' % (i, j): j})
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store = StateStore(filepath)
+    assert len(store.get('stamps')) == 80
+    assert store.update('stamps', {'0-0': 0}) is False
+    assert store.update('stamps', {'0-0': None}) is True
+    assert store.writes == 1 and len(store.get('stamps')) == 79
+    assert not [name for name in os.listdir(os.path.dirname(filepath)) if name.endswith('.tmp')]
+    # save_config skips unchanged configs:
+    config_filepath = os.path.join(os.path.dirname(filepath), "config.yaml")
+    assert save_config({'a': 1}, config_filepath) is True
+    assert save_config({'a': 1}, config_filepath) is False
+
+
+def test_cookies_round_trip():
+    filepath = os.path.join(tempfile.mkdtemp(), "state.json")
+    client = InstapaperClient({'instapaper_login_prompt': False, 'cookies_filepath': filepath}, 'key', 'secret')
+    client.cookies.set('session', 'abc', domain='www.instapaper.com', path='/')
+    client.save_cookies()
+    client = InstapaperClient({'instapaper_login_prompt': False, 'cookies_filepath': filepath}, 'key', 'secret')
+    assert client.cookies.get('session', domain='www.instapaper.com') == 'abc'
+    assert isinstance(client.cookies, requests.cookies.RequestsCookieJar)
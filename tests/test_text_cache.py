@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the bookmark text cache.
+"""
+
+import os
+import sys
+import zlib
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.text_cache import TextCache, prefetch_texts
+from instapaper_stub import InstapaperStub
+
+
+def test_text_cache_hash_and_lru_eviction():
+    texts = {i: os.urandom(1000).hex() for i in range(1, 5)}
+    size = len(zlib.compress(texts[1].encode('utf-8'), 6))
+    # Room for three texts, but not four:
+    cache = TextCache(':memory:', max_bytes=int(3.5*size))
+    for bid, text in list(texts.items())[:3]:
+        cache.put(bid, 'h%s' % bid, text)
+    assert cache.get(1, 'h1') == texts[1]
+    assert cache.get(1, 'other-hash') is None
+    # Bookmark 2 is now the least recently used, and is evicted first:
+    cache.put(4, 'h4', texts[4])
+    assert 2 not in cache
+    assert 1 in cache and 3 in cache and 4 in cache
+    assert cache.total_bytes <= cache.max_bytes
+
+
+def test_prefetch_and_cached_get_bookmark_text():
+    with InstapaperStub() as stub:
+        client = InstapaperClient(stub.config(), *stub.consumer_keys)
+        client.text_cache = TextCache(':memory:')
+        stats = prefetch_texts(client, 'unread', workers=3)
+        assert stats == {'cached': 0, 'fetched': 5, 'failed': 0}
+        assert prefetch_texts(client, 'unread')['cached'] == 5
+        n_requests = len(stub.requests)
+        assert client.get_bookmark_text(2, 'h2') == "<html><body>Text of 2</body></html>"
+        assert len(stub.requests) == n_requests
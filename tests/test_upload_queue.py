@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the durable upload queue.
+"""
+
+import os
+import sys
+import time
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+sys.path.insert(0, testsdir)
+
+from instaporter.instapaper import InstapaperClient
+from instaporter.upload_queue import UploadQueue, drain_queue
+from instapaper_stub import InstapaperStub
+
+
+def test_leases_and_idempotent_completion(tmpdir):
+    filepath = str(tmpdir.join("uploads.sqlite"))
+    # Two queues on the same file, as if in two processes:
+    queue_a = UploadQueue(filepath, lease_seconds=0.2, max_attempts=2, retry_delay=0)
+    queue_b = UploadQueue(filepath, lease_seconds=0.2)
+    job_id = queue_a.enqueue({'title': "A", 'content': "<p>a</p>"}, key="http://a")
+    assert queue_a.enqueue({'title': "A2", 'content': "<p>a</p>"}, key="http://a") == job_id
+    [job] = queue_a.claim("worker-a")
+    assert job.payload['title'] == "A2"
+    assert queue_b.claim("worker-b") == []
+    time.sleep(0.3)
+    # Lease expired; worker b takes over, and the failure of worker a is ignored:
+    [job_b] = queue_b.claim("worker-b")
+    assert job_b.job_id == job_id and job_b.attempts == 2
+    queue_a.fail(job, "too slow")
+    assert queue_a.counts()['leased'] == 1
+    assert queue_b.complete(job_b, result=1000)
+    assert not queue_a.complete(job)
+    assert queue_a.counts() == {'pending': 0, 'leased': 0, 'done': 1, 'failed': 0}
+    # Failed uploads are retried until max_attempts:
+    queue_a.enqueue({'title': "B"}, key="http://b")
+    assert queue_a.fail(queue_a.claim("worker-a")[0], "error") == 'pending'
+    assert queue_a.fail(queue_a.claim("worker-a")[0], "error") == 'failed'
+    assert queue_a.claim("worker-a") == []
+    queue_a.close()
+    queue_b.close()
+
+
+def test_drain_queue():
+    with InstapaperStub() as stub:
+        client = InstapaperClient(stub.config(api_backoff_base=0.01, api_max_retries=0), *stub.consumer_keys)
+        queue = UploadQueue(':memory:', retry_delay=60)
+        for i in range(6):
+            queue.enqueue({'title': "T%s" % i, 'content': "<p>%s</p>" % i, 'is_private_from_source': "test"},
+                          key="http://example.com/%s" % i)
+        added = []
+        def add(params):
+            added.append(params['title'])
+            if params['title'] == "T3":
+                return 400, [{"type": "error", "error_code": 1240, "message": "Invalid URL specified"}]
+            return 200, [{"type": "bookmark", "bookmark_id": 1000 + len(added), "title": params['title']}]
+        stub.server.overrides['bookmarks/add'] = add
+        stats = drain_queue(queue, client, workers=3)
+        assert stats == {'done': 5, 'retry': 1, 'failed': 0}
+        assert sorted(added) == ["T%s" % i for i in range(6)]
+        # The failed job is kept for a later drain:
+        assert queue.counts() == {'pending': 1, 'leased': 0, 'done': 5, 'failed': 0}
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2015 Rasmus Sorensen, rasmusscholer@gmail.com <scholer.github.io>
+
+##    This program is free software: you can redistribute it and/or modify
+##    it under the terms of the GNU General Public License as published by
+##    the Free Software Foundation, either version 3 of the License, or
+##    (at your option) any later version.
+##
+##    This program is distributed in the hope that it will be useful,
+##    but WITHOUT ANY WARRANTY; without even the implied warranty of
+##    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+##    GNU General Public License for more details.
+##
+##    You should have received a copy of the GNU General Public License
+
+# pylint: disable=C0103,W0142
+
+
+"""
+Test module for the utils module.
+"""
+
+import os
+import sys
+import time
+import threading
+import tempfile
+
+testsdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(testsdir)))
+
+from instaporter import utils
+
+
+def test_load_yaml_uses_cache_until_file_changes(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    monkeypatch.setattr(utils, 'CONFIG_CACHE_FILEPATH', os.path.join(tmpdir, "config.cache"))
+    filepath = os.path.join(tmpdir, "config.yaml")
+    with open(filepath, 'w') as fd:
+        fd.write("download_pdf: [www.nature.com, pubs.acs.org]\nfetch_workers: 4\n")
+    assert utils.load_config(filepath) == {'download_pdf': ['www.nature.com', 'pubs.acs.org'], 'fetch_workers': 4}
+    # The cached data is used while the file is unchanged:
+    parsed = []
+    monkeypatch.setattr(utils.yaml, 'load', lambda *args, **kwargs: parsed.append(args) or {'parsed': True})
+    assert utils.load_config(filepath)['fetch_workers'] == 4
+    assert parsed == []
+    with open(filepath, 'w') as fd:
+        fd.write("fetch_workers: 8\n")
+    os.utime(filepath, ns=(0, 10**9))
+    assert utils.load_config(filepath) == {'parsed': True}
+
+
+def test_config_loader_reload_if_changed(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    monkeypatch.setattr(utils, 'CONFIG_CACHE_FILEPATH', os.path.join(tmpdir, "config.cache"))
+    filepath = os.path.join(tmpdir, "config.yaml")
+    with open(filepath, 'w') as fd:
+        fd.write("fetch_workers: 4\n")
+    loader = utils.ConfigLoader(filepath, {'loglevel': 'INFO', 'upload_workers': None})
+    config = loader.config
+    assert config == {'fetch_workers': 4, 'loglevel': 'INFO'}
+    assert loader.reload_if_changed() is False
+    with open(filepath, 'w') as fd:
+        fd.write("fetch_workers: 16\n")
+    os.utime(filepath, ns=(0, 10**9))
+    assert loader.reload_if_changed() is True
+    assert config == {'fetch_workers': 16, 'loglevel': 'INFO'}
+
+
+def test_config_loader_reloads_between_jobs(monkeypatch):
+    tmpdir = tempfile.mkdtemp()
+    monkeypatch.setattr(utils, 'CONFIG_CACHE_FILEPATH', os.path.join(tmpdir, "config.cache"))
+    filepath = os.path.join(tmpdir, "config.yaml")
+    with open(filepath, 'w') as fd:
+        fd.write("fetch_workers: 4\nhttp_timeout: 10\n")
+    reloaded = []
+    loader = utils.ConfigLoader(filepath, {}, on_reload=[lambda config: reloaded.append(dict(config))])
+    config = loader.config
+    assert reloaded == [{'fetch_workers': 4, 'http_timeout': 10}]
+    # Keys added at runtime (e.g. by the client) are kept:
+    config['access_tokens'] = {'oauth_token': 'x'}
+    running, seen = threading.Event(), []
+
+    def job():
+        with loader.job() as job_config:
+            running.set()
+            time.sleep(0.2)
+            seen.append(dict(job_config))
+
+    thread = threading.Thread(target=job)
+    thread.start()
+    running.wait()
+    with open(filepath, 'w') as fd:
+        fd.write("fetch_workers: 16\n")
+    os.utime(filepath, ns=(0, 10**9))
+    # The next job waits for the running job to finish before the config is reloaded:
+    with loader.job():
+        assert seen == [{'fetch_workers': 4, 'http_timeout': 10, 'access_tokens': {'oauth_token': 'x'}}]
+        assert config == {'fetch_workers': 16, 'access_tokens': {'oauth_token': 'x'}}
+    thread.join()
+    assert len(reloaded) == 2 and reloaded[1] == config